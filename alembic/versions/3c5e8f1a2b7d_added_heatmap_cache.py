@@ -0,0 +1,39 @@
+"""Added heatmap cache
+
+Revision ID: 3c5e8f1a2b7d
+Revises: de60cf83e127
+Create Date: 2026-10-18 21:37:12.804316
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+
+# revision identifiers, used by Alembic.
+revision = '3c5e8f1a2b7d'
+down_revision = 'de60cf83e127'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'heatmap_cache',
+        sa.Column('id', sa.BigInteger(), autoincrement=True, nullable=False),
+        sa.Column('cache_key', sa.Text(), nullable=False),
+        sa.Column('h3_index', sa.BigInteger(), nullable=False),
+        sa.Column('accessibility', sa.Float(), nullable=True),
+        sa.Column('opportunity_count', sa.Integer(), nullable=True),
+        sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('cache_key', 'h3_index', name='unique_heatmap_cache_cell'),
+        schema='customer'
+    )
+    op.create_index('idx_heatmap_cache_created_at', 'heatmap_cache', ['created_at'], unique=False, schema='customer')
+
+
+def downgrade():
+    op.drop_index('idx_heatmap_cache_created_at', table_name='heatmap_cache', schema='customer')
+    op.drop_table('heatmap_cache', schema='customer')
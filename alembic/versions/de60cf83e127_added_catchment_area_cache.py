@@ -0,0 +1,40 @@
+"""Added catchment area cache
+
+Revision ID: de60cf83e127
+Revises: 8a4322891019
+Create Date: 2026-10-18 10:12:41.527310
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import geoalchemy2
+import sqlmodel
+
+
+
+# revision identifiers, used by Alembic.
+revision = 'de60cf83e127'
+down_revision = '8a4322891019'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'catchment_area_cache',
+        sa.Column('id', sa.BigInteger(), autoincrement=True, nullable=False),
+        sa.Column('cache_key', sa.Text(), nullable=False),
+        sa.Column('geom', geoalchemy2.types.Geometry(srid=4326, spatial_index=False, from_text='ST_GeomFromEWKT', name='geometry'), nullable=True),
+        sa.Column('integer_attr1', sa.Integer(), nullable=True),
+        sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        schema='customer'
+    )
+    op.create_index('idx_catchment_area_cache_cache_key', 'catchment_area_cache', ['cache_key'], unique=False, schema='customer')
+    op.create_index('idx_catchment_area_cache_created_at', 'catchment_area_cache', ['created_at'], unique=False, schema='customer')
+
+
+def downgrade():
+    op.drop_index('idx_catchment_area_cache_created_at', table_name='catchment_area_cache', schema='customer')
+    op.drop_index('idx_catchment_area_cache_cache_key', table_name='catchment_area_cache', schema='customer')
+    op.drop_table('catchment_area_cache', schema='customer')
@@ -0,0 +1,88 @@
+"""Benchmarks of the jsoline tracing, run from the repository root with
+`python -m scripts.benchmark_jsoline`."""
+
+import time
+
+import numpy as np
+from numba import get_num_threads, set_num_threads
+
+from src.jsoline import (
+    assign_holes,
+    calculate_jsolines,
+    get_band_index,
+    trace_isoline_rings,
+)
+from tests.unit.test_jsoline import assign_holes_brute_force
+
+
+def get_benchmark_surface(width, height, noise, seed=0):
+    """
+    Radial travel time surface in minutes. Noise fragments the isolines into many
+    shells and holes.
+    """
+    rng = np.random.default_rng(seed)
+    yy, xx = np.mgrid[0:height, 0:width]
+    surface = np.hypot(xx - width / 2, yy - height / 2) / width * 120
+    surface += rng.normal(0, noise, size=surface.shape)
+    return surface.clip(0, 65535).astype(np.uint16).ravel()
+
+
+def benchmark_calculate_jsolines(width=1200, height=1000, n_cutoffs=12, repeat=3):
+    """Time tracing the isolines of all cutoffs on a single thread."""
+
+    surface = get_benchmark_surface(width, height, noise=0.5)
+    cutoffs = np.linspace(60 / n_cutoffs, 60, n_cutoffs)
+    n_threads = get_num_threads()
+    set_num_threads(1)
+    # Compile before timing
+    calculate_jsolines(surface, width, height, 69700, 45300, 9, cutoffs)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        calculate_jsolines(surface, width, height, 69700, 45300, 9, cutoffs)
+    duration = (time.perf_counter() - start) / repeat
+    set_num_threads(n_threads)
+    print(f"calculate_jsolines {width}x{height}, {n_cutoffs} cutoffs: {duration:.3f}s")
+
+
+def benchmark_assign_holes(sizes=(100, 200, 400), repeat=3):
+    """
+    Time the hole assignment for a growing number of rings on a single thread,
+    indexed vs brute force.
+    """
+
+    n_threads = get_num_threads()
+    set_num_threads(1)
+    cutoffs = np.arange(10.0, 61, 10.0)
+    for size in sizes:
+        surface = get_benchmark_surface(size, size, noise=16)
+        coords, ring_offsets, ring_is_shell, cutoff_offsets = trace_isoline_rings(
+            get_band_index(surface, cutoffs),
+            surface,
+            size,
+            size,
+            69700,
+            45300,
+            9,
+            cutoffs,
+            np.arange(cutoffs.shape[0]),
+            True,
+            False,
+        )
+        durations = []
+        for function in (assign_holes_brute_force, assign_holes):
+            # Compile before timing
+            function(coords, ring_offsets, ring_is_shell, cutoff_offsets)
+            start = time.perf_counter()
+            for _ in range(repeat):
+                function(coords, ring_offsets, ring_is_shell, cutoff_offsets)
+            durations.append((time.perf_counter() - start) / repeat)
+        print(
+            f"assign_holes {size}x{size} ({ring_is_shell.shape[0]} rings): "
+            f"{durations[0]:.4f}s brute force, {durations[1]:.4f}s indexed"
+        )
+    set_num_threads(n_threads)
+
+
+if __name__ == "__main__":
+    benchmark_calculate_jsolines()
+    benchmark_assign_holes()
@@ -0,0 +1,173 @@
+"""
+Aggregate points on a H3 grid in memory.
+
+Points are added in batches. Each batch is reduced to partial statistics per H3
+cell and group, which are merged once all points were added. The statistics of
+a cell over all groups are merged from the partials of its groups, so the cell
+of each point is computed once.
+"""
+
+import warnings
+
+import numpy as np
+
+with warnings.catch_warnings():
+    # The vectorized bindings are part of the experimental API of h3 3.x
+    warnings.simplefilter("ignore")
+    from h3.unstable import vect
+
+# Operation merging the partial statistics of an operation
+MERGE_OPERATION = {"count": "sum", "sum": "sum", "min": "min", "max": "max"}
+
+
+def reduce_statistic(
+    index: np.ndarray, n: int, operation: str, values: np.ndarray
+) -> np.ndarray:
+    """
+    Reduce values to a statistic per index.
+
+    :param index: The index of each value, from 0 to n - 1.
+    :param operation: The statistic to compute, sum, min or max.
+    :return: The statistic of each index, undefined for indexes without values.
+    """
+    if operation == "sum":
+        if values.dtype.kind == "f":
+            return np.bincount(index, weights=values, minlength=n)
+        stats = np.zeros(n, dtype=values.dtype)
+        np.add.at(stats, index, values)
+        return stats
+    elif operation in ("min", "max"):
+        # Start from any value of the index
+        stats = np.zeros(n, dtype=values.dtype)
+        stats[index] = values
+        ufunc = np.minimum if operation == "min" else np.maximum
+        ufunc.at(stats, index, values)
+        return stats
+    else:
+        raise ValueError(f"Unsupported operation {operation}")
+
+
+class H3PointAggregation:
+    """Statistics of the points in each H3 cell, in total and per group."""
+
+    def __init__(
+        self, resolution: int, operation: str, dtype: np.dtype, n_groups: int = 1
+    ):
+        """
+        :param operation: The statistic to compute, count, sum, min or max.
+        :param dtype: The data type of the statistic.
+        :param n_groups: The number of groups, points are in group 0 if there is one.
+        """
+        if operation not in MERGE_OPERATION:
+            raise ValueError(f"Unsupported operation {operation}")
+        self.resolution = resolution
+        self.operation = operation
+        self.dtype = np.dtype(dtype)
+        self.n_groups = n_groups
+        self.partials = []
+
+    def reduce(
+        self,
+        h3_index: np.ndarray,
+        group_id: np.ndarray,
+        operation: str,
+        values: np.ndarray | None,
+        count: np.ndarray,
+    ) -> tuple:
+        """
+        Reduce the values of each cell and group.
+
+        :param count: The number of values represented by each value, 0 for NULL.
+        :return: The cell, group, statistic and count of each cell and group.
+        """
+        unique_h3_index, cell_index = np.unique(h3_index, return_inverse=True)
+        key = cell_index * self.n_groups + group_id
+        unique_key, key_index = np.unique(key, return_inverse=True)
+        n = len(unique_key)
+
+        key_count = np.bincount(key_index, weights=count, minlength=n).astype(np.int64)
+        if values is None:
+            stats = key_count.astype(self.dtype)
+        else:
+            has_values = count > 0
+            stats = reduce_statistic(
+                key_index[has_values], n, operation, values[has_values]
+            )
+        return (
+            unique_h3_index[unique_key // self.n_groups],
+            unique_key % self.n_groups,
+            stats,
+            key_count,
+        )
+
+    def add(
+        self,
+        lat: np.ndarray,
+        lng: np.ndarray,
+        valid: np.ndarray,
+        values: np.ndarray | None = None,
+        group_id: np.ndarray | None = None,
+    ):
+        """
+        Add a batch of points.
+
+        :param valid: Whether the value of each point is not NULL.
+        :param values: The values of the points, not needed to count them.
+        :param group_id: The group of each point.
+        """
+        h3_index = vect.geo_to_h3(
+            np.ascontiguousarray(lat, dtype=np.float64),
+            np.ascontiguousarray(lng, dtype=np.float64),
+            self.resolution,
+        ).view(np.int64)
+        self.partials.append(
+            self.reduce(
+                h3_index,
+                (
+                    np.zeros(len(h3_index), dtype=np.int64)
+                    if group_id is None
+                    else np.asarray(group_id, dtype=np.int64)
+                ),
+                self.operation,
+                None if values is None else np.asarray(values, dtype=self.dtype),
+                np.asarray(valid, dtype=np.int64),
+            )
+        )
+
+    def result(self) -> dict:
+        """
+        Merge the partial statistics of all points added.
+
+        :return: The integer H3 index, statistic and number of values of each cell,
+            and the same for each cell and group with its group id.
+        """
+        if not self.partials:
+            self.partials.append(
+                (
+                    np.empty(0, dtype=np.int64),
+                    np.empty(0, dtype=np.int64),
+                    np.empty(0, dtype=self.dtype),
+                    np.empty(0, dtype=np.int64),
+                )
+            )
+        h3_index, group_id, stats, count = (
+            np.concatenate(arrays) for arrays in zip(*self.partials, strict=True)
+        )
+        operation = MERGE_OPERATION[self.operation]
+        grouped = self.reduce(h3_index, group_id, operation, stats, count)
+        total = self.reduce(
+            grouped[0],
+            np.zeros(len(grouped[0]), dtype=np.int64),
+            operation,
+            grouped[2],
+            grouped[3],
+        )
+        return {
+            "h3_index": total[0],
+            "stats": total[2],
+            "count": total[3],
+            "grouped_h3_index": grouped[0],
+            "group_id": grouped[1],
+            "grouped_stats": grouped[2],
+            "grouped_count": grouped[3],
+        }
@@ -0,0 +1,120 @@
+import hashlib
+import json
+
+import h3
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.core.config import settings
+
+# Starting points are snapped to H3 cells of this resolution (~65 m edge length)
+CATCHMENT_AREA_CACHE_H3_RESOLUTION = 10
+
+# Keys of routing requests which alter the street network for a single request
+ROUTING_SCENARIO_KEYS = ["scenario_id", "street_network"]
+
+# Keys of routing requests which only define where the result is written to
+ROUTING_RESULT_KEYS = ["result_table", "layer_id"]
+
+
+class CatchmentAreaResultCache:
+    """Database store for the catchment area shapes computed by the routing service.
+
+    The routing service computes a single result for all starting points, so the
+    shapes are stored per request, keyed by a hash of the request payload.
+    """
+
+    def __init__(self, ttl: int):
+        self.ttl = ttl
+        self.table = f"{settings.CUSTOMER_SCHEMA}.catchment_area_cache"
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0
+
+    def get_key(self, request_payload: dict) -> str | None:
+        """Get the cache key of a routing request payload.
+
+        The starting points are snapped to H3 cells, so that repeated studies with
+        slightly moved starting points share a result.
+
+        :return: The key, or None if the request must not be cached.
+        """
+
+        if not self.enabled or any(
+            request_payload.get(key) for key in ROUTING_SCENARIO_KEYS
+        ):
+            return None
+
+        starting_points = request_payload["starting_points"]
+        canonical_payload = {
+            key: value
+            for key, value in request_payload.items()
+            if key not in ROUTING_SCENARIO_KEYS + ROUTING_RESULT_KEYS
+        } | {
+            "starting_points": sorted(
+                {
+                    h3.geo_to_h3(lat, lon, CATCHMENT_AREA_CACHE_H3_RESOLUTION)
+                    for lat, lon in zip(
+                        starting_points["latitude"],
+                        starting_points["longitude"],
+                        strict=True,
+                    )
+                }
+            ),
+            "network": [
+                str(settings.BASE_STREET_NETWORK),
+                settings.GOAT_ROUTING_NETWORK_VERSION,
+            ],
+        }
+        return hashlib.sha256(
+            json.dumps(canonical_payload, sort_keys=True, separators=(",", ":")).encode(
+                "utf-8"
+            )
+        ).hexdigest()
+
+    async def copy(
+        self, async_session: AsyncSession, key: str, result_table: str, layer_id: str
+    ) -> bool:
+        """Copy cached shapes into the result table.
+
+        :return: Whether the result was cached.
+        """
+
+        sql = f"""
+            INSERT INTO {result_table} (layer_id, geom, integer_attr1)
+            SELECT '{layer_id}', geom, integer_attr1
+            FROM {self.table}
+            WHERE cache_key = '{key}'
+            AND created_at > now() - INTERVAL '{self.ttl} seconds'
+            ORDER BY id;
+        """
+        result = await async_session.execute(sql)
+        await async_session.commit()
+        return result.rowcount > 0
+
+    async def put(
+        self, async_session: AsyncSession, key: str, result_table: str, layer_id: str
+    ):
+        """Store the shapes written to the result table and remove expired ones."""
+
+        sql_delete_expired = f"""
+            DELETE FROM {self.table}
+            WHERE created_at <= now() - INTERVAL '{self.ttl} seconds';
+        """
+        await async_session.execute(sql_delete_expired)
+        # Skip results which were stored by a concurrent job in the meantime
+        sql_insert = f"""
+            INSERT INTO {self.table} (cache_key, geom, integer_attr1)
+            SELECT '{key}', geom, integer_attr1
+            FROM {result_table}
+            WHERE layer_id = '{layer_id}'
+            AND NOT EXISTS (SELECT 1 FROM {self.table} WHERE cache_key = '{key}')
+            ORDER BY id;
+        """
+        await async_session.execute(sql_insert)
+        await async_session.commit()
+
+
+catchment_area_result_cache = CatchmentAreaResultCache(
+    ttl=settings.CATCHMENT_AREA_CACHE_TTL
+)
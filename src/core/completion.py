@@ -0,0 +1,114 @@
+import asyncio
+import contextlib
+import random
+from typing import AsyncIterator, Awaitable, Callable
+
+import asyncpg
+from httpx import Response
+
+from src.core.config import settings
+
+# Channel notified by basic.trigger_notify_user_data_insert with the layer_id of
+# rows the routing service inserted into temporal catchment area tables
+USER_DATA_INSERT_CHANNEL = "user_data_insert"
+
+
+def get_backoff_delay(attempt: int) -> float:
+    """Get the delay before a retry, growing exponentially from the min interval up
+    to the max interval, with jitter so that concurrent requests spread out."""
+
+    max_delay = min(
+        settings.CRUD_RETRY_INTERVAL,
+        settings.CRUD_RETRY_MIN_INTERVAL * 2**attempt,
+    )
+    return random.uniform(settings.CRUD_RETRY_MIN_INTERVAL, max_delay)
+
+
+async def request_until_complete(
+    send_request: Callable[[], Awaitable[Response]],
+    completed: asyncio.Future | None = None,
+) -> Response:
+    """Repeat a request while the endpoint is still processing it (status 202).
+
+    Between requests, wait with exponential backoff. If a completion future is
+    given, the next request is sent as soon as it is done.
+
+    :return: The first response which isn't a 202, or the last 202 response if
+    the endpoint didn't finish within the retry timeout.
+    """
+
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + settings.CRUD_RETRY_TIMEOUT
+    attempt = 0
+    while True:
+        response = await send_request()
+        if response.status_code != 202 or loop.time() >= deadline:
+            return response
+
+        delay = min(get_backoff_delay(attempt), max(deadline - loop.time(), 0))
+        if completed is None or completed.done():
+            # Completion was notified already, the endpoint is finishing up
+            await asyncio.sleep(delay)
+        else:
+            await asyncio.wait({completed}, timeout=delay)
+        attempt += 1
+
+
+class CompletionListener:
+    """Listens on a PostgreSQL channel and resolves the futures waiting for a
+    payload. All waiters share a single connection, which is opened on first use.
+    """
+
+    def __init__(self, channel: str):
+        self.channel = channel
+        self.connection: asyncpg.Connection | None = None
+        self.waiters: dict[str, set[asyncio.Future]] = {}
+        self.lock = asyncio.Lock()
+
+    async def connect(self):
+        async with self.lock:
+            if self.connection is not None and not self.connection.is_closed():
+                return
+            self.connection = await asyncpg.connect(
+                settings.POSTGRES_DATABASE_URI,
+                server_settings={"application_name": "GOAT Core Listener"},
+            )
+            await self.connection.add_listener(self.channel, self.notify)
+
+    def notify(self, connection, pid: int, channel: str, payload: str):
+        for future in self.waiters.pop(payload, set()):
+            if not future.done():
+                future.set_result(None)
+
+    @contextlib.asynccontextmanager
+    async def listen(self, payload: str) -> AsyncIterator[asyncio.Future]:
+        """Get a future which is done once the payload is notified.
+
+        Enter before sending the request, so that no notification is missed. If
+        listening fails, the future is never done and callers fall back to polling.
+        """
+
+        future = asyncio.get_running_loop().create_future()
+        try:
+            await self.connect()
+        except (OSError, asyncpg.PostgresError) as e:
+            print(f"Could not listen on {self.channel}: {e}")
+        else:
+            self.waiters.setdefault(payload, set()).add(future)
+        try:
+            yield future
+        finally:
+            waiters = self.waiters.get(payload)
+            if waiters is not None:
+                waiters.discard(future)
+                if not waiters:
+                    del self.waiters[payload]
+            future.cancel()
+
+    async def close(self):
+        if self.connection is not None:
+            await self.connection.close()
+            self.connection = None
+
+
+user_data_insert_listener = CompletionListener(USER_DATA_INSERT_CHANNEL)
@@ -0,0 +1,39 @@
+import numpy as np
+import shapely
+from sqlalchemy.ext.asyncio import AsyncSession
+
+
+class GeofenceCache:
+    """In-memory copy of the geofence tables, so that points can be checked
+    against a geofence without querying the database. Each table is loaded on
+    first use and merged into a single prepared geometry."""
+
+    def __init__(self):
+        self.geofences = {}
+
+    async def get(self, async_session: AsyncSession, geofence_table: str):
+        if geofence_table not in self.geofences:
+            sql = f"SELECT ST_AsBinary(geom) FROM {geofence_table};"
+            result = (await async_session.execute(sql)).fetchall()
+            geofence = shapely.union_all(
+                shapely.from_wkb([bytes(row[0]) for row in result])
+            )
+            shapely.prepare(geofence)
+            self.geofences[geofence_table] = geofence
+        return self.geofences[geofence_table]
+
+    async def count_outside(
+        self, async_session: AsyncSession, geofence_table: str, lats: list, lons: list
+    ) -> int:
+        """Count the points which don't intersect the geofence."""
+
+        geofence = await self.get(async_session, geofence_table)
+        intersects = shapely.intersects_xy(
+            geofence,
+            np.asarray(lons, dtype=np.float64),
+            np.asarray(lats, dtype=np.float64),
+        )
+        return int(np.count_nonzero(~intersects))
+
+
+geofence_cache = GeofenceCache()
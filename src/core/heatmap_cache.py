@@ -0,0 +1,168 @@
+import hashlib
+import json
+import logging
+from uuid import UUID
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.core.config import settings
+from src.utils import get_h3_result_column, get_h3_result_value
+
+logger = logging.getLogger(__name__)
+
+# Keys of heatmap params which don't change the computed cells
+HEATMAP_ENGINE_KEYS = ["engine"]
+
+
+class HeatmapResultCache:
+    """Database store for the H3 cells of computed heatmaps.
+
+    Results are keyed by a hash of the heatmap parameters and the revision of its
+    input data, i.e. the last data update and feature count of each input layer and
+    the features of the scenario, so that edited data is never served from the cache.
+    Heatmaps which are a sum over opportunities also store the number of
+    opportunities reaching each cell, so scenarios can be applied to them.
+    """
+
+    def __init__(self, ttl: int):
+        self.ttl = ttl
+        self.table = f"{settings.CUSTOMER_SCHEMA}.heatmap_cache"
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0
+
+    @property
+    def stats(self) -> dict:
+        """Hits and misses of the cache lookups of this process."""
+
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else None,
+        }
+
+    def get_key(
+        self, params: dict, layers: list[dict], scenario_revision: str | None = None
+    ) -> str | None:
+        """Get the cache key of a heatmap.
+
+        :param params: The heatmap parameters.
+        :param layers: The input layers with their layer_id, where_query,
+            last_data_updated_at and feature count.
+        :param scenario_revision: The revision of the features of the scenario.
+        :return: The key, or None if the heatmap must not be cached.
+        """
+
+        if not self.enabled:
+            return None
+
+        canonical_params = {
+            key: value
+            for key, value in params.items()
+            if key not in HEATMAP_ENGINE_KEYS
+        } | {
+            "layers": layers,
+            "scenario_revision": scenario_revision,
+            "network": [
+                str(settings.BASE_STREET_NETWORK),
+                settings.GOAT_ROUTING_NETWORK_VERSION,
+            ],
+        }
+        return hashlib.sha256(
+            json.dumps(
+                canonical_params, sort_keys=True, separators=(",", ":"), default=str
+            ).encode("utf-8")
+        ).hexdigest()
+
+    async def get_scenario_revision(
+        self, async_session: AsyncSession, scenario_id: UUID
+    ) -> str:
+        """Get the revision of the features of a scenario, which changes whenever a
+        feature is added, edited or removed."""
+
+        sql = f"""
+            SELECT COUNT(*), MAX(scenario_feature.updated_at)
+            FROM {settings.CUSTOMER_SCHEMA}.scenario_scenario_feature link
+            JOIN {settings.CUSTOMER_SCHEMA}.scenario_feature scenario_feature
+                ON scenario_feature.id = link.scenario_feature_id
+            WHERE link.scenario_id = '{scenario_id}';
+        """
+        cnt_features, last_updated_at = (await async_session.execute(sql)).fetchone()
+        return f"{cnt_features}_{last_updated_at}"
+
+    async def copy(
+        self, async_session: AsyncSession, key: str, result_table: str, layer_id: str
+    ) -> bool:
+        """Copy cached cells into the result table.
+
+        :return: Whether the result was cached.
+        """
+
+        sql = f"""
+            INSERT INTO {result_table} (layer_id, {get_h3_result_column()}, text_attr1, float_attr1, integer_attr1)
+            SELECT '{layer_id}', {get_h3_result_value("h3_index::h3index")}, h3_index::h3index, accessibility, opportunity_count
+            FROM {self.table}
+            WHERE cache_key = '{key}'
+            AND created_at > now() - INTERVAL '{self.ttl} seconds';
+        """
+        result = await async_session.execute(sql)
+        await async_session.commit()
+        return self.record_lookup(result.rowcount > 0)
+
+    async def copy_cells(
+        self, async_session: AsyncSession, key: str, cells_table: str
+    ) -> bool:
+        """Copy cached cells into a table of h3_index, accessibility and
+        opportunity_count.
+
+        :return: Whether the result was cached.
+        """
+
+        sql = f"""
+            INSERT INTO {cells_table} (h3_index, accessibility, opportunity_count)
+            SELECT h3_index::h3index, accessibility, opportunity_count
+            FROM {self.table}
+            WHERE cache_key = '{key}'
+            AND created_at > now() - INTERVAL '{self.ttl} seconds';
+        """
+        result = await async_session.execute(sql)
+        await async_session.commit()
+        return self.record_lookup(result.rowcount > 0)
+
+    def record_lookup(self, hit: bool) -> bool:
+        """Count a cache lookup in the statistics."""
+
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+        logger.info(f"Heatmap cache {'hit' if hit else 'miss'}: {self.stats}")
+        return hit
+
+    async def put(
+        self, async_session: AsyncSession, key: str, result_table: str, layer_id: str
+    ):
+        """Store the cells written to the result table and remove expired ones."""
+
+        sql_delete_expired = f"""
+            DELETE FROM {self.table}
+            WHERE created_at <= now() - INTERVAL '{self.ttl} seconds';
+        """
+        await async_session.execute(sql_delete_expired)
+        # Skip cells which were stored by a concurrent job in the meantime
+        sql_insert = f"""
+            INSERT INTO {self.table} (cache_key, h3_index, accessibility, opportunity_count)
+            SELECT '{key}', text_attr1::h3index::bigint, float_attr1, integer_attr1
+            FROM {result_table}
+            WHERE layer_id = '{layer_id}'
+            ON CONFLICT (cache_key, h3_index) DO NOTHING;
+        """
+        await async_session.execute(sql_insert)
+        await async_session.commit()
+
+
+heatmap_result_cache = HeatmapResultCache(ttl=settings.HEATMAP_CACHE_TTL)
@@ -13,7 +13,7 @@ from src.core.config import settings
 from src.crud.crud_job import job as crud_job
 from src.schemas.error import ERROR_MAPPING, JobKilledError, TimeoutError, UnknownError
 from src.schemas.job import JobStatusType
-from src.schemas.layer import LayerType, UserDataTable
+from src.schemas.layer import FeatureDataType, LayerType, UserDataTable
 from src.utils import table_exists
 
 # Create a logger object for background tasks
@@ -37,6 +37,7 @@ async def delete_orphan_data(
         UserDataTable.line,
         UserDataTable.point,
         UserDataTable.no_geometry,
+        UserDataTable.h3,
     ):
         table_name = f"{table.value}_{str(user_id).replace('-', '')}"
 
@@ -48,6 +49,8 @@ async def delete_orphan_data(
         # Build condition for layer filtering
         if table == UserDataTable.no_geometry:
             condition = f"type = '{LayerType.table.value}'"
+        elif table == UserDataTable.h3:
+            condition = f"data_type = '{FeatureDataType.h3.value}'"
         else:
             condition = f"feature_layer_geometry_type = '{table.value}'"
 
@@ -103,6 +103,9 @@ def get_user_table(layer: Union[dict, SQLModel, BaseModel]):
             table_prefix = "no_geometry"
         else:
             raise ValueError(f"The passed layer type {layer['type']} is not supported.")
+        # H3 layers are read through the view generating the cell boundaries
+        if layer.get("data_type") == FeatureDataType.h3:
+            table_prefix = f"h3_{table_prefix}"
     user_id = layer["user_id"]
     return f"{settings.USER_DATA_SCHEMA}.{table_prefix}_{str(user_id).replace('-', '')}"
 
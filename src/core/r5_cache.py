@@ -0,0 +1,195 @@
+import hashlib
+import json
+import math
+import os
+import time
+import uuid
+
+import aiofiles
+import aiofiles.os as aos
+import numpy as np
+import shapely
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.core.config import settings
+from src.utils import latitude_to_pixel, longitude_to_pixel
+
+# Keys of R5 requests which alter the transport network for a single request
+R5_SCENARIO_KEYS = ["modifications", "scenario", "scenarioId"]
+
+
+class R5ResultCache:
+    """Local disk store for the raw travel time grids returned by R5.
+
+    Results are stored as one file per request, keyed by a hash of the request
+    payload. The modification time of a file is its creation time, which is used
+    for expiry, the access time is its last use, which is used for LRU eviction.
+    """
+
+    def __init__(self, cache_dir: str, max_size: int, ttl: int):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.ttl = ttl
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 0
+
+    def get_key(self, request_payload: dict) -> str | None:
+        """Get the cache key of an R5 request payload.
+
+        The origin and bounds are snapped to the pixels of the R5 grid, as R5
+        computes the same result within a pixel.
+
+        :return: The key, or None if the request must not be cached.
+        """
+
+        if not self.enabled or any(
+            request_payload.get(key) for key in R5_SCENARIO_KEYS
+        ):
+            return None
+
+        zoom = request_payload["zoom"]
+        bounds = request_payload["bounds"]
+        canonical_payload = {
+            key: value
+            for key, value in request_payload.items()
+            if key not in R5_SCENARIO_KEYS
+        } | {
+            "fromLat": math.floor(latitude_to_pixel(request_payload["fromLat"], zoom)),
+            "fromLon": math.floor(longitude_to_pixel(request_payload["fromLon"], zoom)),
+            "bounds": {
+                "north": math.floor(latitude_to_pixel(bounds["north"], zoom)),
+                "south": math.ceil(latitude_to_pixel(bounds["south"], zoom)),
+                "east": math.ceil(longitude_to_pixel(bounds["east"], zoom)),
+                "west": math.floor(longitude_to_pixel(bounds["west"], zoom)),
+            },
+        }
+        return hashlib.sha256(
+            json.dumps(canonical_payload, sort_keys=True, separators=(",", ":")).encode(
+                "utf-8"
+            )
+        ).hexdigest()
+
+    def get_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.bin")
+
+    async def get(self, key: str) -> bytes | None:
+        """Get a cached result, None if it doesn't exist or has expired."""
+
+        path = self.get_path(key)
+        try:
+            stat = await aos.stat(path)
+            if time.time() - stat.st_mtime > self.ttl:
+                await aos.remove(path)
+                return None
+            async with aiofiles.open(path, "rb") as file:
+                result = await file.read()
+            # Mark as recently used, keep the creation time
+            await aos.wrap(os.utime)(path, (time.time(), stat.st_mtime))
+        except OSError:
+            return None
+        return result
+
+    async def put(self, key: str, result: bytes):
+        """Store a result and evict expired and least recently used results.
+
+        Caching is best effort, failures to write to disk are ignored.
+        """
+
+        temp_path = os.path.join(self.cache_dir, f"{uuid.uuid4().hex}.tmp")
+        try:
+            await aos.makedirs(self.cache_dir, exist_ok=True)
+            # Write to a temporary file first, so readers never see partial results
+            async with aiofiles.open(temp_path, "wb") as file:
+                await file.write(result)
+            await aos.replace(temp_path, self.get_path(key))
+            await aos.wrap(self.evict)()
+        except OSError:
+            if await aos.path.exists(temp_path):
+                await aos.remove(temp_path)
+
+    def evict(self):
+        """Remove expired results, then the least recently used results until the
+        cache fits into its max size."""
+
+        now = time.time()
+        entries = []
+        size = 0
+        for entry in os.scandir(self.cache_dir):
+            if not entry.name.endswith(".bin"):
+                continue
+            try:
+                stat = entry.stat()
+                if now - stat.st_mtime > self.ttl:
+                    os.remove(entry.path)
+                    continue
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_atime, stat.st_size, entry.path))
+            size += stat.st_size
+
+        for _, entry_size, path in sorted(entries):
+            if size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            size -= entry_size
+
+
+class R5RegionCache:
+    """In-memory copy of the R5 region mapping, so that the region of starting
+    points can be looked up without querying the database. Loaded on startup."""
+
+    def __init__(self):
+        self.regions = None
+        self.geometries = None
+
+    @property
+    def loaded(self) -> bool:
+        return self.regions is not None
+
+    async def refresh(self, async_session: AsyncSession):
+        sql = f"""
+            SELECT r5_region_id, r5_bundle_id, r5_host, ST_AsBinary(ST_SetSRID(geom, 4326))
+            FROM {settings.REGION_MAPPING_PT_TABLE};
+        """
+        result = (await async_session.execute(sql)).fetchall()
+        geometries = shapely.from_wkb([bytes(row[3]) for row in result])
+        shapely.prepare(geometries)
+        self.geometries = geometries
+        self.regions = [
+            {"r5_region_id": row[0], "r5_bundle_id": row[1], "r5_host": row[2]}
+            for row in result
+        ]
+
+    def get_regions(self, lats: list, lons: list) -> list[dict | None] | None:
+        """Get the region of each point, None for points outside of all regions.
+
+        :return: The regions, or None if the cache isn't loaded.
+        """
+
+        if not self.loaded:
+            return None
+
+        lats = np.asarray(lats, dtype=np.float64)
+        lons = np.asarray(lons, dtype=np.float64)
+        region_index = np.full(lats.shape[0], -1)
+        for i, geometry in enumerate(self.geometries):
+            # Regions don't overlap, take the first match like the database lookup
+            intersects = (region_index == -1) & shapely.intersects_xy(
+                geometry, lons, lats
+            )
+            region_index[intersects] = i
+        return [self.regions[i] if i != -1 else None for i in region_index]
+
+
+r5_region_cache = R5RegionCache()
+
+r5_result_cache = R5ResultCache(
+    cache_dir=settings.R5_CACHE_DIR,
+    max_size=settings.R5_CACHE_MAX_SIZE,
+    ttl=settings.R5_CACHE_TTL,
+)
@@ -14,6 +14,7 @@ from src.crud.crud_job import job as crud_job
 from src.crud.crud_layer import layer as crud_layer
 from src.crud.crud_layer_project import layer_project as crud_layer_project
 from src.crud.crud_project import project as crud_project
+from src.crud.crud_user import user as crud_user
 from src.db.models.layer import FeatureType, Layer, LayerType, ToolType
 from src.schemas.common import CQLQueryObject, OrderEnum
 from src.schemas.error import (
@@ -28,10 +29,12 @@ from src.schemas.error import (
 from src.schemas.job import JobType, Msg, MsgType
 from src.schemas.layer import (
     ComputeBreakOperation,
+    FeatureDataType,
     FeatureGeometryType,
     IFeatureLayerToolCreate,
     OgrPostgresType,
     UserDataGeomType,
+    UserDataTable,
 )
 from src.schemas.style import (
     custom_styles,
@@ -643,6 +646,22 @@ class CRUDToolBase(CRUDFailedJob):
         temp_table = f"temporal.{prefix}_{get_random_string(6)}_{table_suffix}"
         return temp_table
 
+    async def get_h3_result_table(self):
+        """Get the user table storing results on a H3 grid. If H3_RESULT_TABLE is set,
+        this is the table storing H3 cells without geometry, which is created on first
+        use. Otherwise it is the polygon table."""
+
+        if not settings.H3_RESULT_TABLE:
+            return f"{settings.USER_DATA_SCHEMA}.{UserDataTable.polygon.value}_{str(self.user_id).replace('-', '')}"
+
+        await crud_user.create_user_h3_table(self.async_session, self.user_id)
+        return f"{settings.USER_DATA_SCHEMA}.{UserDataTable.h3.value}_{str(self.user_id).replace('-', '')}"
+
+    def get_h3_result_data_type(self) -> FeatureDataType | None:
+        """Get the data type of result layers on a H3 grid."""
+
+        return FeatureDataType.h3 if settings.H3_RESULT_TABLE else None
+
     async def create_distributed_polygon_table(
         self,
         layer_project: BaseModel,
@@ -0,0 +1,412 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import uuid
+from collections import OrderedDict
+from itertools import chain
+
+import numpy as np
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.core.config import settings
+from src.utils import table_exists
+
+# Arrays of a shard, each saved as a .npy file
+SHARD_ARRAYS = ["orig_id", "offsets", "dest_id", "traveltime"]
+
+MANIFEST_FILE = "manifest.json"
+
+# Number of attempts to open a shard which is replaced while it is read
+SHARD_READ_ATTEMPTS = 3
+
+# Suffix of the tables with the cumulative reachable cells of a matrix
+REACHABILITY_TABLE_SUFFIX = "reachability"
+
+
+def build_shard(orig_id: list, traveltime: list, dest_id: list) -> dict:
+    """
+    Convert matrix rows sorted by origin and travel time to the arrays of a shard.
+
+    :return: The sorted origin cells, the offsets of their destinations and the
+        destinations with their travel times, sorted by travel time per origin.
+    """
+    orig_id = np.asarray(orig_id, dtype=np.int64)
+    traveltime = np.asarray(traveltime, dtype=np.int64)
+    if len(traveltime) and traveltime.max() > np.iinfo(np.uint8).max:
+        raise ValueError("Travel times of a shard must fit into uint8.")
+
+    n_dest = np.fromiter(
+        (len(row) for row in dest_id), dtype=np.int64, count=len(dest_id)
+    )
+    unique_orig_id, first_row = np.unique(orig_id, return_index=True)
+    row_offsets = np.zeros(len(orig_id) + 1, dtype=np.int64)
+    np.cumsum(n_dest, out=row_offsets[1:])
+    return {
+        "orig_id": unique_orig_id,
+        "offsets": np.append(row_offsets[first_row], row_offsets[-1]),
+        "dest_id": np.fromiter(
+            chain.from_iterable(dest_id), dtype=np.int64, count=int(row_offsets[-1])
+        ),
+        "traveltime": np.repeat(traveltime, n_dest).astype(np.uint8),
+    }
+
+
+def get_reachability_table(matrix_table: str) -> str:
+    return f"{matrix_table}_{REACHABILITY_TABLE_SUFFIX}"
+
+
+async def reachability_exists(async_session: AsyncSession, matrix_table: str) -> bool:
+    schema_name, table_name = get_reachability_table(matrix_table).split(".")
+    return await table_exists(async_session, schema_name, table_name)
+
+
+async def rebuild_reachability(
+    async_session: AsyncSession, matrix_table: str, max_traveltime: int
+):
+    """
+    Precompute the number of cells reachable from each origin of a matrix within
+    every travel time from 0 to max_traveltime minutes. The counts are stored as
+    an array per origin, reachable_cells[t + 1] being the count within t minutes.
+
+    The new table is built next to the current one and swapped in at the end, so
+    heatmaps keep reading a complete table during the rebuild.
+    """
+
+    reachability_table = get_reachability_table(matrix_table)
+    table_name = reachability_table.split(".")[-1]
+    temp_table = f"{reachability_table}_{uuid.uuid4().hex[:8]}"
+    await async_session.execute(
+        f"""
+        CREATE TABLE {temp_table} (
+            orig_id h3index,
+            h3_3 int,
+            reachable_cells int[]
+        );
+        """
+    )
+    # Co-locate with the matrix and the opportunity tables
+    await async_session.execute(
+        f"SELECT create_distributed_table('{temp_table}', 'h3_3');"
+    )
+    await async_session.execute(
+        f"""
+        INSERT INTO {temp_table}
+        SELECT orig_id, h3_3, ARRAY_AGG(reachable_cells ORDER BY minute)
+        FROM (
+            SELECT matrix.orig_id, matrix.h3_3, minute.value AS minute,
+                COALESCE(
+                    SUM(ARRAY_LENGTH(matrix.dest_id, 1)) FILTER (WHERE matrix.traveltime <= minute.value), 0
+                )::int AS reachable_cells
+            FROM {matrix_table} matrix
+            CROSS JOIN generate_series(0, {max_traveltime}) minute(value)
+            GROUP BY matrix.orig_id, matrix.h3_3, minute.value
+        ) cumulative
+        GROUP BY orig_id, h3_3;
+        """
+    )
+    await async_session.execute(f"CREATE INDEX ON {temp_table} (orig_id, h3_3);")
+    await async_session.execute(
+        f"""
+        DO $$
+        BEGIN
+            DROP TABLE IF EXISTS {reachability_table};
+            ALTER TABLE {temp_table} RENAME TO {table_name};
+        END $$;
+        """
+    )
+
+
+class TravelTimeMatrixShards:
+    """Local disk copy of the travel time matrices, with one shard per h3_3 cell.
+
+    The arrays of a shard are opened as memory maps, so reading them needs no
+    deserialization and repeated reads are served from the page cache. Open
+    shards are kept in an LRU and reopened when their files were replaced, e.g.
+    by a rebuild in another process. A manifest per matrix stores the checksum of the
+    source rows and of the files of each shard, used to rebuild changed shards.
+    Shards are only read once the export of the whole matrix completed.
+    """
+
+    def __init__(self, shard_dir: str, max_open_shards: int):
+        self.shard_dir = shard_dir
+        self.max_open_shards = max_open_shards
+        self.open_shards = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get_matrix_dir(self, matrix_table: str) -> str:
+        return os.path.join(self.shard_dir, matrix_table.split(".")[-1])
+
+    def get_shard_path(self, matrix_table: str, h3_3: int) -> str:
+        return os.path.join(self.get_matrix_dir(matrix_table), str(h3_3))
+
+    def get_manifest(self, matrix_table: str) -> dict:
+        try:
+            with open(
+                os.path.join(self.get_matrix_dir(matrix_table), MANIFEST_FILE)
+            ) as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return {}
+
+    def write_manifest(self, matrix_table: str, manifest: dict):
+        matrix_dir = self.get_matrix_dir(matrix_table)
+        temp_path = os.path.join(matrix_dir, f"{uuid.uuid4().hex}.tmp")
+        with open(temp_path, "w") as file:
+            json.dump(manifest, file, sort_keys=True)
+        os.replace(temp_path, os.path.join(matrix_dir, MANIFEST_FILE))
+
+    def exists(self, matrix_table: str) -> bool:
+        """Whether the matrix was fully exported, cells without a shard have no
+        rows."""
+
+        return self.get_manifest(matrix_table).get("complete", False)
+
+    def get_file_checksum(self, matrix_table: str, h3_3: int) -> str | None:
+        path = self.get_shard_path(matrix_table, h3_3)
+        checksum = hashlib.sha256()
+        try:
+            for name in SHARD_ARRAYS:
+                with open(os.path.join(path, f"{name}.npy"), "rb") as file:
+                    while chunk := file.read(1024**2):
+                        checksum.update(chunk)
+        except OSError:
+            return None
+        return checksum.hexdigest()
+
+    def write_shard(self, matrix_table: str, h3_3: int, shard: dict) -> str:
+        """Write the arrays of a shard, replacing an existing shard at once.
+
+        A directory can't be replaced atomically, so the shard path is a symlink to
+        a directory per version of the shard, which is swapped with os.replace.
+
+        :return: The checksum of the shard files.
+        """
+
+        path = self.get_shard_path(matrix_table, h3_3)
+        version_path = f"{path}.{uuid.uuid4().hex}"
+        os.makedirs(version_path)
+        for name in SHARD_ARRAYS:
+            np.save(os.path.join(version_path, f"{name}.npy"), shard[name])
+
+        # Open memory maps keep reading the replaced files
+        with self.lock:
+            self.open_shards.pop((matrix_table, h3_3), None)
+        old_version_path = None
+        if os.path.islink(path):
+            old_version_path = os.path.realpath(path)
+        elif os.path.isdir(path):
+            # Shard written as a directory by an earlier version
+            shutil.rmtree(path)
+        temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        os.symlink(os.path.basename(version_path), temp_path)
+        os.replace(temp_path, path)
+        if old_version_path is not None:
+            shutil.rmtree(old_version_path, ignore_errors=True)
+        return self.get_file_checksum(matrix_table, h3_3)
+
+    def remove_shard(self, matrix_table: str, h3_3: int):
+        with self.lock:
+            self.open_shards.pop((matrix_table, h3_3), None)
+        path = self.get_shard_path(matrix_table, h3_3)
+        if os.path.islink(path):
+            version_path = os.path.realpath(path)
+            os.remove(path)
+            shutil.rmtree(version_path, ignore_errors=True)
+        else:
+            shutil.rmtree(path, ignore_errors=True)
+
+    def get_shard_version(self, matrix_table: str, h3_3: int) -> tuple | None:
+        """Get the inode and modification time of the files of a shard, which
+        change whenever the shard is replaced."""
+
+        path = self.get_shard_path(matrix_table, h3_3)
+        try:
+            stat = os.stat(os.path.join(path, f"{SHARD_ARRAYS[0]}.npy"))
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns
+
+    def get(self, matrix_table: str, h3_3: int) -> dict | None:
+        """Get the memory mapped arrays of a shard, None if the cell has no rows."""
+
+        key = (matrix_table, h3_3)
+        path = self.get_shard_path(matrix_table, h3_3)
+        for _ in range(SHARD_READ_ATTEMPTS):
+            # Open memory maps keep reading replaced or removed files, so check the
+            # files are still the same
+            version = self.get_shard_version(matrix_table, h3_3)
+            with self.lock:
+                if key in self.open_shards and self.open_shards[key][0] == version:
+                    self.open_shards.move_to_end(key)
+                    return self.open_shards[key][1]
+                self.open_shards.pop(key, None)
+            if version is None:
+                return None
+
+            # The shard may be replaced while its arrays are opened, which mixes
+            # arrays of both versions, so open them again
+            try:
+                shard = {
+                    name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r")
+                    for name in SHARD_ARRAYS
+                }
+            except FileNotFoundError:
+                continue
+            if self.get_shard_version(matrix_table, h3_3) != version:
+                continue
+
+            with self.lock:
+                self.open_shards[key] = (version, shard)
+                while len(self.open_shards) > self.max_open_shards:
+                    self.open_shards.popitem(last=False)
+            return shard
+
+        raise OSError(f"Shard {h3_3} of {matrix_table} kept changing while read.")
+
+    def load_csr(
+        self,
+        matrix_table: str,
+        orig_id: np.ndarray,
+        h3_3: np.ndarray,
+        max_traveltime: np.ndarray,
+    ) -> dict:
+        """
+        Load the destinations of the origins up to their max travel time, as
+        compressed sparse rows in the format of build_traveltime_matrix_csr.
+        """
+        orig_id = np.asarray(orig_id, dtype=np.int64)
+        h3_3 = np.asarray(h3_3, dtype=np.int64)
+        max_traveltime = np.asarray(max_traveltime, dtype=np.int64)
+
+        # Largest max travel time of each origin
+        order = np.lexsort((-max_traveltime, orig_id))
+        unique_orig_id, first = np.unique(orig_id[order], return_index=True)
+        origin_h3_3 = h3_3[order][first]
+        origin_max_traveltime = max_traveltime[order][first]
+
+        entry_origin = [np.empty(0, dtype=np.int64)]
+        dest_ids = [np.empty(0, dtype=np.int64)]
+        traveltimes = [np.empty(0, dtype=np.uint8)]
+        for cell in np.unique(origin_h3_3):
+            shard = self.get(matrix_table, int(cell))
+            if shard is None or not len(shard["orig_id"]):
+                continue
+            origins = np.flatnonzero(origin_h3_3 == cell)
+            rows = np.searchsorted(shard["orig_id"], unique_orig_id[origins])
+            rows[rows == len(shard["orig_id"])] = 0
+            matched = shard["orig_id"][rows] == unique_orig_id[origins]
+            origins, rows = origins[matched], rows[matched]
+
+            # Position of every entry of the origins in the shard arrays
+            starts = shard["offsets"][rows]
+            lengths = shard["offsets"][rows + 1] - starts
+            entries = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+            entries += np.arange(len(entries))
+            origin = np.repeat(origins, lengths)
+            traveltime = shard["traveltime"][entries]
+            keep = traveltime <= origin_max_traveltime[origin]
+
+            entry_origin.append(origin[keep])
+            dest_ids.append(shard["dest_id"][entries[keep]])
+            traveltimes.append(traveltime[keep])
+
+        entry_origin = np.concatenate(entry_origin)
+        dest_id = np.concatenate(dest_ids)
+        traveltime = np.concatenate(traveltimes).astype(np.int16)
+        # Shards are read in h3_3 order, which usually matches the origin order
+        if np.any(entry_origin[1:] < entry_origin[:-1]):
+            order = np.argsort(entry_origin, kind="stable")
+            entry_origin, dest_id, traveltime = (
+                entry_origin[order],
+                dest_id[order],
+                traveltime[order],
+            )
+
+        n_entries = np.bincount(entry_origin, minlength=len(unique_orig_id))
+        found = n_entries > 0
+        offsets = np.zeros(np.count_nonzero(found) + 1, dtype=np.int64)
+        np.cumsum(n_entries[found], out=offsets[1:])
+        unique_dest_id, dest_index = np.unique(dest_id, return_inverse=True)
+        return {
+            "orig_id": unique_orig_id[found],
+            "offsets": offsets,
+            "dest_index": dest_index.astype(np.int64),
+            "traveltime": traveltime,
+            "dest_id": unique_dest_id,
+        }
+
+    async def get_source_checksums(
+        self, async_session: AsyncSession, matrix_table: str
+    ) -> dict:
+        """Get an order independent checksum of the rows of each h3_3 cell."""
+
+        sql = f"""
+            SELECT h3_3, COUNT(*), SUM(hashtextextended(
+                orig_id::text || ',' || traveltime::text || ',' || dest_id::text, 0
+            )::numeric)
+            FROM {matrix_table}
+            GROUP BY h3_3;
+        """
+        result = (await async_session.execute(sql)).fetchall()
+        return {str(h3_3): f"{count}:{checksum}" for h3_3, count, checksum in result}
+
+    async def export_shard(
+        self, async_session: AsyncSession, matrix_table: str, h3_3: int
+    ) -> str:
+        sql = f"""
+            SELECT orig_id::bigint, traveltime, dest_id::bigint[]
+            FROM {matrix_table}
+            WHERE h3_3 = {h3_3}
+            ORDER BY orig_id, traveltime;
+        """
+        rows = (await async_session.execute(sql)).fetchall()
+        shard = build_shard(*(list(zip(*rows, strict=True)) or [[], [], []]))
+        return self.write_shard(matrix_table, h3_3, shard)
+
+    async def rebuild(self, async_session: AsyncSession, matrix_table: str) -> dict:
+        """Export the shards of a matrix whose source rows changed or whose files
+        don't match their checksum, and remove shards of cells without rows.
+
+        :return: The number of built, unchanged and removed shards.
+        """
+
+        os.makedirs(self.get_matrix_dir(matrix_table), exist_ok=True)
+        source_checksums = await self.get_source_checksums(async_session, matrix_table)
+        manifest = self.get_manifest(matrix_table) | {"complete": False}
+        shards = manifest.setdefault("shards", {})
+        stats = {"built": 0, "unchanged": 0, "removed": 0}
+
+        for h3_3, source_checksum in source_checksums.items():
+            entry = shards.get(h3_3)
+            if (
+                entry is not None
+                and entry["source_checksum"] == source_checksum
+                and entry["file_checksum"] == self.get_file_checksum(matrix_table, h3_3)
+            ):
+                stats["unchanged"] += 1
+                continue
+            shards[h3_3] = {
+                "source_checksum": source_checksum,
+                "file_checksum": await self.export_shard(
+                    async_session, matrix_table, int(h3_3)
+                ),
+            }
+            # Save progress, so an interrupted rebuild resumes where it stopped
+            self.write_manifest(matrix_table, manifest)
+            stats["built"] += 1
+
+        for h3_3 in set(shards) - set(source_checksums):
+            self.remove_shard(matrix_table, int(h3_3))
+            del shards[h3_3]
+            stats["removed"] += 1
+        manifest["complete"] = True
+        self.write_manifest(matrix_table, manifest)
+        return stats
+
+
+traveltime_matrix_shards = TravelTimeMatrixShards(
+    shard_dir=settings.TRAVELTIME_MATRIX_DIR,
+    max_open_shards=settings.TRAVELTIME_MATRIX_MAX_OPEN_SHARDS,
+)
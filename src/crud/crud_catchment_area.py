@@ -1,12 +1,22 @@
 import asyncio
-from uuid import UUID
+import math
+from concurrent.futures import ProcessPoolExecutor
+from uuid import UUID, uuid4
 
+import numpy as np
+import shapely
 from httpx import AsyncClient
+from pyproj import Geod
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from src.core.catchment_area_cache import catchment_area_result_cache
+from src.core.completion import request_until_complete, user_data_insert_listener
 from src.core.config import settings
+from src.core.geofence import geofence_cache
 from src.core.job import job_init, job_log, run_background_or_immediately
+from src.core.r5_cache import r5_region_cache, r5_result_cache
 from src.core.tool import CRUDToolBase
+from src.crud.crud_job import job as crud_job
 from src.jsoline import generate_jsolines
 from src.schemas.catchment_area import (
     CatchmentAreaNearbyStationAccess,
@@ -14,6 +24,7 @@ from src.schemas.catchment_area import (
     CatchmentAreaRoutingModeCar,
     CatchmentAreaTravelTimeCostActiveMobility,
     CatchmentAreaTravelTimeCostMotorizedMobility,
+    CatchmentAreaTypePT,
     ICatchmentAreaActiveMobility,
     ICatchmentAreaCar,
     ICatchmentAreaPT,
@@ -25,13 +36,45 @@ from src.schemas.error import (
     RoutingEndpointError,
     SQLError,
 )
+from src.schemas.heatmap import (
+    TRAVELTIME_MATRIX_RESOLUTION,
+    MotorizedRoutingHeatmapType,
+)
 from src.schemas.job import JobStatusType
 from src.schemas.layer import IFeatureLayerToolCreate, UserDataGeomType
 from src.schemas.toolbox_base import (
     CatchmentAreaGeometryTypeMapping,
     DefaultResultLayerName,
 )
-from src.utils import decode_r5_grid, format_value_null_sql
+from src.utils import (
+    compute_r5_surface,
+    copy_records_to_table,
+    decode_r5_grid,
+    format_value_null_sql,
+    is_distributed_table,
+    min_value_per_h3_cell,
+    split_points_by_h3_cell,
+    surface_to_h3_cells,
+)
+
+# Starting points are chunked by H3 cells of this resolution (~36 km2)
+CATCHMENT_AREA_CHUNK_H3_RESOLUTION = 6
+
+# Number of segments of the buffer around starting points used for the R5 bounds
+R5_BOUNDS_BUFFER_SEGMENTS = 32
+
+
+_routing_semaphores = {}
+
+
+def get_routing_semaphore(url: str) -> asyncio.Semaphore:
+    """Get the semaphore limiting the concurrent requests to a GOAT Routing host."""
+
+    if url not in _routing_semaphores:
+        _routing_semaphores[url] = asyncio.Semaphore(
+            settings.GOAT_ROUTING_MAX_CONCURRENT_REQUESTS
+        )
+    return _routing_semaphores[url]
 
 
 async def call_routing_endpoint(
@@ -40,42 +83,148 @@ async def call_routing_endpoint(
     http_client: AsyncClient,
 ):
     try:
-        # Call GOAT Routing endpoint multiple times for upto 20 seconds / 10 retries
-        for i in range(settings.CRUD_NUM_RETRIES):
-            # Call GOAT Routing endpoint to compute catchment area
-            url = (
-                f"{settings.GOAT_ROUTING_URL}/active-mobility/catchment-area"
-                if type(routing_mode) == CatchmentAreaRoutingModeActiveMobility
-                else f"{settings.GOAT_ROUTING_URL}/motorized-mobility/catchment-area"
-            )
-            response = await http_client.post(
-                url=url,
-                json=request_payload,
-                headers={"Authorization": settings.GOAT_ROUTING_AUTHORIZATION},
+        # Call GOAT Routing endpoint to compute catchment area
+        url = (
+            f"{settings.GOAT_ROUTING_URL}/active-mobility/catchment-area"
+            if type(routing_mode) == CatchmentAreaRoutingModeActiveMobility
+            else f"{settings.GOAT_ROUTING_URL}/motorized-mobility/catchment-area"
+        )
+        # The routing service writes the result into the layer, re-request as soon
+        # as its rows are inserted
+        async with (
+            get_routing_semaphore(settings.GOAT_ROUTING_URL),
+            user_data_insert_listener.listen(request_payload["layer_id"]) as completed,
+        ):
+            response = await request_until_complete(
+                lambda: http_client.post(
+                    url=url,
+                    json=request_payload,
+                    headers={"Authorization": settings.GOAT_ROUTING_AUTHORIZATION},
+                ),
+                completed=completed,
             )
-            if response.status_code == 202:
-                # Endpoint is still processing request, retry shortly
-                if i == settings.CRUD_NUM_RETRIES - 1:
-                    raise Exception(
-                        "GOAT routing endpoint took too long to process request."
-                    )
-                await asyncio.sleep(settings.CRUD_RETRY_INTERVAL)
-                continue
-            elif response.status_code == 201:
-                # Endpoint has finished processing request, break
-                break
-            else:
-                raise Exception(response.text)
+        if response.status_code == 202:
+            raise Exception("GOAT routing endpoint took too long to process request.")
+        elif response.status_code != 201:
+            raise Exception(response.text)
     except Exception as e:
         raise RoutingEndpointError(
             f"Error while calling the routing endpoint: {str(e)}"
         )
 
 
-async def create_temp_isochrone_table(async_session: AsyncSession, job_id: UUID):
+async def call_r5_endpoint(
+    r5_host: str,
+    request_payload: dict,
+    http_client: AsyncClient,
+) -> bytes:
+    try:
+        # Call R5 endpoint to compute catchment area
+        response = await request_until_complete(
+            lambda: http_client.post(
+                url=f"{r5_host}/api/analysis",
+                json=request_payload,
+                headers={"Authorization": settings.R5_AUTHORIZATION},
+            )
+        )
+        if response.status_code == 202:
+            raise Exception("R5 engine took too long to process request.")
+        elif response.status_code != 200:
+            raise Exception(response.text)
+        return response.content
+    except Exception as e:
+        raise R5EndpointError(f"Error while calling the R5 endpoint: {str(e)}")
+
+
+def get_r5_bounds(lats: list, lons: list, buffer_distance: float = 100000):
+    """Get the bounds of the R5 request for each starting point, the envelope of a
+    geodesic buffer around the point."""
+
+    # TODO Compute buffer distance dynamically?
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+    azimuths = np.linspace(0, 360, R5_BOUNDS_BUFFER_SEGMENTS, endpoint=False)
+    buffer_lons, buffer_lats, _ = Geod(ellps="WGS84").fwd(
+        np.repeat(lons, azimuths.shape[0]),
+        np.repeat(lats, azimuths.shape[0]),
+        np.tile(azimuths, lats.shape[0]),
+        np.full(lats.shape[0] * azimuths.shape[0], buffer_distance),
+    )
+    buffer_lons = buffer_lons.reshape(lats.shape[0], azimuths.shape[0])
+    buffer_lats = buffer_lats.reshape(lats.shape[0], azimuths.shape[0])
+    return [
+        {"north": north, "south": south, "east": east, "west": west}
+        for north, south, east, west in zip(
+            buffer_lats.max(axis=1).tolist(),
+            buffer_lats.min(axis=1).tolist(),
+            buffer_lons.max(axis=1).tolist(),
+            buffer_lons.min(axis=1).tolist(),
+            strict=True,
+        )
+    ]
+
+
+_process_pool = None
+
+
+def get_process_pool() -> ProcessPoolExecutor:
+    """Get the process pool used for CPU-bound catchment area processing."""
+
+    global _process_pool
+    if _process_pool is None:
+        _process_pool = ProcessPoolExecutor(
+            max_workers=settings.R5_PROCESS_POOL_WORKERS
+        )
+    return _process_pool
+
+
+def process_r5_grid(
+    result: bytes, travel_time: int, steps: int, catchment_area_type: str
+):
+    """Decode an R5 travel time grid and convert it to catchment area shapes or
+    H3 grid cells.
+
+    Runs in a worker process, hence it is a module-level function.
+    """
+
+    # Decode R5 response data
+    grid = decode_r5_grid(result)
+
+    if catchment_area_type != CatchmentAreaTypePT.polygon.value:
+        # Skip polygonization, aggregate the travel time of the pixels to the H3
+        # grid used for public transport heatmaps instead
+        surface = compute_r5_surface(grid, percentile=5)
+        h3_grid = surface_to_h3_cells(
+            surface=surface,
+            width=grid["width"],
+            west=grid["west"],
+            north=grid["north"],
+            zoom=grid["zoom"],
+            max_value=travel_time,
+            h3_resolution=TRAVELTIME_MATRIX_RESOLUTION[
+                MotorizedRoutingHeatmapType.public_transport.value
+            ],
+        )
+        return h3_grid, None
+
+    # Convert grid data returned by R5 to valid catchment area geometry
+    shapes = generate_jsolines(
+        grid=grid,
+        travel_time=travel_time,
+        percentile=5,
+        steps=steps,
+        simplify_tolerance=settings.JSOLINE_SIMPLIFY_TOLERANCE,
+        precision=settings.JSOLINE_PRECISION,
+    )
+    return grid, shapes
+
+
+async def create_temp_isochrone_table(
+    async_session: AsyncSession, job_id: UUID, table_prefix: str = "temp"
+):
     try:
         # Create result table to store catchment area geometry
-        catchment_area_table = f"temporal.temp_{str(job_id).replace('-', '')}"
+        catchment_area_table = f"temporal.{table_prefix}_{str(job_id).replace('-', '')}"
         # Drop table if exists
         sql_drop_temp_table = f"""
             DROP TABLE IF EXISTS {catchment_area_table};
@@ -90,6 +239,14 @@ async def create_temp_isochrone_table(async_session: AsyncSession, job_id: UUID)
             );
         """
         await async_session.execute(sql_create_temp_table)
+        # Notify jobs waiting for the catchment areas written by the routing service
+        sql_create_notify_trigger = f"""
+            CREATE TRIGGER notify_insert
+            AFTER INSERT ON {catchment_area_table}
+            REFERENCING NEW TABLE AS new_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION basic.trigger_notify_user_data_insert();
+        """
+        await async_session.execute(sql_create_notify_trigger)
         await async_session.commit()
     except Exception as e:
         await async_session.rollback()
@@ -125,50 +282,227 @@ class CRUDCatchmentAreaBase(CRUDToolBase):
             job_id=self.job_id,
         )
 
+        lats = params.starting_points.latitude
+        lons = params.starting_points.longitude
+
         # Check if starting points are within the geofence
-        for i in range(0, len(params.starting_points.latitude), 500):
-            # Create insert query
-            lats = params.starting_points.latitude[i : i + 500]
-            lons = params.starting_points.longitude[i : i + 500]
-            sql = f"""
-                WITH to_test AS
-                (
-                    SELECT ST_SETSRID(ST_MAKEPOINT(lon[gs], lat[gs]), 4326) AS geom
-                    FROM generate_series(1, array_length(ARRAY{str(lats)}, 1)) AS gs,
-                    LATERAL (SELECT ARRAY{str(lats)} AS lat, ARRAY{str(lons)} AS lon) AS arrays
-                )
-                SELECT COUNT(*)
-                FROM to_test t
-                WHERE NOT EXISTS (
-                    SELECT 1
-                    FROM {params.geofence_table} AS g
-                    WHERE ST_INTERSECTS(t.geom, g.geom)
-                )
-            """
-            # Execute query
-            cnt_not_intersecting = await self.async_session.execute(sql)
-            cnt_not_intersecting = cnt_not_intersecting.scalars().first()
+        cnt_not_intersecting = await geofence_cache.count_outside(
+            async_session=self.async_session,
+            geofence_table=params.geofence_table,
+            lats=lats,
+            lons=lons,
+        )
+        if cnt_not_intersecting > 0:
+            raise OutOfGeofenceError(
+                f"There are {cnt_not_intersecting} starting points that are not within the geofence. Please check your starting points."
+            )
+
+        # Save data into user data tables in a single copy
+        geometries = shapely.set_srid(shapely.points(lons, lats), 4326)
+        await copy_records_to_table(
+            async_session=self.async_session,
+            table_name=self.table_starting_points,
+            columns=["layer_id", "geom"],
+            records=[
+                (layer.id, geometry)
+                for geometry in shapely.to_wkb(geometries, include_srid=True)
+            ],
+        )
 
-            if cnt_not_intersecting > 0:
-                raise OutOfGeofenceError(
-                    f"There are {cnt_not_intersecting} starting points that are not within the geofence. Please check your starting points."
+        return layer
+
+    async def compute_catchment_area_routing(
+        self,
+        routing_mode: (
+            CatchmentAreaRoutingModeActiveMobility | CatchmentAreaRoutingModeCar
+        ),
+        request_payload: dict,
+    ):
+        """Copy the catchment area of previous jobs with the same request into the
+        result table, else compute it with the GOAT Routing endpoint."""
+
+        if (
+            len(request_payload["starting_points"]["latitude"])
+            > settings.CATCHMENT_AREA_CHUNK_SIZE
+        ):
+            return await self.compute_catchment_area_chunked(
+                routing_mode=routing_mode, request_payload=request_payload
+            )
+
+        cache_key = catchment_area_result_cache.get_key(request_payload)
+        if cache_key and await catchment_area_result_cache.copy(
+            async_session=self.async_session,
+            key=cache_key,
+            result_table=request_payload["result_table"],
+            layer_id=request_payload["layer_id"],
+        ):
+            return
+
+        # The routing service writes into a temporal table with the notify trigger,
+        # so imports into user tables don't pay for notifications
+        routing_table = await create_temp_isochrone_table(
+            async_session=self.async_session,
+            job_id=self.job_id,
+            table_prefix="temp_routing",
+        )
+        await call_routing_endpoint(
+            routing_mode,
+            request_payload | {"result_table": routing_table},
+            self.http_client,
+        )
+        try:
+            await self.async_session.execute(
+                f"""
+                INSERT INTO {request_payload["result_table"]} (layer_id, geom, integer_attr1)
+                SELECT '{request_payload["layer_id"]}', geom, integer_attr1
+                FROM {routing_table}
+                ORDER BY id;
+                """
+            )
+            await self.async_session.execute(f"DROP TABLE IF EXISTS {routing_table};")
+            await self.async_session.commit()
+        except Exception as e:
+            await self.async_session.rollback()
+            raise SQLError(e)
+
+        if cache_key:
+            await catchment_area_result_cache.put(
+                async_session=self.async_session,
+                key=cache_key,
+                result_table=request_payload["result_table"],
+                layer_id=request_payload["layer_id"],
+            )
+
+    async def compute_catchment_area_chunked(
+        self,
+        routing_mode: (
+            CatchmentAreaRoutingModeActiveMobility | CatchmentAreaRoutingModeCar
+        ),
+        request_payload: dict,
+    ):
+        """Split the starting points into chunks of nearby points, compute their
+        catchment areas concurrently and merge them into the result table."""
+
+        starting_points = request_payload["starting_points"]
+        chunks = split_points_by_h3_cell(
+            lats=starting_points["latitude"],
+            lons=starting_points["longitude"],
+            max_chunk_size=settings.CATCHMENT_AREA_CHUNK_SIZE,
+            h3_resolution=CATCHMENT_AREA_CHUNK_H3_RESOLUTION,
+        )
+        chunk_table = await create_temp_isochrone_table(
+            async_session=self.async_session,
+            job_id=self.job_id,
+            table_prefix="temp_chunks",
+        )
+        chunk_payloads = [
+            request_payload
+            | {
+                "starting_points": {
+                    "latitude": [starting_points["latitude"][i] for i in chunk],
+                    "longitude": [starting_points["longitude"][i] for i in chunk],
+                },
+                # Differences are computed after merging the full catchment areas
+                "polygon_difference": (
+                    False
+                    if request_payload["catchment_area_type"] == "polygon"
+                    else request_payload["polygon_difference"]
+                ),
+                "result_table": chunk_table,
+                "layer_id": str(uuid4()),
+            }
+            for chunk in chunks
+        ]
+
+        # Copy cached chunks upfront, the database session can't be shared between tasks
+        uncached_chunks = []
+        for chunk_payload in chunk_payloads:
+            cache_key = catchment_area_result_cache.get_key(chunk_payload)
+            if not cache_key or not await catchment_area_result_cache.copy(
+                async_session=self.async_session,
+                key=cache_key,
+                result_table=chunk_table,
+                layer_id=chunk_payload["layer_id"],
+            ):
+                uncached_chunks.append((chunk_payload, cache_key))
+
+        async def compute_chunk(chunk_payload: dict, cache_key: str | None):
+            await call_routing_endpoint(routing_mode, chunk_payload, self.http_client)
+            return chunk_payload, cache_key
+
+        # Compute uncached chunks concurrently, limited per routing host
+        tasks = [
+            asyncio.create_task(compute_chunk(chunk_payload, cache_key))
+            for chunk_payload, cache_key in uncached_chunks
+        ]
+        cnt_computed = len(chunks) - len(tasks)
+        try:
+            for task in asyncio.as_completed(tasks):
+                chunk_payload, cache_key = await task
+                if cache_key:
+                    await catchment_area_result_cache.put(
+                        async_session=self.async_session,
+                        key=cache_key,
+                        result_table=chunk_table,
+                        layer_id=chunk_payload["layer_id"],
+                    )
+                cnt_computed += 1
+                await crud_job.update_status(
+                    async_session=self.async_session,
+                    job_id=self.job_id,
+                    job_step_name="catchment_area",
+                    status=JobStatusType.running.value,
+                    msg_text=f"Computed {cnt_computed} of {len(chunks)} chunks of starting points.",
                 )
+        finally:
+            # Don't leave requests running if a chunk failed or the job timed out
+            for task in tasks:
+                task.cancel()
 
-        # Save data into user data tables in batches of 500
-        for i in range(0, len(params.starting_points.latitude), 500):
-            # Create insert query
-            lats = params.starting_points.latitude[i : i + 500]
-            lons = params.starting_points.longitude[i : i + 500]
-            sql = f"""
-                INSERT INTO {self.table_starting_points} (layer_id, geom)
-                SELECT '{layer.id}', ST_SETSRID(ST_MAKEPOINT(lon[gs], lat[gs]), 4326) AS geom
-                FROM generate_series(1, array_length(ARRAY{str(lats)}, 1)) AS gs,
-                LATERAL (SELECT ARRAY{str(lats)} AS lat, ARRAY{str(lons)} AS lon) AS arrays
-            """
-            # Execute query
-            await self.async_session.execute(sql)
+        await self.merge_catchment_area_chunks(
+            chunk_table=chunk_table, request_payload=request_payload
+        )
 
-        return layer
+    async def merge_catchment_area_chunks(
+        self, chunk_table: str, request_payload: dict
+    ):
+        """Merge the catchment areas of all chunks into the result table."""
+
+        result_table = request_payload["result_table"]
+        layer_id = request_payload["layer_id"]
+        if request_payload["catchment_area_type"] == "polygon":
+            # Union the catchment areas of each step, bands are the difference to the
+            # union of the previous step
+            geom = (
+                "COALESCE(ST_Difference(geom, LAG(geom) OVER (ORDER BY integer_attr1)), geom)"
+                if request_payload["polygon_difference"]
+                else "geom"
+            )
+            sql_merge = f"""
+                INSERT INTO {result_table} (layer_id, geom, integer_attr1)
+                SELECT '{layer_id}', {geom}, integer_attr1
+                FROM (
+                    SELECT integer_attr1, ST_Union(geom) AS geom
+                    FROM {chunk_table}
+                    GROUP BY integer_attr1
+                ) steps
+                ORDER BY integer_attr1 DESC;
+            """
+        else:
+            # Keep the lowest travel cost of features reached from several chunks
+            sql_merge = f"""
+                INSERT INTO {result_table} (layer_id, geom, integer_attr1)
+                SELECT '{layer_id}', geom, MIN(integer_attr1)
+                FROM {chunk_table}
+                GROUP BY geom;
+            """
+        try:
+            await self.async_session.execute(sql_merge)
+            await self.async_session.execute(f"DROP TABLE IF EXISTS {chunk_table};")
+            await self.async_session.commit()
+        except Exception as e:
+            await self.async_session.rollback()
+            raise SQLError(e)
 
     async def get_lats_lons(
         self,
@@ -317,8 +651,8 @@ class CRUDCatchmentAreaActiveMobility(CRUDCatchmentAreaBase):
                 "node_layer_project_id": params.street_network.node_layer_project_id,
             }
 
-        await call_routing_endpoint(
-            params.routing_type, request_payload, self.http_client
+        await self.compute_catchment_area_routing(
+            routing_mode=params.routing_type, request_payload=request_payload
         )
 
         # Create layers only if result_params are not provided
@@ -365,6 +699,172 @@ class CRUDCatchmentAreaPT(CRUDCatchmentAreaBase):
 
         self.http_client = http_client
 
+    async def get_r5_regions(self, lats: list, lons: list) -> list[dict]:
+        """Get the R5 region, bundle, host and request bounds of all starting points."""
+
+        # Identify relevant R5 region & bundle for the catchment area starting points
+        regions = r5_region_cache.get_regions(lats=lats, lons=lons)
+        if regions is None:
+            sql_get_region_mapping = f"""
+                SELECT r.r5_region_id, r.r5_bundle_id, r.r5_host
+                FROM UNNEST(ARRAY{str(lats)}::float8[], ARRAY{str(lons)}::float8[])
+                    WITH ORDINALITY AS p(lat, lon, idx)
+                LEFT JOIN LATERAL (
+                    SELECT r5_region_id, r5_bundle_id, r5_host
+                    FROM {settings.REGION_MAPPING_PT_TABLE}
+                    WHERE ST_INTERSECTS(
+                        ST_SETSRID(ST_MAKEPOINT(p.lon, p.lat), 4326),
+                        ST_SetSRID(geom, 4326)
+                    )
+                    LIMIT 1
+                ) r ON TRUE
+                ORDER BY p.idx;
+            """
+            result = (
+                await self.async_session.execute(sql_get_region_mapping)
+            ).fetchall()
+            regions = [
+                (
+                    {"r5_region_id": row[0], "r5_bundle_id": row[1], "r5_host": row[2]}
+                    if row[0] is not None
+                    else None
+                )
+                for row in result
+            ]
+
+        cnt_outside_regions = sum(region is None for region in regions)
+        if cnt_outside_regions > 0:
+            raise OutOfGeofenceError(
+                f"There are {cnt_outside_regions} starting points that are not within a public transport region."
+            )
+
+        # Get relevant region bounds for the starting points
+        return [
+            region | {"bounds": bounds}
+            for region, bounds in zip(
+                regions, get_r5_bounds(lats=lats, lons=lons), strict=True
+            )
+        ]
+
+    def build_request_payload(
+        self,
+        params: ICatchmentAreaPT,
+        lat: float,
+        lon: float,
+        r5_region: dict,
+    ):
+        """Build the R5 analysis request payload for a starting point."""
+
+        return {
+            "accessModes": params.routing_type.access_mode.value.upper(),
+            "transitModes": ",".join(params.routing_type.mode).upper(),
+            "bikeSpeed": params.bike_speed,
+            "walkSpeed": params.walk_speed,
+            "bikeTrafficStress": params.bike_traffic_stress,
+            "date": params.time_window.weekday_date,
+            "fromTime": params.time_window.from_time,
+            "toTime": params.time_window.to_time,
+            "maxTripDurationMinutes": params.travel_cost.max_traveltime,
+            "decayFunction": {
+                "type": "logistic",
+                "standard_deviation_minutes": params.decay_function.standard_deviation_minutes,
+                "width_minutes": params.decay_function.width_minutes,
+            },
+            "destinationPointSetIds": [],
+            "bounds": r5_region["bounds"],
+            "directModes": params.routing_type.access_mode.value.upper(),
+            "egressModes": params.routing_type.egress_mode.value.upper(),
+            "fromLat": lat,
+            "fromLon": lon,
+            "zoom": params.zoom,
+            "maxBikeTime": params.max_bike_time,
+            "maxRides": params.max_rides,
+            "maxWalkTime": params.max_walk_time,
+            "monteCarloDraws": params.monte_carlo_draws,
+            "percentiles": params.percentiles,
+            "variantIndex": settings.R5_VARIANT_INDEX,
+            "workerVersion": settings.R5_WORKER_VERSION,
+            "regionId": r5_region["r5_region_id"],
+            "projectId": r5_region["r5_region_id"],
+            "bundleId": r5_region["r5_bundle_id"],
+        }
+
+    async def compute_catchment_area_point(
+        self,
+        semaphore: asyncio.Semaphore,
+        r5_host: str,
+        request_payload: dict,
+        params: ICatchmentAreaPT,
+    ):
+        """Request the R5 travel time grid of one starting point and process it."""
+
+        # Reuse the result of an identical request if available
+        cache_key = r5_result_cache.get_key(request_payload)
+        result = await r5_result_cache.get(cache_key) if cache_key else None
+
+        if result is None:
+            # Limit the number of requests which are in flight at the same time
+            async with semaphore:
+                result = await call_r5_endpoint(
+                    r5_host, request_payload, self.http_client
+                )
+            if cache_key:
+                await r5_result_cache.put(cache_key, result)
+
+        # Decode grid & compute jsolines in a worker process, so the event loop
+        # can keep collecting responses for the remaining starting points
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                get_process_pool(),
+                process_r5_grid,
+                result,
+                params.travel_cost.max_traveltime,
+                params.travel_cost.steps,
+                params.catchment_area_type.value,
+            )
+        except Exception as e:
+            raise R5CatchmentAreaComputeError(
+                f"Error while processing R5 catchment area grid: {str(e)}"
+            )
+
+    async def insert_catchment_area_polygons(self, layer_id, result_table, shapes):
+        """Insert catchment area polygons as WKT, used for distributed tables."""
+
+        shapes_sorted = []
+        for i in shapes.index:
+            shapes_sorted.append((shapes["geometry"][i], shapes["minute"][i]))
+        shapes_sorted = sorted(shapes_sorted, key=lambda x: x[1], reverse=True)
+        insert_string = ""
+        for shape in shapes_sorted:
+            insert_string += f"('{layer_id}', ST_MakeValid(ST_SetSRID(ST_GeomFromText('{shape[0]}'), 4326)), {shape[1]}),"
+        insert_string = f"""
+            INSERT INTO {result_table} (layer_id, geom, integer_attr1)
+            VALUES {insert_string.rstrip(",")};
+        """
+        await self.async_session.execute(insert_string)
+
+    async def copy_catchment_area_polygons(self, layer_id, result_table, shapes):
+        """Copy catchment area polygons as binary WKB into the result table."""
+
+        shapes = shapes.sort_values("minute", ascending=False, kind="stable")
+        geometries = shapely.set_srid(
+            shapely.make_valid(shapes["geometry"].values), 4326
+        )
+        records = zip(
+            [UUID(layer_id)] * len(shapes),
+            shapely.to_wkb(geometries, include_srid=True),
+            # Round half up like the cast of the numeric minutes in the insert
+            [math.floor(minute + 0.5) for minute in shapes["minute"]],
+            strict=True,
+        )
+        await copy_records_to_table(
+            async_session=self.async_session,
+            table_name=result_table,
+            columns=["layer_id", "geom", "integer_attr1"],
+            records=list(records),
+        )
+
     async def write_catchment_area_result(
         self,
         catchment_area_type,
@@ -373,27 +873,46 @@ class CRUDCatchmentAreaPT(CRUDCatchmentAreaBase):
         shapes,
         grid,
         polygon_difference,
+        is_distributed=False,
     ):
         """Save the result of the catchment area computation to the database."""
 
         if catchment_area_type == "polygon":
             # Save catchment area geometry data (shapes)
             shapes = shapes["incremental"] if polygon_difference else shapes["full"]
-            shapes_sorted = []
-            for i in shapes.index:
-                shapes_sorted.append((shapes["geometry"][i], shapes["minute"][i]))
-            shapes_sorted = sorted(shapes_sorted, key=lambda x: x[1], reverse=True)
-            insert_string = ""
-            for shape in shapes_sorted:
-                insert_string += f"('{layer_id}', ST_MakeValid(ST_SetSRID(ST_GeomFromText('{shape[0]}'), 4326)), {shape[1]}),"
-            insert_string = f"""
-                INSERT INTO {result_table} (layer_id, geom, integer_attr1)
-                VALUES {insert_string.rstrip(",")};
-            """
-            await self.async_session.execute(insert_string)
+            if is_distributed:
+                await self.insert_catchment_area_polygons(
+                    layer_id=layer_id, result_table=result_table, shapes=shapes
+                )
+            else:
+                await self.copy_catchment_area_polygons(
+                    layer_id=layer_id, result_table=result_table, shapes=shapes
+                )
         else:
-            # Save catchment area grid data
-            pass
+            # Copy the cells to a temporal table and save one polygon per H3 cell
+            temp_cells = await self.create_temp_table_name("cells")
+            await self.async_session.execute(
+                f"CREATE TABLE {temp_cells} (h3_index bigint, traveltime smallint);"
+            )
+            await copy_records_to_table(
+                async_session=self.async_session,
+                table_name=temp_cells,
+                columns=["h3_index", "traveltime"],
+                records=[
+                    (int(h3_index, 16), traveltime)
+                    for h3_index, traveltime in zip(
+                        grid["h3_index"], grid["value"], strict=True
+                    )
+                ],
+            )
+            sql = f"""
+                INSERT INTO {result_table} (layer_id, geom, integer_attr1, text_attr1)
+                SELECT '{layer_id}', ST_SetSRID(h3_cell_to_boundary(h3_index::h3index)::geometry, 4326),
+                    traveltime, h3_index::h3index::text
+                FROM {temp_cells};
+            """
+            await self.async_session.execute(sql)
+            await self.async_session.execute(f"DROP TABLE IF EXISTS {temp_cells};")
 
     @job_log(job_step_name="catchment_area")
     async def catchment_area(
@@ -417,147 +936,87 @@ class CRUDCatchmentAreaPT(CRUDCatchmentAreaBase):
             feature_layer_geometry_type=CatchmentAreaGeometryTypeMapping[
                 params.catchment_area_type.value
             ],
-            attribute_mapping={"integer_attr1": "travel_cost"},
+            attribute_mapping=(
+                {"integer_attr1": "travel_cost"}
+                if params.catchment_area_type == CatchmentAreaTypePT.polygon
+                else {"integer_attr1": "travel_cost", "text_attr1": "h3_index"}
+            ),
             tool_type=params.tool_type.value,
             job_id=self.job_id,
         )
         result_table = f"{settings.USER_DATA_SCHEMA}.{layer_catchment_area.feature_layer_geometry_type.value}_{str(self.user_id).replace('-', '')}"
 
-        # Compute catchment area for each starting point
-        for i in range(0, len(lats)):
-            # Identify relevant R5 region & bundle for this catchment area starting point
-            sql_get_region_mapping = f"""
-                SELECT r5_region_id, r5_bundle_id, r5_host
-                FROM {settings.REGION_MAPPING_PT_TABLE}
-                WHERE ST_INTERSECTS(
-                    ST_SETSRID(
-                        ST_MAKEPOINT(
-                            {lons[i]},
-                            {lats[i]}
-                        ),
-                        4326
-                    ),
-                    ST_SetSRID(geom, 4326)
-                );
-            """
-            r5_region_id, r5_bundle_id, r5_host = (
-                await self.async_session.execute(sql_get_region_mapping)
-            ).fetchall()[0]
-
-            # Get relevant region bounds for this starting point
-            # TODO Compute buffer distance dynamically?
-            sql_get_region_bounds = f"""
-                SELECT ST_XMin(b.geom), ST_YMin(b.geom), ST_XMax(b.geom), ST_YMax(b.geom)
-                FROM (
-                    SELECT ST_Envelope(
-                        ST_Buffer(
-                            ST_SetSRID(
-                                ST_MakePoint(
-                                    {lons[i]},
-                                    {lats[i]}),
-                                4326
-                            )::geography,
-                            100000
-                        )::geometry
-                    ) AS geom
-                ) b;
-            """
-            xmin, ymin, xmax, ymax = (
-                await self.async_session.execute(sql_get_region_bounds)
-            ).fetchall()[0]
-
-            # Construct request payload
-            request_payload = {
-                "accessModes": params.routing_type.access_mode.value.upper(),
-                "transitModes": ",".join(params.routing_type.mode).upper(),
-                "bikeSpeed": params.bike_speed,
-                "walkSpeed": params.walk_speed,
-                "bikeTrafficStress": params.bike_traffic_stress,
-                "date": params.time_window.weekday_date,
-                "fromTime": params.time_window.from_time,
-                "toTime": params.time_window.to_time,
-                "maxTripDurationMinutes": params.travel_cost.max_traveltime,
-                "decayFunction": {
-                    "type": "logistic",
-                    "standard_deviation_minutes": params.decay_function.standard_deviation_minutes,
-                    "width_minutes": params.decay_function.width_minutes,
-                },
-                "destinationPointSetIds": [],
-                "bounds": {
-                    "north": ymax,
-                    "south": ymin,
-                    "east": xmax,
-                    "west": xmin,
-                },
-                "directModes": params.routing_type.access_mode.value.upper(),
-                "egressModes": params.routing_type.egress_mode.value.upper(),
-                "fromLat": lats[i],
-                "fromLon": lons[i],
-                "zoom": params.zoom,
-                "maxBikeTime": params.max_bike_time,
-                "maxRides": params.max_rides,
-                "maxWalkTime": params.max_walk_time,
-                "monteCarloDraws": params.monte_carlo_draws,
-                "percentiles": params.percentiles,
-                "variantIndex": settings.R5_VARIANT_INDEX,
-                "workerVersion": settings.R5_WORKER_VERSION,
-                "regionId": r5_region_id,
-                "projectId": r5_region_id,
-                "bundleId": r5_bundle_id,
-            }
-
-            result = None
-            try:
-                # Call R5 endpoint multiple times for upto 20 seconds / 10 retries
-                for i in range(settings.CRUD_NUM_RETRIES):
-                    # Call R5 endpoint to compute catchment area
-                    response = await self.http_client.post(
-                        url=f"{r5_host}/api/analysis",
-                        json=request_payload,
-                        headers={"Authorization": settings.R5_AUTHORIZATION},
-                    )
-                    if response.status_code == 202:
-                        # Engine is still processing request, retry shortly
-                        if i == settings.CRUD_NUM_RETRIES - 1:
-                            raise Exception(
-                                "R5 engine took too long to process request."
-                            )
-                        await asyncio.sleep(settings.CRUD_RETRY_INTERVAL)
-                        continue
-                    elif response.status_code == 200:
-                        # Engine has finished processing request, break
-                        result = response.content
-                        break
-                    else:
-                        raise Exception(response.text)
-            except Exception as e:
-                raise R5EndpointError(f"Error while calling the R5 endpoint: {str(e)}")
+        # Identify relevant R5 region & bounds for all starting points upfront, the
+        # database session can't be shared between tasks
+        r5_regions = await self.get_r5_regions(lats=lats, lons=lons)
+        requests = [
+            (
+                r5_region["r5_host"],
+                self.build_request_payload(
+                    params=params, lat=lat, lon=lon, r5_region=r5_region
+                ),
+            )
+            for lat, lon, r5_region in zip(lats, lons, r5_regions, strict=True)
+        ]
 
-            catchment_area_grid = None
-            catchment_area_shapes = None
-            try:
-                # Decode R5 response data
-                catchment_area_grid = decode_r5_grid(result)
+        # Citus tables don't support binary COPY of geometries, check once per job
+        is_distributed = await is_distributed_table(
+            async_session=self.async_session, table_name=result_table
+        )
 
-                # Convert grid data returned by R5 to valid catchment area geometry
-                catchment_area_shapes = generate_jsolines(
-                    grid=catchment_area_grid,
-                    travel_time=params.travel_cost.max_traveltime,
-                    percentile=5,
-                    steps=params.travel_cost.steps,
-                )
-            except Exception as e:
-                raise R5CatchmentAreaComputeError(
-                    f"Error while processing R5 catchment area grid: {str(e)}"
+        # Compute catchment area for all starting points concurrently
+        semaphore = asyncio.Semaphore(settings.R5_MAX_CONCURRENT_REQUESTS)
+        tasks = [
+            asyncio.create_task(
+                self.compute_catchment_area_point(
+                    semaphore=semaphore,
+                    r5_host=r5_host,
+                    request_payload=request_payload,
+                    params=params,
                 )
-
+            )
+            for r5_host, request_payload in requests
+        ]
+        h3_grids = []
+        try:
+            # Save results as soon as they are available
+            for task in asyncio.as_completed(tasks):
+                catchment_area_grid, catchment_area_shapes = await task
+                if params.catchment_area_type != CatchmentAreaTypePT.polygon:
+                    # Grids of all starting points are merged before saving
+                    h3_grids.append(catchment_area_grid)
+                    continue
+                try:
+                    await self.write_catchment_area_result(
+                        catchment_area_type=params.catchment_area_type.value,
+                        layer_id=str(layer_catchment_area.id),
+                        result_table=result_table,
+                        shapes=catchment_area_shapes,
+                        grid=catchment_area_grid,
+                        polygon_difference=params.polygon_difference,
+                        is_distributed=is_distributed,
+                    )
+                except Exception as e:
+                    raise SQLError(
+                        f"Error while saving R5 catchment area result to database: {str(e)}"
+                    )
+        finally:
+            # Don't leave requests running if a starting point failed or the job timed out
+            for task in tasks:
+                task.cancel()
+
+        if h3_grids:
+            # Keep the minimum travel time of each cell over all starting points
+            catchment_area_grid = min_value_per_h3_cell(
+                h3_index=[cell for grid in h3_grids for cell in grid["h3_index"]],
+                values=[value for grid in h3_grids for value in grid["value"]],
+            )
             try:
-                # Save result to database
                 await self.write_catchment_area_result(
                     catchment_area_type=params.catchment_area_type.value,
                     layer_id=str(layer_catchment_area.id),
                     result_table=result_table,
-                    shapes=catchment_area_shapes,
+                    shapes=None,
                     grid=catchment_area_grid,
                     polygon_difference=params.polygon_difference,
                 )
@@ -566,17 +1025,17 @@ class CRUDCatchmentAreaPT(CRUDCatchmentAreaBase):
                     f"Error while saving R5 catchment area result to database: {str(e)}"
                 )
 
-            # Create new layers.
+        # Create new layers.
+        await self.create_feature_layer_tool(
+            layer_in=layer_catchment_area,
+            params=params,
+        )
+        # Create new layer if starting points are not a layer
+        if not params.starting_points.layer_project_id:
             await self.create_feature_layer_tool(
-                layer_in=layer_catchment_area,
+                layer_in=layer_starting_points,
                 params=params,
             )
-            # Create new layer if starting points are not a layer
-            if not params.starting_points.layer_project_id:
-                await self.create_feature_layer_tool(
-                    layer_in=layer_starting_points,
-                    params=params,
-                )
 
         return {
             "status": JobStatusType.finished.value,
@@ -677,8 +1136,8 @@ class CRUDCatchmentAreaCar(CRUDCatchmentAreaBase):
                 "node_layer_project_id": params.street_network.node_layer_project_id,
             }
 
-        await call_routing_endpoint(
-            params.routing_type, request_payload, self.http_client
+        await self.compute_catchment_area_routing(
+            routing_mode=params.routing_type, request_payload=request_payload
         )
 
         # Create layers only if result_params are not provided
@@ -1,5 +1,10 @@
+import asyncio
+import json
+
+import numpy as np
 from sqlalchemy import text
 
+from src.aggregation import H3PointAggregation
 from src.core.chart import Chart
 from src.core.config import settings
 from src.core.job import job_init, job_log, run_background_or_immediately
@@ -19,6 +24,10 @@ from src.schemas.layer import (
 from src.schemas.tool import IAggregationPoint, IAggregationPolygon, IOriginDestination
 from src.schemas.toolbox_base import ColumnStatisticsOperation, DefaultResultLayerName
 from src.utils import (
+    copy_query_to_arrays,
+    copy_records_to_table,
+    get_h3_result_column,
+    get_h3_result_value,
     get_result_column,
     search_value,
 )
@@ -127,9 +136,9 @@ class CRUDAggregateBase(CRUDToolBase, Chart):
             operation=params.column_statistics.operation,
         )
 
-        # Create insert statement
+        # Create insert statement, cells of the h3 grid may be stored without geometry
         insert_columns_arr = (
-            ["geom"]
+            ["geom" if aggregation_layer_project else get_h3_result_column()]
             + list(attribute_mapping_aggregation.keys())
             + list(result_column.keys())
         )
@@ -139,6 +148,9 @@ class CRUDAggregateBase(CRUDToolBase, Chart):
         layer_in = IFeatureLayerToolCreate(
             name=DefaultResultLayerName[params.tool_type].value,
             feature_layer_geometry_type=FeatureGeometryType.polygon,
+            data_type=(
+                None if aggregation_layer_project else self.get_h3_result_data_type()
+            ),
             attribute_mapping={**attribute_mapping_aggregation, **result_column},
             tool_type=params.tool_type,
             job_id=self.job_id,
@@ -272,47 +284,63 @@ class CRUDAggregatePoint(CRUDAggregateBase):
                 """
         else:
             # If aggregation_layer_project_id does not exist the h3 grid will be taken for the intersection
-            sql_query_total_stats = f"""
-                CREATE TABLE {self.table_name_total_stats} AS
-                SELECT h3_lat_lng_to_cell(geom::point, {params.h3_resolution}) h3_index, {statistics_column_query} AS stats
-                FROM {temp_source}
-                GROUP BY h3_lat_lng_to_cell(geom::point, {params.h3_resolution})
-            """
-            await self.async_session.execute(sql_query_total_stats)
-            await self.async_session.execute(
-                f"CREATE INDEX ON {self.table_name_total_stats} (h3_index);"
-            )
-
-            if params.source_group_by_field:
-                # Define subquery for grouped by id and group_by_field
-                sql_query_group_stats = f"""
-                    CREATE TABLE {self.table_name_grouped_stats} AS
-                    SELECT h3_index, JSONB_OBJECT_AGG(group_column_name, stats) AS stats
-                    FROM
-                    (
-                        SELECT h3_lat_lng_to_cell(geom::point, {params.h3_resolution}) h3_index, {group_column_name}, {statistics_column_query} AS stats
-                        FROM {temp_source}
-                        GROUP BY h3_lat_lng_to_cell(geom::point, {params.h3_resolution}), {group_by_columns}
-                    ) AS to_group
-                    GROUP BY h3_index
+            self.result_table = await self.get_h3_result_table()
+            cnt_points = (
+                await self.async_session.execute(f"SELECT COUNT(*) FROM {temp_source}")
+            ).scalar()
+            if cnt_points >= settings.AGGREGATE_POINT_VECTORIZED_MIN_POINTS:
+                await self.aggregate_point_h3_vectorized(
+                    params=params,
+                    temp_source=temp_source,
+                    mapped_statistics_field=aggregation["mapped_statistics_field"],
+                    mapped_statistics_field_type=aggregation[
+                        "result_check_statistics_field"
+                    ]["mapped_statistics_field_type"],
+                    group_column_name=group_column_name,
+                )
+            else:
+                sql_query_total_stats = f"""
+                    CREATE TABLE {self.table_name_total_stats} AS
+                    SELECT h3_lat_lng_to_cell(geom::point, {params.h3_resolution}) h3_index, {statistics_column_query} AS stats
+                    FROM {temp_source}
+                    GROUP BY h3_lat_lng_to_cell(geom::point, {params.h3_resolution})
                 """
-                await self.async_session.execute(sql_query_group_stats)
+                await self.async_session.execute(sql_query_total_stats)
                 await self.async_session.execute(
-                    f"CREATE INDEX ON {self.table_name_grouped_stats} (h3_index);"
+                    f"CREATE INDEX ON {self.table_name_total_stats} (h3_index);"
                 )
 
+                if params.source_group_by_field:
+                    # Define subquery for grouped by id and group_by_field
+                    sql_query_group_stats = f"""
+                        CREATE TABLE {self.table_name_grouped_stats} AS
+                        SELECT h3_index, JSONB_OBJECT_AGG(group_column_name, stats) AS stats
+                        FROM
+                        (
+                            SELECT h3_lat_lng_to_cell(geom::point, {params.h3_resolution}) h3_index, {group_column_name}, {statistics_column_query} AS stats
+                            FROM {temp_source}
+                            GROUP BY h3_lat_lng_to_cell(geom::point, {params.h3_resolution}), {group_by_columns}
+                        ) AS to_group
+                        GROUP BY h3_index
+                    """
+                    await self.async_session.execute(sql_query_group_stats)
+                    await self.async_session.execute(
+                        f"CREATE INDEX ON {self.table_name_grouped_stats} (h3_index);"
+                    )
+
+            if params.source_group_by_field:
                 sql_query = f"""
                     INSERT INTO {self.result_table} (layer_id, {insert_columns})
-                    SELECT '{layer_in.id}', ST_SETSRID(h3_cell_to_boundary(t.h3_index)::geometry, 4326),
-                    t.h3_index, t.stats AS total_stats, g.stats AS grouped_stats
+                    SELECT '{layer_in.id}', {get_h3_result_value("t.h3_index::h3index")},
+                    t.h3_index::h3index, t.stats AS total_stats, g.stats AS grouped_stats
                     FROM {self.table_name_total_stats} t, {self.table_name_grouped_stats} g
                     WHERE t.h3_index = g.h3_index
                 """
             else:
                 sql_query = f"""
                     INSERT INTO {self.result_table} (layer_id, {insert_columns})
-                    SELECT '{layer_in.id}', ST_SETSRID(h3_cell_to_boundary(h3_index)::geometry, 4326),
-                    h3_index, t.stats AS total_stats
+                    SELECT '{layer_in.id}', {get_h3_result_value("h3_index::h3index")},
+                    h3_index::h3index, t.stats AS total_stats
                     FROM {self.table_name_total_stats} t
                 """
         # Execute query
@@ -342,6 +370,128 @@ class CRUDAggregatePoint(CRUDAggregateBase):
             "msg": "Points where successfully aggregated.",
         }
 
+    async def aggregate_point_h3_vectorized(
+        self,
+        params: IAggregationPoint,
+        temp_source: str,
+        mapped_statistics_field: str,
+        mapped_statistics_field_type: str,
+        group_column_name: str | None,
+    ):
+        """Aggregate the points on the h3 grid in memory into the total and grouped
+        stats tables. Points are streamed from the database in batches and the cell
+        of each point is computed once for both tables."""
+
+        operation = params.column_statistics.operation
+        stats_type = "float8" if mapped_statistics_field_type == "float" else "int8"
+        columns = {"lat": np.float64, "lng": np.float64, "valid": np.bool_}
+        select_columns = [
+            "ST_Y(points.geom)",
+            "ST_X(points.geom)",
+            f"points.{mapped_statistics_field} IS NOT NULL",
+        ]
+        if operation != ColumnStatisticsOperation.count:
+            columns["values"] = np.float64 if stats_type == "float8" else np.int64
+            select_columns.append(
+                f"COALESCE(points.{mapped_statistics_field}, 0)::{stats_type}"
+            )
+
+        # Number the groups, so only their id is streamed
+        group_names = [None]
+        from_query = f"{temp_source} points"
+        if params.source_group_by_field:
+            table_name_groups = await self.create_temp_table_name("groups")
+            await self.async_session.execute(
+                f"""
+                CREATE TABLE {table_name_groups} AS
+                SELECT group_column_name,
+                    (ROW_NUMBER() OVER (ORDER BY group_column_name) - 1)::int4 AS group_id
+                FROM (SELECT DISTINCT {group_column_name} FROM {temp_source}) to_group;
+                """
+            )
+            sql_group_names = (
+                f"SELECT group_column_name FROM {table_name_groups} ORDER BY group_id;"
+            )
+            group_names = [
+                row[0]
+                for row in (await self.async_session.execute(sql_group_names)).all()
+            ]
+            columns["group_id"] = np.int32
+            select_columns.append("groups.group_id")
+            from_query = f"""
+                (SELECT {temp_source}.*, {group_column_name} FROM {temp_source}) points
+                JOIN {table_name_groups} groups USING (group_column_name)
+            """
+
+        h3_aggregation = H3PointAggregation(
+            resolution=params.h3_resolution,
+            operation=operation.value,
+            dtype=columns.get("values", np.int64),
+            n_groups=len(group_names),
+        )
+        await copy_query_to_arrays(
+            async_session=self.async_session,
+            query=f"SELECT {', '.join(select_columns)} FROM {from_query}",
+            columns=columns,
+            process_batch=lambda batch: h3_aggregation.add(**batch),
+            batch_size=settings.AGGREGATE_POINT_BATCH_SIZE,
+        )
+        result = await asyncio.to_thread(h3_aggregation.result)
+
+        # Statistics of cells without values are NULL, except their count
+        def get_stats(stats: np.ndarray, count: np.ndarray):
+            if operation == ColumnStatisticsOperation.count:
+                return stats.tolist()
+            return [
+                value if cnt > 0 else None
+                for value, cnt in zip(stats.tolist(), count.tolist(), strict=True)
+            ]
+
+        await self.async_session.execute(
+            f"CREATE TABLE {self.table_name_total_stats} (h3_index bigint, stats {stats_type});"
+        )
+        await copy_records_to_table(
+            self.async_session,
+            self.table_name_total_stats,
+            ["h3_index", "stats"],
+            list(
+                zip(
+                    result["h3_index"].tolist(),
+                    get_stats(result["stats"], result["count"]),
+                    strict=True,
+                )
+            ),
+        )
+        await self.async_session.execute(
+            f"CREATE INDEX ON {self.table_name_total_stats} (h3_index);"
+        )
+
+        if params.source_group_by_field:
+            grouped_stats = {}
+            for h3_index, group_id, stats in zip(
+                result["grouped_h3_index"].tolist(),
+                result["group_id"].tolist(),
+                get_stats(result["grouped_stats"], result["grouped_count"]),
+                strict=True,
+            ):
+                grouped_stats.setdefault(h3_index, {})[group_names[group_id]] = stats
+
+            await self.async_session.execute(
+                f"CREATE TABLE {self.table_name_grouped_stats} (h3_index bigint, stats jsonb);"
+            )
+            await copy_records_to_table(
+                self.async_session,
+                self.table_name_grouped_stats,
+                ["h3_index", "stats"],
+                [
+                    (h3_index, json.dumps(stats))
+                    for h3_index, stats in grouped_stats.items()
+                ],
+            )
+            await self.async_session.execute(
+                f"CREATE INDEX ON {self.table_name_grouped_stats} (h3_index);"
+            )
+
     @run_background_or_immediately(settings)
     @job_init()
     async def aggregate_point_run(self, params: IAggregationPoint):
@@ -439,6 +589,8 @@ class CRUDAggregatePolygon(CRUDAggregateBase):
                     WHERE {aggregation_layer_project.table_name}.layer_id = '{aggregation_layer_project.layer_id}'
                 """
         else:
+            self.result_table = await self.get_h3_result_table()
+
             # Get average edge length of h3 grid
             avg_edge_length = await self.async_session.execute(
                 f"SELECT h3_get_hexagon_edge_length_avg({params.h3_resolution}, 'm')"
@@ -555,7 +707,7 @@ class CRUDAggregatePolygon(CRUDAggregateBase):
 
                 sql_query_combine = f"""
                     INSERT INTO {self.result_table} (layer_id, {insert_columns})
-                    SELECT '{layer_in.id}', ST_SETSRID(h3_cell_to_boundary(t.h3_target::h3index)::geometry, 4326),
+                    SELECT '{layer_in.id}', {get_h3_result_value("t.h3_target::h3index")},
                     t.h3_target, t.stats as total_stats, g.stats AS grouped_stats
                     FROM {self.table_name_grouped_stats} g, {self.table_name_total_stats} t
                     WHERE g.h3_target = t.h3_target;
@@ -563,7 +715,7 @@ class CRUDAggregatePolygon(CRUDAggregateBase):
             else:
                 sql_query_combine = f"""
                     INSERT INTO {self.result_table} (layer_id, {insert_columns})
-                    SELECT '{layer_in.id}', ST_SETSRID(h3_cell_to_boundary(h3_target::h3index)::geometry, 4326),
+                    SELECT '{layer_in.id}', {get_h3_result_value("h3_target::h3index")},
                     h3_target, stats AS total_stats
                     FROM {self.table_name_total_stats}
                 """
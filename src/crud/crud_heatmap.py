@@ -1,12 +1,33 @@
+import asyncio
+from typing import Callable
+
+import numpy as np
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.core.config import settings
+from src.core.heatmap_cache import heatmap_result_cache
 from src.core.tool import CRUDToolBase
+from src.core.traveltime_matrix import traveltime_matrix_shards
+from src.crud.crud_job import job as crud_job
+from src.crud.crud_layer import layer as crud_layer
 from src.crud.crud_layer_project import layer_project as crud_layer_project
+from src.heatmap import build_traveltime_matrix_csr
 from src.schemas.heatmap import (
+    TRAVELTIME_MATRIX_TABLE,
+    ActiveRoutingHeatmapType,
     IHeatmapClosestAverageActive,
     IHeatmapClosestAverageMotorized,
     IHeatmapConnectivityActive,
     IHeatmapConnectivityMotorized,
     IHeatmapGravityActive,
     IHeatmapGravityMotorized,
+    MotorizedRoutingHeatmapType,
+)
+from src.schemas.job import JobStatusType
+from src.utils import (
+    copy_records_to_table,
+    get_h3_result_column,
+    get_h3_result_value,
 )
 
 
@@ -65,3 +86,350 @@ class CRUDHeatmapBase(CRUDToolBase):
             ]
 
         return opportunity_layers, opportunity_geofence_layer
+
+    async def get_input_layers_project(
+        self,
+        params: (
+            IHeatmapGravityActive
+            | IHeatmapGravityMotorized
+            | IHeatmapClosestAverageActive
+            | IHeatmapClosestAverageMotorized
+            | IHeatmapConnectivityActive
+            | IHeatmapConnectivityMotorized
+        ),
+    ):
+        """Get the layers project the heatmap is computed from."""
+
+        layer_project_ids = [
+            layer.opportunity_layer_project_id for layer in params.opportunities
+        ]
+        if params.opportunity_geofence_layer_project_id:
+            layer_project_ids.append(params.opportunity_geofence_layer_project_id)
+
+        return [
+            await crud_layer_project.get_internal(
+                async_session=self.async_session,
+                id=layer_project_id,
+                project_id=self.project_id,
+            )
+            for layer_project_id in layer_project_ids
+        ]
+
+    async def get_cache_key(
+        self,
+        params: (
+            IHeatmapGravityActive
+            | IHeatmapGravityMotorized
+            | IHeatmapClosestAverageActive
+            | IHeatmapClosestAverageMotorized
+            | IHeatmapConnectivityActive
+            | IHeatmapConnectivityMotorized
+        ),
+    ) -> str | None:
+        """Get the key of the heatmap in the result cache, from its params and the
+        revision of its input layers and scenario."""
+
+        if not heatmap_result_cache.enabled:
+            return None
+
+        layers = []
+        for layer_project in await self.get_input_layers_project(params):
+            layers.append(
+                {
+                    "layer_id": layer_project.layer_id,
+                    "where_query": layer_project.where_query,
+                    "last_data_updated_at": await crud_layer.get_last_data_updated_at(
+                        async_session=self.async_session,
+                        id=layer_project.layer_id,
+                        query=layer_project.query,
+                    ),
+                    # Deleted features don't change the last update
+                    "feature_cnt": await crud_layer_project.get_feature_cnt(
+                        async_session=self.async_session,
+                        layer_project=layer_project,
+                    ),
+                }
+            )
+
+        scenario_revision = None
+        if params.scenario_id:
+            scenario_revision = await heatmap_result_cache.get_scenario_revision(
+                self.async_session, params.scenario_id
+            )
+
+        return heatmap_result_cache.get_key(
+            params=params.dict() | {"tool_type": params.tool_type},
+            layers=layers,
+            scenario_revision=scenario_revision,
+        )
+
+    async def compute_heatmap_cached(
+        self,
+        params: (
+            IHeatmapGravityActive
+            | IHeatmapGravityMotorized
+            | IHeatmapClosestAverageActive
+            | IHeatmapClosestAverageMotorized
+            | IHeatmapConnectivityActive
+            | IHeatmapConnectivityMotorized
+        ),
+        result_table: str,
+        result_layer_id: str,
+    ):
+        """Copy the cells of a heatmap computed before with the same params and
+        input data, otherwise compute it and store its cells in the cache."""
+
+        cache_key = await self.get_cache_key(params)
+        if cache_key and await heatmap_result_cache.copy(
+            async_session=self.async_session,
+            key=cache_key,
+            result_table=result_table,
+            layer_id=result_layer_id,
+        ):
+            return
+
+        if not await self.compute_heatmap_delta(
+            params=params,
+            result_table=result_table,
+            result_layer_id=result_layer_id,
+        ):
+            opportunity_table = await self.create_opportunity_table(params)
+            await self.compute_heatmap(
+                params=params,
+                opportunity_table=opportunity_table,
+                result_table=result_table,
+                result_layer_id=result_layer_id,
+            )
+
+        if cache_key:
+            await heatmap_result_cache.put(
+                async_session=self.async_session,
+                key=cache_key,
+                result_table=result_table,
+                layer_id=result_layer_id,
+            )
+
+    async def compute_heatmap_delta(
+        self,
+        params: (
+            IHeatmapGravityActive
+            | IHeatmapGravityMotorized
+            | IHeatmapClosestAverageActive
+            | IHeatmapClosestAverageMotorized
+            | IHeatmapConnectivityActive
+            | IHeatmapConnectivityMotorized
+        ),
+        result_table: str,
+        result_layer_id: str,
+    ) -> bool:
+        """Compute a scenario heatmap from the cached heatmap without scenario and
+        the opportunities edited by the scenario. Only heatmaps which are a sum over
+        opportunities can be corrected like this.
+
+        :return: Whether the heatmap was computed.
+        """
+
+        return False
+
+    def get_origin_table(
+        self,
+        params: (
+            IHeatmapGravityActive
+            | IHeatmapGravityMotorized
+            | IHeatmapClosestAverageActive
+            | IHeatmapClosestAverageMotorized
+            | IHeatmapConnectivityActive
+            | IHeatmapConnectivityMotorized
+        ),
+        opportunity_table: str,
+    ):
+        """Get the table of the origin cells of the heatmap in the matrix, with
+        their h3_index, h3_3 and max_traveltime."""
+
+        return opportunity_table
+
+    async def load_traveltime_matrix(
+        self,
+        routing_type: ActiveRoutingHeatmapType | MotorizedRoutingHeatmapType,
+        opportunity_table: str,
+    ) -> dict:
+        """Load the matrix rows of the opportunity cells up to their max travel
+        time as compressed sparse rows. They are read from the local shards if the
+        matrix was exported, otherwise from the database. The opportunity table can
+        also be an aliased subquery with h3_index, h3_3 and max_traveltime."""
+
+        matrix_table = TRAVELTIME_MATRIX_TABLE[routing_type]
+        if traveltime_matrix_shards.exists(matrix_table):
+            sql_origins = f"""
+                SELECT h3_index::bigint, h3_3, max_traveltime
+                FROM {opportunity_table};
+            """
+            rows = (await self.async_session.execute(sql_origins)).fetchall()
+            return await asyncio.to_thread(
+                traveltime_matrix_shards.load_csr,
+                matrix_table,
+                *(list(zip(*rows, strict=True)) or [[], [], []]),
+            )
+
+        sql_matrix = f"""
+            SELECT matrix.orig_id::bigint, matrix.traveltime, matrix.dest_id::bigint[]
+            FROM (
+                SELECT h3_3, h3_index, MAX(max_traveltime) AS max_traveltime
+                FROM {opportunity_table}
+                GROUP BY h3_3, h3_index
+            ) opportunity, {matrix_table} matrix
+            WHERE matrix.h3_3 = opportunity.h3_3
+            AND matrix.orig_id = opportunity.h3_index
+            AND matrix.traveltime <= opportunity.max_traveltime;
+        """
+        rows = (await self.async_session.execute(sql_matrix)).fetchall()
+        return await asyncio.to_thread(
+            build_traveltime_matrix_csr,
+            *(list(zip(*rows, strict=True)) or [[], [], []]),
+        )
+
+    async def write_heatmap_cells(
+        self,
+        result_table: str,
+        result_layer_id: str,
+        h3_index: np.ndarray,
+        accessibility: np.ndarray,
+        opportunity_count: np.ndarray | None = None,
+    ):
+        """Bulk write H3 cells computed in memory to the result table. The number
+        of opportunities reaching each cell is kept in integer_attr1 if given."""
+
+        # Copy cells to a temporal table and insert them as H3 cells
+        temp_cells = await self.create_temp_table_name("cells")
+        await self.async_session.execute(
+            f"CREATE TABLE {temp_cells} (h3_index bigint, accessibility float8, opportunity_count int);"
+        )
+        await copy_records_to_table(
+            self.async_session,
+            temp_cells,
+            ["h3_index", "accessibility", "opportunity_count"],
+            list(
+                zip(
+                    h3_index.tolist(),
+                    accessibility.tolist(),
+                    (
+                        [None] * len(h3_index)
+                        if opportunity_count is None
+                        else opportunity_count.tolist()
+                    ),
+                    strict=True,
+                )
+            ),
+        )
+
+        await self.async_session.execute(
+            f"""
+            INSERT INTO {result_table} (layer_id, {get_h3_result_column()}, text_attr1, float_attr1, integer_attr1)
+            SELECT '{result_layer_id}', {get_h3_result_value("h3_index::h3index")}, h3_index::h3index, accessibility, opportunity_count
+            FROM {temp_cells};
+            """
+        )
+
+    async def run_partitioned(
+        self,
+        opportunity_table: str,
+        partial_table_columns: str,
+        build_partition_query: Callable[..., str],
+        job_step_name: str,
+        by_opportunity: bool = True,
+    ):
+        """Run the query of a heatmap separately for the opportunities of each h3_3
+        cell, so each query is routed to a single shard of the matrix. Partitions are
+        computed concurrently on pooled connections and write partial results to a
+        temporal table, which is merged by the caller.
+
+        :param partial_table_columns: The column definitions of the partial table.
+        :param build_partition_query: Builds the query inserting the partial results
+            into partial_table, for the opportunities matching opportunity_filter, a
+            condition on the "opportunity" alias.
+        :param by_opportunity: Whether cells of the same opportunity id must be
+            computed together. Opportunities spanning several h3_3 cells are then
+            computed in a partition of their own.
+        :return: The name of the partial table.
+        """
+
+        partial_table = await self.create_temp_table_name("partial")
+        await self.async_session.execute(
+            f"CREATE TABLE {partial_table} ({partial_table_columns});"
+        )
+
+        spanning_ids = []
+        if by_opportunity:
+            sql_spanning_ids = f"""
+                SELECT id FROM {opportunity_table}
+                GROUP BY id
+                HAVING COUNT(DISTINCT h3_3) > 1;
+            """
+            spanning_ids = [
+                f"'{row[0]}'"
+                for row in (await self.async_session.execute(sql_spanning_ids)).all()
+            ]
+        sql_partitions = f"SELECT DISTINCT h3_3 FROM {opportunity_table};"
+        conditions = [
+            f"opportunity.h3_3 = {row[0]}"
+            + (
+                f" AND opportunity.id NOT IN ({', '.join(spanning_ids)})"
+                if spanning_ids
+                else ""
+            )
+            for row in (await self.async_session.execute(sql_partitions)).all()
+        ]
+        if spanning_ids:
+            conditions.append(f"opportunity.id IN ({', '.join(spanning_ids)})")
+
+        semaphore = asyncio.Semaphore(settings.HEATMAP_MAX_CONCURRENT_PARTITIONS)
+
+        async def compute_partition(condition: str):
+            # The session of the job can't be shared between tasks
+            async with semaphore, AsyncSession(self.async_session.bind) as session:
+                await session.execute(
+                    build_partition_query(
+                        opportunity_filter=condition, partial_table=partial_table
+                    )
+                )
+
+        tasks = [
+            asyncio.create_task(compute_partition(condition))
+            for condition in conditions
+        ]
+        cnt_computed = 0
+        try:
+            for task in asyncio.as_completed(tasks):
+                await task
+                cnt_computed += 1
+                await crud_job.update_status(
+                    async_session=self.async_session,
+                    job_id=self.job_id,
+                    job_step_name=job_step_name,
+                    status=JobStatusType.running.value,
+                    msg_text=f"Computed {cnt_computed} of {len(tasks)} partitions.",
+                )
+        finally:
+            # Don't leave queries running if a partition failed or the job timed out
+            for task in tasks:
+                task.cancel()
+
+        return partial_table
+
+    def build_merge_sum_query(
+        self,
+        partial_table: str,
+        result_table: str,
+        result_layer_id: str,
+        opportunity_count: bool = False,
+    ):
+        """Builds SQL query summing the partial accessibility of each cell, and the
+        partial opportunity_count into integer_attr1 if enabled."""
+
+        return f"""
+            INSERT INTO {result_table} (layer_id, {get_h3_result_column()}, text_attr1, float_attr1, integer_attr1)
+            SELECT '{result_layer_id}', {get_h3_result_value("h3_index")}, h3_index, SUM(accessibility),
+                {"SUM(opportunity_count)" if opportunity_count else "NULL"}
+            FROM {partial_table}
+            GROUP BY h3_index;
+        """
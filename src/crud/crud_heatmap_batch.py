@@ -0,0 +1,119 @@
+from src.core.config import settings
+from src.core.heatmap_cache import heatmap_result_cache
+from src.core.job import job_init, job_log, run_background_or_immediately
+from src.crud.crud_heatmap import CRUDHeatmapBase
+from src.crud.crud_heatmap_closest_average import CRUDHeatmapClosestAverage
+from src.crud.crud_heatmap_connectivity import CRUDHeatmapConnectivity
+from src.crud.crud_heatmap_gravity import CRUDHeatmapGravity
+from src.schemas.heatmap import (
+    HeatmapIndicatorType,
+    IHeatmapBatchActive,
+    IHeatmapBatchMotorized,
+)
+from src.schemas.job import JobStatusType
+
+HEATMAP_INDICATOR_CRUD = {
+    HeatmapIndicatorType.gravity: CRUDHeatmapGravity,
+    HeatmapIndicatorType.closest_average: CRUDHeatmapClosestAverage,
+    HeatmapIndicatorType.connectivity: CRUDHeatmapConnectivity,
+}
+
+
+class CRUDHeatmapBatch(CRUDHeatmapBase):
+    def __init__(self, job_id, background_tasks, async_session, user_id, project_id):
+        super().__init__(job_id, background_tasks, async_session, user_id, project_id)
+
+    @job_log(job_step_name="heatmap_batch")
+    async def heatmap(self, params: IHeatmapBatchActive | IHeatmapBatchMotorized):
+        """Compute several heatmaps of the same routing type, reading the matrix rows
+        of all their cells once."""
+
+        # Initialize result table
+        result_table = await self.get_h3_result_table()
+
+        # Copy the cached heatmaps & create the opportunity tables of the others
+        indicators = []
+        uncached_indicators = []
+        for indicator_type, indicator_params in params.get_indicator_params():
+            crud_indicator = HEATMAP_INDICATOR_CRUD[indicator_type](
+                job_id=self.job_id,
+                background_tasks=self.background_tasks,
+                async_session=self.async_session,
+                user_id=self.user_id,
+                project_id=self.project_id,
+            )
+            layer_heatmap = crud_indicator.get_result_layer(indicator_params)
+            indicators.append((crud_indicator, indicator_params, layer_heatmap))
+
+            cache_key = await crud_indicator.get_cache_key(indicator_params)
+            if cache_key and await heatmap_result_cache.copy(
+                async_session=self.async_session,
+                key=cache_key,
+                result_table=result_table,
+                layer_id=str(layer_heatmap.id),
+            ):
+                continue
+            opportunity_table = await crud_indicator.create_opportunity_table(
+                indicator_params
+            )
+            uncached_indicators.append(
+                (
+                    crud_indicator,
+                    indicator_params,
+                    layer_heatmap,
+                    opportunity_table,
+                    cache_key,
+                )
+            )
+
+        if uncached_indicators:
+            # Load the matrix rows of the cells of all indicators at once
+            origin_tables = " UNION ALL ".join(
+                f"SELECT h3_index, h3_3, max_traveltime FROM {crud_indicator.get_origin_table(indicator_params, opportunity_table)}"
+                for crud_indicator, indicator_params, _, opportunity_table, _ in (
+                    uncached_indicators
+                )
+            )
+            matrix = await self.load_traveltime_matrix(
+                params.routing_type, f"({origin_tables}) origins"
+            )
+
+        # Compute each heatmap from the loaded matrix
+        for (
+            crud_indicator,
+            indicator_params,
+            layer_heatmap,
+            opportunity_table,
+            cache_key,
+        ) in uncached_indicators:
+            await crud_indicator.compute_heatmap(
+                params=indicator_params,
+                opportunity_table=opportunity_table,
+                result_table=result_table,
+                result_layer_id=str(layer_heatmap.id),
+                matrix=matrix,
+            )
+            if cache_key:
+                await heatmap_result_cache.put(
+                    async_session=self.async_session,
+                    key=cache_key,
+                    result_table=result_table,
+                    layer_id=str(layer_heatmap.id),
+                )
+
+        # Register the feature layer of each heatmap
+        for crud_indicator, indicator_params, layer_heatmap in indicators:
+            await crud_indicator.create_feature_layer_tool(
+                layer_in=layer_heatmap,
+                params=indicator_params,
+            )
+
+        return {
+            "status": JobStatusType.finished.value,
+            "msg": "Heatmap batch was successfully computed.",
+        }
+
+    @run_background_or_immediately(settings)
+    @job_init()
+    async def run_heatmap(self, params: IHeatmapBatchActive | IHeatmapBatchMotorized):
+        return await self.heatmap(params=params)
@@ -1,14 +1,18 @@
+import asyncio
+from functools import partial
 from typing import List
 from uuid import UUID
 
 from src.core.config import settings
 from src.core.job import job_init, job_log, run_background_or_immediately
 from src.crud.crud_heatmap import CRUDHeatmapBase
+from src.heatmap import build_opportunity_csr, compute_closest_average_heatmap
 from src.schemas.heatmap import (
     ROUTING_MODE_DEFAULT_SPEED,
     TRAVELTIME_MATRIX_RESOLUTION,
     TRAVELTIME_MATRIX_TABLE,
     ActiveRoutingHeatmapType,
+    HeatmapEngineType,
     IHeatmapClosestAverageActive,
     IHeatmapClosestAverageMotorized,
     MotorizedRoutingHeatmapType,
@@ -16,7 +20,11 @@ from src.schemas.heatmap import (
 from src.schemas.job import JobStatusType
 from src.schemas.layer import FeatureGeometryType, IFeatureLayerToolCreate
 from src.schemas.toolbox_base import DefaultResultLayerName
-from src.utils import format_value_null_sql
+from src.utils import (
+    format_value_null_sql,
+    get_h3_result_column,
+    get_h3_result_value,
+)
 
 
 class CRUDHeatmapClosestAverage(CRUDHeatmapBase):
@@ -83,6 +91,34 @@ class CRUDHeatmapClosestAverage(CRUDHeatmapBase):
 
         return temp_points
 
+    def build_grouped_destinations(
+        self,
+        params: IHeatmapClosestAverageActive | IHeatmapClosestAverageMotorized,
+        opportunity_table: str,
+        opportunity_filter: str | None = None,
+    ):
+        """Builds SQL query of the closest travel times of each reached cell and
+        number of destinations."""
+
+        opportunity_filter = f"AND {opportunity_filter}" if opportunity_filter else ""
+        return f"""
+            SELECT dest_id, num_destinations, (ARRAY_AGG(traveltime ORDER BY traveltime))[1:num_destinations] AS traveltime
+            FROM (
+                SELECT opportunity_id, dest_id.value AS dest_id, min(traveltime) AS traveltime, num_destinations
+                FROM (
+                    SELECT opportunity.id AS opportunity_id, matrix.orig_id, matrix.dest_id, matrix.traveltime, opportunity.num_destinations
+                    FROM {opportunity_table} opportunity, {TRAVELTIME_MATRIX_TABLE[params.routing_type]} matrix
+                    WHERE matrix.h3_3 = opportunity.h3_3
+                    AND matrix.orig_id = opportunity.h3_index
+                    AND matrix.traveltime <= opportunity.max_traveltime
+                    {opportunity_filter}
+                ) sub_matrix
+                JOIN LATERAL UNNEST(sub_matrix.dest_id) dest_id(value) ON TRUE
+                GROUP BY opportunity_id, dest_id.value, num_destinations
+            ) grouped_opportunities
+            GROUP BY dest_id, num_destinations
+        """
+
     def build_query(
         self,
         params: IHeatmapClosestAverageActive | IHeatmapClosestAverageMotorized,
@@ -93,24 +129,9 @@ class CRUDHeatmapClosestAverage(CRUDHeatmapBase):
         """Builds SQL query to compute heatmap closest-average."""
 
         query = f"""
-            INSERT INTO {result_table} (layer_id, geom, text_attr1, float_attr1)
-            WITH grouped AS (
-                SELECT dest_id, (ARRAY_AGG(traveltime ORDER BY traveltime))[1:num_destinations] AS traveltime
-                FROM (
-                    SELECT opportunity_id, dest_id.value AS dest_id, min(traveltime) AS traveltime, num_destinations
-                    FROM (
-                        SELECT opportunity.id AS opportunity_id, matrix.orig_id, matrix.dest_id, matrix.traveltime, opportunity.num_destinations
-                        FROM {opportunity_table} opportunity, {TRAVELTIME_MATRIX_TABLE[params.routing_type]} matrix
-                        WHERE matrix.h3_3 = opportunity.h3_3
-                        AND matrix.orig_id = opportunity.h3_index
-                        AND matrix.traveltime <= opportunity.max_traveltime
-                    ) sub_matrix
-                    JOIN LATERAL UNNEST(sub_matrix.dest_id) dest_id(value) ON TRUE
-                    GROUP BY opportunity_id, dest_id.value, num_destinations
-                ) grouped_opportunities
-                GROUP BY dest_id, num_destinations
-            )
-            SELECT '{result_layer_id}', ST_SetSRID(h3_cell_to_boundary(grouped.dest_id)::geometry, 4326), grouped.dest_id,
+            INSERT INTO {result_table} (layer_id, {get_h3_result_column()}, text_attr1, float_attr1)
+            WITH grouped AS ({self.build_grouped_destinations(params, opportunity_table)})
+            SELECT '{result_layer_id}', {get_h3_result_value("grouped.dest_id")}, grouped.dest_id,
                 AVG(traveltime.value) AS accessibility
             FROM grouped
             JOIN LATERAL UNNEST(grouped.traveltime) traveltime(value) ON TRUE
@@ -119,33 +140,145 @@ class CRUDHeatmapClosestAverage(CRUDHeatmapBase):
 
         return query
 
-    @job_log(job_step_name="heatmap_closest_average")
-    async def heatmap(
+    def build_partition_query(
         self,
         params: IHeatmapClosestAverageActive | IHeatmapClosestAverageMotorized,
+        opportunity_table: str,
+        opportunity_filter: str,
+        partial_table: str,
     ):
-        """Compute heatmap closest-average."""
+        """Builds SQL query to compute the closest travel times of the opportunities
+        matching a filter."""
+
+        return f"""
+            INSERT INTO {partial_table} (h3_index, num_destinations, traveltime)
+            {self.build_grouped_destinations(params, opportunity_table, opportunity_filter)};
+        """
+
+    def build_merge_query(
+        self, partial_table: str, result_table: str, result_layer_id: str
+    ):
+        """Builds SQL query averaging the closest travel times of all partitions."""
+
+        return f"""
+            INSERT INTO {result_table} (layer_id, {get_h3_result_column()}, text_attr1, float_attr1)
+            WITH grouped AS (
+                SELECT h3_index, (ARRAY_AGG(traveltime.value ORDER BY traveltime.value))[1:num_destinations] AS traveltime
+                FROM {partial_table}
+                JOIN LATERAL UNNEST({partial_table}.traveltime) traveltime(value) ON TRUE
+                GROUP BY h3_index, num_destinations
+            )
+            SELECT '{result_layer_id}', {get_h3_result_value("grouped.h3_index")}, grouped.h3_index,
+                AVG(traveltime.value) AS accessibility
+            FROM grouped
+            JOIN LATERAL UNNEST(grouped.traveltime) traveltime(value) ON TRUE
+            GROUP BY grouped.h3_index;
+        """
+
+    async def compute_heatmap_partitioned(
+        self,
+        params: IHeatmapClosestAverageActive | IHeatmapClosestAverageMotorized,
+        opportunity_table: str,
+        result_table: str,
+        result_layer_id: str,
+    ):
+        """Compute the closest travel times per h3_3 partition of the opportunities
+        concurrently & average the closest of them for each cell."""
+
+        partial_table = await self.run_partitioned(
+            opportunity_table=opportunity_table,
+            partial_table_columns="h3_index h3index, num_destinations int, traveltime smallint[]",
+            build_partition_query=partial(
+                self.build_partition_query,
+                params=params,
+                opportunity_table=opportunity_table,
+            ),
+            job_step_name="heatmap_closest_average",
+        )
+        await self.async_session.execute(
+            self.build_merge_query(
+                partial_table=partial_table,
+                result_table=result_table,
+                result_layer_id=result_layer_id,
+            )
+        )
+
+    async def compute_heatmap_numba(
+        self,
+        params: IHeatmapClosestAverageActive | IHeatmapClosestAverageMotorized,
+        opportunity_table: str,
+        result_table: str,
+        result_layer_id: str,
+        matrix: dict | None = None,
+    ):
+        """Compute heatmap closest-average in memory, keeping only the closest
+        travel times of each cell instead of sorting all reached opportunities. A
+        matrix already loaded for the opportunity cells can be passed."""
+
+        sql_opportunities = f"""
+            SELECT id, h3_index::bigint, max_traveltime, num_destinations
+            FROM {opportunity_table};
+        """
+        opportunity_rows = (
+            await self.async_session.execute(sql_opportunities)
+        ).fetchall()
+
+        if matrix is None:
+            matrix = await self.load_traveltime_matrix(
+                params.routing_type, opportunity_table
+            )
+
+        # Run the kernel off the event loop
+        def compute():
+            id, h3_index, max_traveltime, num_destinations = list(
+                zip(*opportunity_rows, strict=True)
+            ) or [[], [], [], []]
+            opportunities = build_opportunity_csr(
+                id,
+                h3_index,
+                max_traveltime,
+                matrix_orig_id=matrix["orig_id"],
+                num_destinations=num_destinations,
+            )
+            return compute_closest_average_heatmap(
+                matrix=matrix, opportunities=opportunities
+            )
+
+        heatmap = await asyncio.to_thread(compute)
+
+        await self.write_heatmap_cells(
+            result_table=result_table,
+            result_layer_id=result_layer_id,
+            h3_index=heatmap["h3_index"],
+            accessibility=heatmap["accessibility"],
+        )
+
+    async def create_opportunity_table(
+        self, params: IHeatmapClosestAverageActive | IHeatmapClosestAverageMotorized
+    ):
+        """Fetch the opportunity layers and create the opportunity table."""
 
-        # Fetch opportunity tables
         layers, opportunity_geofence_layer = await self.fetch_opportunity_layers(params)
-        opportunity_table = await self.create_distributed_opportunity_table(
+        return await self.create_distributed_opportunity_table(
             params.routing_type,
             layers,
             params.scenario_id,
             opportunity_geofence_layer,
         )
 
-        # Initialize result table
-        result_table = f"{settings.USER_DATA_SCHEMA}.{FeatureGeometryType.polygon.value}_{str(self.user_id).replace('-', '')}"
+    def get_result_layer(
+        self, params: IHeatmapClosestAverageActive | IHeatmapClosestAverageMotorized
+    ):
+        """Create the feature layer to store the computed heatmap output."""
 
-        # Create feature layer to store computed heatmap output
-        layer_heatmap = IFeatureLayerToolCreate(
+        return IFeatureLayerToolCreate(
             name=(
                 DefaultResultLayerName.heatmap_closest_average_active_mobility.value
                 if type(params.routing_type) == ActiveRoutingHeatmapType
                 else DefaultResultLayerName.heatmap_closest_average_motorized_mobility.value
             ),
             feature_layer_geometry_type=FeatureGeometryType.polygon,
+            data_type=self.get_h3_result_data_type(),
             attribute_mapping={
                 "text_attr1": "h3_index",
                 "float_attr1": "accessibility",
@@ -154,14 +287,60 @@ class CRUDHeatmapClosestAverage(CRUDHeatmapBase):
             job_id=self.job_id,
         )
 
-        # Compute heatmap & write to result table
-        await self.async_session.execute(
-            self.build_query(
+    async def compute_heatmap(
+        self,
+        params: IHeatmapClosestAverageActive | IHeatmapClosestAverageMotorized,
+        opportunity_table: str,
+        result_table: str,
+        result_layer_id: str,
+        matrix: dict | None = None,
+    ):
+        """Compute heatmap closest-average with the engine of the params & write it
+        to the result table."""
+
+        if params.engine == HeatmapEngineType.numba:
+            await self.compute_heatmap_numba(
+                params=params,
+                opportunity_table=opportunity_table,
+                result_table=result_table,
+                result_layer_id=result_layer_id,
+                matrix=matrix,
+            )
+        elif params.engine == HeatmapEngineType.sql_partitioned:
+            await self.compute_heatmap_partitioned(
                 params=params,
                 opportunity_table=opportunity_table,
                 result_table=result_table,
-                result_layer_id=str(layer_heatmap.id),
+                result_layer_id=result_layer_id,
+            )
+        else:
+            await self.async_session.execute(
+                self.build_query(
+                    params=params,
+                    opportunity_table=opportunity_table,
+                    result_table=result_table,
+                    result_layer_id=result_layer_id,
+                )
             )
+
+    @job_log(job_step_name="heatmap_closest_average")
+    async def heatmap(
+        self,
+        params: IHeatmapClosestAverageActive | IHeatmapClosestAverageMotorized,
+    ):
+        """Compute heatmap closest-average."""
+
+        # Initialize result table
+        result_table = await self.get_h3_result_table()
+
+        # Create feature layer to store computed heatmap output
+        layer_heatmap = self.get_result_layer(params)
+
+        # Compute heatmap & write to result table, or copy it from the cache
+        await self.compute_heatmap_cached(
+            params=params,
+            result_table=result_table,
+            result_layer_id=str(layer_heatmap.id),
         )
 
         # Register feature layer
@@ -1,14 +1,21 @@
+import asyncio
+from functools import partial
 from uuid import UUID
 
+import h3
+
 from pydantic import BaseModel
 
 from src.core.config import settings
 from src.core.job import job_init, job_log, run_background_or_immediately
-from src.core.tool import CRUDToolBase
+from src.core.traveltime_matrix import get_reachability_table, reachability_exists
+from src.crud.crud_heatmap import CRUDHeatmapBase
+from src.heatmap import compute_connectivity_heatmap
 from src.schemas.heatmap import (
     TRAVELTIME_MATRIX_RESOLUTION,
     TRAVELTIME_MATRIX_TABLE,
     ActiveRoutingHeatmapType,
+    HeatmapEngineType,
     IHeatmapConnectivityActive,
     IHeatmapConnectivityMotorized,
     MotorizedRoutingHeatmapType,
@@ -16,10 +23,14 @@ from src.schemas.heatmap import (
 from src.schemas.job import JobStatusType
 from src.schemas.layer import FeatureGeometryType, IFeatureLayerToolCreate
 from src.schemas.toolbox_base import DefaultResultLayerName
-from src.utils import format_value_null_sql
+from src.utils import (
+    format_value_null_sql,
+    get_h3_result_column,
+    get_h3_result_value,
+)
 
 
-class CRUDHeatmapConnectivity(CRUDToolBase):
+class CRUDHeatmapConnectivity(CRUDHeatmapBase):
     def __init__(self, job_id, background_tasks, async_session, user_id, project_id):
         super().__init__(job_id, background_tasks, async_session, user_id, project_id)
 
@@ -51,55 +62,192 @@ class CRUDHeatmapConnectivity(CRUDToolBase):
 
         return temp_points
 
+    def build_reachable_area(
+        self,
+        params: IHeatmapConnectivityActive | IHeatmapConnectivityMotorized,
+        reference_area_table: str,
+        use_reachability: bool = False,
+        opportunity_filter: str | None = None,
+    ):
+        """Builds SQL query of the area reachable from each reference area cell.
+        With use_reachability, the reachable cells are read from the precomputed
+        cumulative counts instead of summing the matrix rows."""
+
+        h3_cell_area = f"((3 * SQRT(3) / 2) * POWER(h3_get_hexagon_edge_length_avg({TRAVELTIME_MATRIX_RESOLUTION[params.routing_type]}, 'm'), 2))"
+        opportunity_filter = f"AND {opportunity_filter}" if opportunity_filter else ""
+
+        if use_reachability:
+            reachable_cells = (
+                f"reachability.reachable_cells[{params.max_traveltime + 1}]"
+            )
+            return f"""
+                SELECT reachability.orig_id AS h3_index, SUM({reachable_cells} * {h3_cell_area}) AS accessibility
+                FROM {reference_area_table} opportunity, {get_reachability_table(TRAVELTIME_MATRIX_TABLE[params.routing_type])} reachability
+                WHERE reachability.h3_3 = opportunity.h3_3
+                AND reachability.orig_id = opportunity.h3_index
+                AND {reachable_cells} > 0
+                {opportunity_filter}
+                GROUP BY reachability.orig_id
+            """
+
+        return f"""
+            SELECT matrix.orig_id AS h3_index, SUM(ARRAY_LENGTH(matrix.dest_id, 1) * {h3_cell_area}) AS accessibility
+            FROM {reference_area_table} opportunity, {TRAVELTIME_MATRIX_TABLE[params.routing_type]} matrix
+            WHERE matrix.h3_3 = opportunity.h3_3
+            AND matrix.orig_id = opportunity.h3_index
+            AND matrix.traveltime <= {params.max_traveltime}
+            {opportunity_filter}
+            GROUP BY matrix.orig_id
+        """
+
     def build_query(
         self,
         params: IHeatmapConnectivityActive | IHeatmapConnectivityMotorized,
         reference_area_table: str,
         result_table: str,
         result_layer_id: str,
+        use_reachability: bool = False,
     ):
         """Builds SQL query to compute heatmap connectivity."""
 
-        h3_cell_area = f"((3 * SQRT(3) / 2) * POWER(h3_get_hexagon_edge_length_avg({TRAVELTIME_MATRIX_RESOLUTION[params.routing_type]}, 'm'), 2))"
-
         query = f"""
-            INSERT INTO {result_table} (layer_id, geom, text_attr1, float_attr1)
-            SELECT '{result_layer_id}', ST_SetSRID(h3_cell_to_boundary(matrix.orig_id)::geometry, 4326),
-                matrix.orig_id, SUM(ARRAY_LENGTH(matrix.dest_id, 1) * {h3_cell_area})
-            FROM {reference_area_table} o, {TRAVELTIME_MATRIX_TABLE[params.routing_type]} matrix
-            WHERE matrix.h3_3 = o.h3_3
-            AND matrix.orig_id = o.h3_index
-            AND matrix.traveltime <= {params.max_traveltime}
-            GROUP BY matrix.orig_id;
+            INSERT INTO {result_table} (layer_id, {get_h3_result_column()}, text_attr1, float_attr1)
+            SELECT '{result_layer_id}', {get_h3_result_value("h3_index")}, h3_index, accessibility
+            FROM ({self.build_reachable_area(params, reference_area_table, use_reachability)}) reachable_area;
         """
         return query
 
-    @job_log(job_step_name="heatmap_connectivity")
-    async def heatmap(
+    def build_partition_query(
         self,
         params: IHeatmapConnectivityActive | IHeatmapConnectivityMotorized,
+        reference_area_table: str,
+        use_reachability: bool,
+        opportunity_filter: str,
+        partial_table: str,
     ):
-        """Compute heatmap connectivity."""
+        """Builds SQL query to compute the reachable area of the reference area
+        cells matching a filter."""
+
+        return f"""
+            INSERT INTO {partial_table} (h3_index, accessibility)
+            {self.build_reachable_area(params, reference_area_table, use_reachability, opportunity_filter)};
+        """
+
+    async def compute_heatmap_partitioned(
+        self,
+        params: IHeatmapConnectivityActive | IHeatmapConnectivityMotorized,
+        reference_area_table: str,
+        result_table: str,
+        result_layer_id: str,
+        use_reachability: bool = False,
+    ):
+        """Compute heatmap connectivity per h3_3 partition of the reference area
+        concurrently."""
+
+        partial_table = await self.run_partitioned(
+            opportunity_table=reference_area_table,
+            partial_table_columns="h3_index h3index, accessibility float8",
+            build_partition_query=partial(
+                self.build_partition_query,
+                params=params,
+                reference_area_table=reference_area_table,
+                use_reachability=use_reachability,
+            ),
+            job_step_name="heatmap_connectivity",
+            by_opportunity=False,
+        )
+        await self.async_session.execute(
+            self.build_merge_sum_query(
+                partial_table=partial_table,
+                result_table=result_table,
+                result_layer_id=result_layer_id,
+            )
+        )
+
+    def get_origin_table(
+        self,
+        params: IHeatmapConnectivityActive | IHeatmapConnectivityMotorized,
+        opportunity_table: str,
+    ):
+        return f"""(
+            SELECT h3_index, h3_3, {params.max_traveltime} AS max_traveltime
+            FROM {opportunity_table}
+        ) reference_area"""
+
+    async def compute_heatmap_numba(
+        self,
+        params: IHeatmapConnectivityActive | IHeatmapConnectivityMotorized,
+        opportunity_table: str,
+        result_table: str,
+        result_layer_id: str,
+        matrix: dict | None = None,
+    ):
+        """Compute heatmap connectivity in memory from the matrix rows of the
+        reference area cells. A matrix already loaded for the reference area cells
+        can be passed."""
+
+        sql_reference_area = f"SELECT h3_index::bigint FROM {opportunity_table};"
+        h3_index = [
+            row[0]
+            for row in (await self.async_session.execute(sql_reference_area)).fetchall()
+        ]
+
+        if matrix is None:
+            matrix = await self.load_traveltime_matrix(
+                params.routing_type,
+                self.get_origin_table(params, opportunity_table),
+            )
+
+        edge_length = h3.edge_length(
+            TRAVELTIME_MATRIX_RESOLUTION[params.routing_type], unit="m"
+        )
+        heatmap = await asyncio.to_thread(
+            compute_connectivity_heatmap,
+            matrix=matrix,
+            h3_index=h3_index,
+            max_traveltime=params.max_traveltime,
+            cell_area=(3 * 3**0.5 / 2) * edge_length**2,
+        )
+
+        await self.write_heatmap_cells(
+            result_table=result_table,
+            result_layer_id=result_layer_id,
+            h3_index=heatmap["h3_index"],
+            accessibility=heatmap["accessibility"],
+        )
+
+    async def get_input_layers_project(
+        self, params: IHeatmapConnectivityActive | IHeatmapConnectivityMotorized
+    ):
+        """Get the reference area layer the heatmap is computed for."""
+
+        return list((await self.get_layers_project(params)).values())
+
+    async def create_opportunity_table(
+        self, params: IHeatmapConnectivityActive | IHeatmapConnectivityMotorized
+    ):
+        """Fetch the reference area layer and create the reference area table."""
 
-        # Fetch reference area table
         reference_area_layer = await self.get_layers_project(params)
-        reference_area_table = await self.create_distributed_opportunity_table(
+        return await self.create_distributed_opportunity_table(
             params.routing_type,
             reference_area_layer["reference_area_layer_project_id"],
             params.scenario_id,
         )
 
-        # Initialize result table
-        result_table = f"{settings.USER_DATA_SCHEMA}.{FeatureGeometryType.polygon.value}_{str(self.user_id).replace('-', '')}"
+    def get_result_layer(
+        self, params: IHeatmapConnectivityActive | IHeatmapConnectivityMotorized
+    ):
+        """Create the feature layer to store the computed heatmap output."""
 
-        # Create feature layer to store computed heatmap output
-        layer_heatmap = IFeatureLayerToolCreate(
+        return IFeatureLayerToolCreate(
             name=(
                 DefaultResultLayerName.heatmap_connectivity_active_mobility.value
                 if type(params.routing_type) == ActiveRoutingHeatmapType
                 else DefaultResultLayerName.heatmap_connectivity_motorized_mobility.value
             ),
             feature_layer_geometry_type=FeatureGeometryType.polygon,
+            data_type=self.get_h3_result_data_type(),
             attribute_mapping={
                 "text_attr1": "h3_index",
                 "float_attr1": "accessibility",
@@ -108,14 +256,67 @@ class CRUDHeatmapConnectivity(CRUDToolBase):
             job_id=self.job_id,
         )
 
-        # Compute heatmap & write to output table
-        await self.async_session.execute(
-            self.build_query(
+    async def compute_heatmap(
+        self,
+        params: IHeatmapConnectivityActive | IHeatmapConnectivityMotorized,
+        opportunity_table: str,
+        result_table: str,
+        result_layer_id: str,
+        matrix: dict | None = None,
+    ):
+        """Compute heatmap connectivity with the engine of the params & write it to
+        the result table."""
+
+        if params.engine == HeatmapEngineType.numba:
+            await self.compute_heatmap_numba(
                 params=params,
-                reference_area_table=reference_area_table,
+                opportunity_table=opportunity_table,
+                result_table=result_table,
+                result_layer_id=result_layer_id,
+                matrix=matrix,
+            )
+            return
+
+        use_reachability = await reachability_exists(
+            self.async_session, TRAVELTIME_MATRIX_TABLE[params.routing_type]
+        )
+        if params.engine == HeatmapEngineType.sql_partitioned:
+            await self.compute_heatmap_partitioned(
+                params=params,
+                reference_area_table=opportunity_table,
                 result_table=result_table,
-                result_layer_id=str(layer_heatmap.id),
+                result_layer_id=result_layer_id,
+                use_reachability=use_reachability,
             )
+        else:
+            await self.async_session.execute(
+                self.build_query(
+                    params=params,
+                    reference_area_table=opportunity_table,
+                    result_table=result_table,
+                    result_layer_id=result_layer_id,
+                    use_reachability=use_reachability,
+                )
+            )
+
+    @job_log(job_step_name="heatmap_connectivity")
+    async def heatmap(
+        self,
+        params: IHeatmapConnectivityActive | IHeatmapConnectivityMotorized,
+    ):
+        """Compute heatmap connectivity."""
+
+        # Initialize result table
+        result_table = await self.get_h3_result_table()
+
+        # Create feature layer to store computed heatmap output
+        layer_heatmap = self.get_result_layer(params)
+
+        # Compute heatmap & write to output table, or copy it from the cache
+        await self.compute_heatmap_cached(
+            params=params,
+            result_table=result_table,
+            result_layer_id=str(layer_heatmap.id),
         )
         # Register feature layer
         await self.create_feature_layer_tool(
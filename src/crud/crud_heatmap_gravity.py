@@ -1,14 +1,23 @@
+import asyncio
+from functools import partial
 from typing import List
 from uuid import UUID
 
 from src.core.config import settings
+from src.core.heatmap_cache import heatmap_result_cache
 from src.core.job import job_init, job_log, run_background_or_immediately
 from src.crud.crud_heatmap import CRUDHeatmapBase
+from src.heatmap import (
+    build_impedance_table,
+    build_opportunity_csr,
+    compute_gravity_heatmap,
+)
 from src.schemas.heatmap import (
     ROUTING_MODE_DEFAULT_SPEED,
     TRAVELTIME_MATRIX_RESOLUTION,
     TRAVELTIME_MATRIX_TABLE,
     ActiveRoutingHeatmapType,
+    HeatmapEngineType,
     IHeatmapGravityActive,
     IHeatmapGravityMotorized,
     ImpedanceFunctionType,
@@ -17,7 +26,11 @@ from src.schemas.heatmap import (
 from src.schemas.job import JobStatusType
 from src.schemas.layer import FeatureGeometryType, IFeatureLayerToolCreate
 from src.schemas.toolbox_base import DefaultResultLayerName
-from src.utils import format_value_null_sql
+from src.utils import (
+    format_value_null_sql,
+    get_h3_result_column,
+    get_h3_result_value,
+)
 
 
 class CRUDHeatmapGravity(CRUDHeatmapBase):
@@ -31,8 +44,11 @@ class CRUDHeatmapGravity(CRUDHeatmapBase):
         layers: List[dict],
         scenario_id: UUID,
         opportunity_geofence_layer,
+        scenario_version: bool | None = None,
     ):
-        """Create distributed table for user-specified opportunities."""
+        """Create distributed table for user-specified opportunities. With
+        scenario_version, only the opportunities edited by the scenario are
+        included, as changed by the scenario if True or as in the layer if False."""
 
         # Create temp table name for points
         temp_points = await self.create_temp_table_name("points")
@@ -83,7 +99,8 @@ class CRUDHeatmapGravity(CRUDHeatmapBase):
                     '{temp_points}',
                     {TRAVELTIME_MATRIX_RESOLUTION[routing_type]},
                     {layer["geom_type"] == FeatureGeometryType.polygon},
-                    {append_to_existing}
+                    {append_to_existing},
+                    {format_value_null_sql(scenario_version)}
                 )"""
             )
 
@@ -98,21 +115,55 @@ class CRUDHeatmapGravity(CRUDHeatmapBase):
         type: ImpedanceFunctionType,
         max_traveltime: int,
         max_sensitivity: float,
+        sensitivities: List[float],
     ):
-        """Builds impedance function used to compute heatmap gravity."""
-
-        max_traveltime = float(max_traveltime)
-
-        if type == ImpedanceFunctionType.gaussian:
-            return f"SUM((EXP(1) ^ ((((traveltime / {max_traveltime}) ^ 2) * -1) / (sensitivity / {max_sensitivity}))) * potential)"
-        elif type == ImpedanceFunctionType.linear:
-            return f"SUM((1 - (traveltime / {max_traveltime})) * potential)"
-        elif type == ImpedanceFunctionType.exponential:
-            return f"SUM((EXP(1) ^ (((sensitivity / {max_sensitivity}) * -1) * (traveltime / {max_traveltime}))) * potential)"
-        elif type == ImpedanceFunctionType.power:
-            return f"SUM(((traveltime / {max_traveltime}) ^ ((sensitivity / {max_sensitivity}) * -1)) * potential)"
-        else:
-            raise ValueError(f"Unknown impedance function type: {type}")
+        """Builds impedance function used to compute heatmap gravity.
+
+        The weights of all sensitivities and travel times are computed upfront, so
+        each matrix row only looks up its weight instead of evaluating the function.
+        """
+
+        weights = build_impedance_table(
+            impedance_function=type.value,
+            sensitivities=sensitivities,
+            max_traveltime=max_traveltime,
+            max_sensitivity=max_sensitivity,
+        )
+        weights_array = ",".join(
+            "{" + ",".join(repr(float(weight)) for weight in row) + "}"
+            for row in weights
+        )
+        sensitivities_array = ",".join(repr(float(s)) for s in sensitivities)
+
+        return f"""SUM(('{{{weights_array}}}'::float8[])[
+            array_position('{{{sensitivities_array}}}'::float8[], sensitivity)
+        ][traveltime + 1] * potential)"""
+
+    def build_grouped_opportunities(
+        self,
+        params: IHeatmapGravityActive | IHeatmapGravityMotorized,
+        opportunity_table: str,
+        opportunity_filter: str | None = None,
+    ):
+        """Builds SQL query of the min travel time from each opportunity to each
+        reached cell."""
+
+        opportunity_filter = f"AND {opportunity_filter}" if opportunity_filter else ""
+        return f"""
+            SELECT opportunity_id, dest_id.value AS dest_id, min(traveltime) AS traveltime, sensitivity, potential
+            FROM
+            (
+                SELECT opportunity.id AS opportunity_id, matrix.orig_id, matrix.dest_id, matrix.traveltime,
+                    opportunity.sensitivity, opportunity.potential
+                FROM {opportunity_table} opportunity, {TRAVELTIME_MATRIX_TABLE[params.routing_type]} matrix
+                WHERE matrix.h3_3 = opportunity.h3_3
+                AND matrix.orig_id = opportunity.h3_index
+                AND matrix.traveltime <= opportunity.max_traveltime
+                {opportunity_filter}
+            ) sub_matrix
+            JOIN LATERAL UNNEST(sub_matrix.dest_id) dest_id(value) ON TRUE
+            GROUP BY opportunity_id, dest_id.value, sensitivity, potential
+        """
 
     def build_query(
         self,
@@ -120,64 +171,285 @@ class CRUDHeatmapGravity(CRUDHeatmapBase):
         opportunity_table: str,
         max_traveltime: int,
         max_sensitivity: float,
+        sensitivities: List[float],
         result_table: str,
         result_layer_id: str,
     ):
-        """Builds SQL query to compute heatmap gravity."""
+        """Builds SQL query to compute heatmap gravity and the number of
+        opportunities reaching each cell."""
 
         impedance_function = self.build_impedance_function(
             type=params.impedance_function,
             max_traveltime=max_traveltime,
             max_sensitivity=max_sensitivity,
+            sensitivities=sensitivities,
         )
 
         query = f"""
-            INSERT INTO {result_table} (layer_id, geom, text_attr1, float_attr1)
-            SELECT '{result_layer_id}', ST_SetSRID(h3_cell_to_boundary(dest_id)::geometry, 4326), dest_id,
-                {impedance_function} AS accessibility
-            FROM (
-                SELECT opportunity_id, dest_id.value AS dest_id, min(traveltime) AS traveltime, sensitivity, potential
-                FROM
-                (
-                    SELECT opportunity.id AS opportunity_id, matrix.orig_id, matrix.dest_id, CAST(matrix.traveltime AS float) AS traveltime,
-                        opportunity.sensitivity, opportunity.potential
-                    FROM {opportunity_table} opportunity, {TRAVELTIME_MATRIX_TABLE[params.routing_type]} matrix
-                    WHERE matrix.h3_3 = opportunity.h3_3
-                    AND matrix.orig_id = opportunity.h3_index
-                    AND matrix.traveltime <= opportunity.max_traveltime
-                ) sub_matrix
-                JOIN LATERAL UNNEST(sub_matrix.dest_id) dest_id(value) ON TRUE
-                GROUP BY opportunity_id, dest_id.value, sensitivity, potential
-            ) grouped_opportunities
+            INSERT INTO {result_table} (layer_id, {get_h3_result_column()}, text_attr1, float_attr1, integer_attr1)
+            SELECT '{result_layer_id}', {get_h3_result_value("dest_id")}, dest_id,
+                {impedance_function} AS accessibility, COUNT(potential) AS opportunity_count
+            FROM ({self.build_grouped_opportunities(params, opportunity_table)}) grouped_opportunities
             GROUP BY dest_id;
         """
 
         return query
 
-    @job_log(job_step_name="heatmap_gravity")
-    async def heatmap(self, params: IHeatmapGravityActive | IHeatmapGravityMotorized):
-        """Compute heatmap gravity."""
+    def build_partition_query(
+        self,
+        params: IHeatmapGravityActive | IHeatmapGravityMotorized,
+        opportunity_table: str,
+        opportunity_filter: str,
+        max_traveltime: int,
+        max_sensitivity: float,
+        sensitivities: List[float],
+        partial_table: str,
+    ):
+        """Builds SQL query to compute the partial heatmap gravity and
+        opportunity count of the opportunities matching a filter."""
+
+        impedance_function = self.build_impedance_function(
+            type=params.impedance_function,
+            max_traveltime=max_traveltime,
+            max_sensitivity=max_sensitivity,
+            sensitivities=sensitivities,
+        )
+
+        return f"""
+            INSERT INTO {partial_table} (h3_index, accessibility, opportunity_count)
+            SELECT dest_id, {impedance_function} AS accessibility, COUNT(potential) AS opportunity_count
+            FROM ({self.build_grouped_opportunities(params, opportunity_table, opportunity_filter)}) grouped_opportunities
+            GROUP BY dest_id;
+        """
+
+    async def compute_heatmap_partitioned(
+        self,
+        params: IHeatmapGravityActive | IHeatmapGravityMotorized,
+        opportunity_table: str,
+        max_traveltime: int,
+        max_sensitivity: float,
+        sensitivities: List[float],
+        result_table: str,
+        result_layer_id: str,
+    ):
+        """Compute heatmap gravity per h3_3 partition of the opportunities
+        concurrently & sum the partial accessibility of each cell."""
+
+        partial_table = await self.run_partitioned(
+            opportunity_table=opportunity_table,
+            partial_table_columns="h3_index h3index, accessibility float8, opportunity_count int",
+            build_partition_query=partial(
+                self.build_partition_query,
+                params=params,
+                opportunity_table=opportunity_table,
+                max_traveltime=max_traveltime,
+                max_sensitivity=max_sensitivity,
+                sensitivities=sensitivities,
+            ),
+            job_step_name="heatmap_gravity",
+        )
+        await self.async_session.execute(
+            self.build_merge_sum_query(
+                partial_table=partial_table,
+                result_table=result_table,
+                result_layer_id=result_layer_id,
+                opportunity_count=True,
+            )
+        )
+
+    async def compute_heatmap_delta(
+        self,
+        params: IHeatmapGravityActive | IHeatmapGravityMotorized,
+        result_table: str,
+        result_layer_id: str,
+    ) -> bool:
+        """Compute a scenario heatmap gravity from the cached heatmap without
+        scenario. The accessibility is a sum over opportunities, so the original
+        contribution of the opportunities edited by the scenario is subtracted and
+        their scenario contribution added. Only the matrix rows of the edited
+        opportunities are read.
+
+        :return: Whether the heatmap without scenario was cached and corrected.
+        """
+
+        if not params.scenario_id or not heatmap_result_cache.enabled:
+            return False
+
+        # Corrections of large edits aren't cheaper than recomputing the heatmap
+        layer_project_ids = [
+            layer.opportunity_layer_project_id for layer in params.opportunities
+        ]
+        sql_cnt_edited = f"""
+            SELECT COUNT(*)
+            FROM {settings.CUSTOMER_SCHEMA}.scenario_scenario_feature link
+            JOIN {settings.CUSTOMER_SCHEMA}.scenario_feature scenario_feature
+                ON scenario_feature.id = link.scenario_feature_id
+            WHERE link.scenario_id = '{params.scenario_id}'
+            AND scenario_feature.layer_project_id IN ({", ".join(map(str, layer_project_ids))});
+        """
+        cnt_edited = (await self.async_session.execute(sql_cnt_edited)).scalar()
+        if cnt_edited > settings.HEATMAP_DELTA_MAX_SCENARIO_FEATURES:
+            return False
+
+        baseline_table = await self.create_temp_table_name("baseline")
+        await self.async_session.execute(
+            f"CREATE TABLE {baseline_table} (h3_index h3index, accessibility float8, opportunity_count int);"
+        )
+        baseline_key = await self.get_cache_key(
+            params.copy(update={"scenario_id": None})
+        )
+        if not await heatmap_result_cache.copy_cells(
+            async_session=self.async_session,
+            key=baseline_key,
+            cells_table=baseline_table,
+        ):
+            return False
+        # Cells cached without their opportunity count can't be corrected
+        sql_cnt_uncounted = f"""
+            SELECT COUNT(*) FROM {baseline_table} WHERE opportunity_count IS NULL;
+        """
+        if (await self.async_session.execute(sql_cnt_uncounted)).scalar():
+            return False
 
-        # Fetch opportunity tables
+        # Get max traveltime & sensitivity for normalization
+        max_traveltime = max(
+            [opportunity.max_traveltime for opportunity in params.opportunities]
+        )
+        sensitivities = sorted(
+            {opportunity.sensitivity for opportunity in params.opportunities}
+        )
+
+        # Compute the contribution of the edited opportunities before & after editing
         layers, opportunity_geofence_layer = await self.fetch_opportunity_layers(params)
-        opportunity_table = await self.create_distributed_opportunity_table(
+        delta_tables = {}
+        for scenario_version in (False, True):
+            opportunity_table = await self.create_distributed_opportunity_table(
+                params.routing_type,
+                layers,
+                params.scenario_id,
+                opportunity_geofence_layer,
+                scenario_version=scenario_version,
+            )
+            delta_tables[scenario_version] = await self.create_temp_table_name("delta")
+            await self.async_session.execute(
+                f"CREATE TABLE {delta_tables[scenario_version]} (h3_index h3index, accessibility float8, opportunity_count int);"
+            )
+            await self.async_session.execute(
+                self.build_partition_query(
+                    params=params,
+                    opportunity_table=opportunity_table,
+                    opportunity_filter="TRUE",
+                    max_traveltime=max_traveltime,
+                    max_sensitivity=settings.HEATMAP_GRAVITY_MAX_SENSITIVITY,
+                    sensitivities=sensitivities,
+                    partial_table=delta_tables[scenario_version],
+                )
+            )
+
+        # Cells are dropped once the scenario removed all opportunities reaching them
+        await self.async_session.execute(
+            f"""
+            INSERT INTO {result_table} (layer_id, {get_h3_result_column()}, text_attr1, float_attr1, integer_attr1)
+            SELECT '{result_layer_id}', {get_h3_result_value("h3_index")}, h3_index, SUM(accessibility),
+                SUM(opportunity_count)
+            FROM (
+                SELECT h3_index, accessibility, opportunity_count FROM {baseline_table}
+                UNION ALL
+                SELECT h3_index, -accessibility, -opportunity_count FROM {delta_tables[False]}
+                UNION ALL
+                SELECT h3_index, accessibility, opportunity_count FROM {delta_tables[True]}
+            ) cells
+            GROUP BY h3_index
+            HAVING SUM(opportunity_count) > 0;
+            """
+        )
+        return True
+
+    async def compute_heatmap_numba(
+        self,
+        params: IHeatmapGravityActive | IHeatmapGravityMotorized,
+        opportunity_table: str,
+        max_traveltime: int,
+        max_sensitivity: float,
+        result_table: str,
+        result_layer_id: str,
+        matrix: dict | None = None,
+    ):
+        """Compute heatmap gravity in memory from the matrix rows of the
+        opportunity cells, without unnesting them in the database. A matrix
+        already loaded for the opportunity cells can be passed."""
+
+        sql_opportunities = f"""
+            SELECT id, h3_index::bigint, max_traveltime, sensitivity, potential
+            FROM {opportunity_table}
+            WHERE potential IS NOT NULL;
+        """
+        opportunity_rows = (
+            await self.async_session.execute(sql_opportunities)
+        ).fetchall()
+
+        if matrix is None:
+            matrix = await self.load_traveltime_matrix(
+                params.routing_type, opportunity_table
+            )
+
+        # Run the kernel off the event loop
+        def compute():
+            id, h3_index, opportunity_max_traveltime, sensitivity, potential = list(
+                zip(*opportunity_rows, strict=True)
+            ) or [[], [], [], [], []]
+            opportunities = build_opportunity_csr(
+                id,
+                h3_index,
+                opportunity_max_traveltime,
+                matrix_orig_id=matrix["orig_id"],
+                sensitivity=sensitivity,
+                potential=potential,
+            )
+            return compute_gravity_heatmap(
+                matrix=matrix,
+                opportunities=opportunities,
+                impedance_function=params.impedance_function.value,
+                max_traveltime=max_traveltime,
+                max_sensitivity=max_sensitivity,
+            )
+
+        heatmap = await asyncio.to_thread(compute)
+
+        await self.write_heatmap_cells(
+            result_table=result_table,
+            result_layer_id=result_layer_id,
+            h3_index=heatmap["h3_index"],
+            accessibility=heatmap["accessibility"],
+            opportunity_count=heatmap["opportunity_count"],
+        )
+
+    async def create_opportunity_table(
+        self, params: IHeatmapGravityActive | IHeatmapGravityMotorized
+    ):
+        """Fetch the opportunity layers and create the opportunity table."""
+
+        layers, opportunity_geofence_layer = await self.fetch_opportunity_layers(params)
+        return await self.create_distributed_opportunity_table(
             params.routing_type,
             layers,
             params.scenario_id,
             opportunity_geofence_layer,
         )
 
-        # Initialize result table
-        result_table = f"{settings.USER_DATA_SCHEMA}.{FeatureGeometryType.polygon.value}_{str(self.user_id).replace('-', '')}"
+    def get_result_layer(
+        self, params: IHeatmapGravityActive | IHeatmapGravityMotorized
+    ):
+        """Create the feature layer to store the computed heatmap output."""
 
-        # Create feature layer to store computed heatmap output
-        layer_heatmap = IFeatureLayerToolCreate(
+        return IFeatureLayerToolCreate(
             name=(
                 DefaultResultLayerName.heatmap_gravity_active_mobility.value
                 if type(params.routing_type) == ActiveRoutingHeatmapType
                 else DefaultResultLayerName.heatmap_gravity_motorized_mobility.value
             ),
             feature_layer_geometry_type=FeatureGeometryType.polygon,
+            data_type=self.get_h3_result_data_type(),
             attribute_mapping={
                 "text_attr1": "h3_index",
                 "float_attr1": "accessibility",
@@ -186,19 +458,73 @@ class CRUDHeatmapGravity(CRUDHeatmapBase):
             job_id=self.job_id,
         )
 
+    async def compute_heatmap(
+        self,
+        params: IHeatmapGravityActive | IHeatmapGravityMotorized,
+        opportunity_table: str,
+        result_table: str,
+        result_layer_id: str,
+        matrix: dict | None = None,
+    ):
+        """Compute heatmap gravity with the engine of the params & write it to the
+        result table."""
+
         # Get max traveltime & sensitivity for normalization
-        max_traveltime = max([layer["layer"].max_traveltime for layer in layers])
+        max_traveltime = max(
+            [opportunity.max_traveltime for opportunity in params.opportunities]
+        )
+        sensitivities = sorted(
+            {opportunity.sensitivity for opportunity in params.opportunities}
+        )
 
-        # Compute heatmap & write to result table
-        await self.async_session.execute(
-            self.build_query(
+        if params.engine == HeatmapEngineType.numba:
+            await self.compute_heatmap_numba(
                 params=params,
                 opportunity_table=opportunity_table,
                 max_traveltime=max_traveltime,
                 max_sensitivity=settings.HEATMAP_GRAVITY_MAX_SENSITIVITY,
                 result_table=result_table,
-                result_layer_id=str(layer_heatmap.id),
+                result_layer_id=result_layer_id,
+                matrix=matrix,
             )
+        elif params.engine == HeatmapEngineType.sql_partitioned:
+            await self.compute_heatmap_partitioned(
+                params=params,
+                opportunity_table=opportunity_table,
+                max_traveltime=max_traveltime,
+                max_sensitivity=settings.HEATMAP_GRAVITY_MAX_SENSITIVITY,
+                sensitivities=sensitivities,
+                result_table=result_table,
+                result_layer_id=result_layer_id,
+            )
+        else:
+            await self.async_session.execute(
+                self.build_query(
+                    params=params,
+                    opportunity_table=opportunity_table,
+                    max_traveltime=max_traveltime,
+                    max_sensitivity=settings.HEATMAP_GRAVITY_MAX_SENSITIVITY,
+                    sensitivities=sensitivities,
+                    result_table=result_table,
+                    result_layer_id=result_layer_id,
+                )
+            )
+
+    @job_log(job_step_name="heatmap_gravity")
+    async def heatmap(self, params: IHeatmapGravityActive | IHeatmapGravityMotorized):
+        """Compute heatmap gravity."""
+
+        # Initialize result table
+        result_table = await self.get_h3_result_table()
+
+        # Create feature layer to store computed heatmap output
+        layer_heatmap = self.get_result_layer(params)
+
+        # Compute heatmap & write to result table, or copy it from the cache
+        await self.compute_heatmap_cached(
+            params=params,
+            result_table=result_table,
+            result_layer_id=str(layer_heatmap.id),
         )
 
         # Register feature layer
@@ -47,6 +47,7 @@ from src.schemas.error import (
 from src.schemas.job import JobStatusType
 from src.schemas.layer import (
     ComputeBreakOperation,
+    FeatureDataType,
     FeatureType,
     ICatalogLayerGet,
     IFeatureStandardCreateAdditionalAttributes,
@@ -83,8 +84,8 @@ class CRUDLayer(CRUDLayerBase):
     async def label_cluster_keep(self, async_session: AsyncSession, layer: Layer):
         """Label the rows that should be kept in case of vector tile clustering. Based on the logic to priotize features close to the centroid of an h3 grid of resolution 8."""
 
-        # Build query to update the selected rows
-        if layer.type == LayerType.feature:
+        # Build query to update the selected rows, H3 layers are labeled by their view
+        if layer.type == LayerType.feature and layer.data_type != FeatureDataType.h3:
             sql_query = f"""WITH to_update AS
             (
                 SELECT id, CASE
@@ -167,9 +167,95 @@ class CRUDUser(CRUDBase):
         # Commit changes
         await async_session.commit()
 
+    async def create_user_h3_table(self, async_session: AsyncSession, user_id: UUID):
+        """Create the user table storing H3 cells without geometry and the view
+        adding the cell boundaries and the columns of the polygon table."""
+
+        table_name = f"{UserDataTable.h3.value}_{str(user_id).replace('-', '')}"
+        view_name = f"{UserDataTable.h3.value}_{UserDataTable.polygon.value}_{str(user_id).replace('-', '')}"
+
+        # Check if table exists
+        if await table_exists(async_session, settings.USER_DATA_SCHEMA, table_name):
+            return
+
+        # Concurrent jobs of the user may create the table. Sessions autocommit, so hold
+        # a session-level lock while creating it and check again
+        lock_key = f"hashtext('{settings.USER_DATA_SCHEMA}.{table_name}')"
+        await async_session.execute(text(f"SELECT pg_advisory_lock({lock_key});"))
+        try:
+            if await table_exists(async_session, settings.USER_DATA_SCHEMA, table_name):
+                return
+
+            attribute_columns = [
+                f"{column_type}_attr{i+1}"
+                for column_type, number_columns in NumberColumnsPerType.__members__.items()
+                for i in range(number_columns.value)
+            ]
+            sql_create_table = f"""
+            CREATE TABLE {settings.USER_DATA_SCHEMA}."{table_name}" (
+                id UUID DEFAULT basic.uuid_generate_v7() NOT NULL,
+                layer_id UUID NOT NULL,
+                h3_index h3index NOT NULL,
+                {', '.join([f'integer_attr{i+1} INTEGER' for i in range(NumberColumnsPerType.integer.value)])},
+                {', '.join([f'bigint_attr{i+1} BIGINT' for i in range(NumberColumnsPerType.bigint.value)])},
+                {', '.join([f'float_attr{i+1} FLOAT' for i in range(NumberColumnsPerType.float.value)])},
+                {', '.join([f'text_attr{i+1} TEXT' for i in range(NumberColumnsPerType.text.value)])},
+                {', '.join([f'jsonb_attr{i+1} jsonb' for i in range(NumberColumnsPerType.jsonb.value)])},
+                {', '.join([f'arrint_attr{i+1} INTEGER[]' for i in range(NumberColumnsPerType.arrint.value)])},
+                {', '.join([f'arrfloat_attr{i+1} FLOAT[]' for i in range(NumberColumnsPerType.arrfloat.value)])},
+                {', '.join([f'arrtext_attr{i+1} TEXT[]' for i in range(NumberColumnsPerType.arrtext.value)])},
+                {', '.join([f'timestamp_attr{i+1} TIMESTAMP' for i in range(NumberColumnsPerType.timestamp.value)])},
+                {', '.join([f'boolean_attr{i+1} BOOLEAN' for i in range(NumberColumnsPerType.boolean.value)])},
+                updated_at timestamptz NOT NULL DEFAULT to_char((CURRENT_TIMESTAMP AT TIME ZONE 'UTC'::text), 'YYYY-MM-DD"T"HH24:MI:SSOF'::text)::timestamp with time zone,
+                created_at timestamptz NOT NULL DEFAULT to_char((CURRENT_TIMESTAMP AT TIME ZONE 'UTC'::text), 'YYYY-MM-DD"T"HH24:MI:SSOF'::text)::timestamp with time zone
+            );
+            """
+            await async_session.execute(text(sql_create_table))
+            await async_session.execute(
+                text(
+                    f"""ALTER TABLE {settings.USER_DATA_SCHEMA}."{table_name}" ADD PRIMARY KEY(id);"""
+                )
+            )
+            await async_session.execute(
+                text(
+                    f"""CREATE INDEX ON {settings.USER_DATA_SCHEMA}."{table_name}" (layer_id, h3_index);"""
+                )
+            )
+
+            # The view is auto-updatable, so data of the layers can be deleted through it.
+            # The clustering columns select the center cell of each H3 cell of resolution 8.
+            sql_create_view = f"""
+            CREATE OR REPLACE VIEW {settings.USER_DATA_SCHEMA}."{view_name}" AS
+            SELECT id, layer_id,
+                ST_SetSRID(h3_cell_to_boundary(h3_index)::geometry, 4326) AS geom,
+                {', '.join(attribute_columns)},
+                updated_at, created_at,
+                CASE WHEN h3_get_resolution(h3_index) > 8
+                    THEN h3_cell_to_center_child(h3_cell_to_parent(h3_index, 8), h3_get_resolution(h3_index)) = h3_index
+                    ELSE TRUE
+                END AS cluster_keep,
+                basic.to_short_h3_3(h3_cell_to_parent(h3_index, 3)::bigint) AS h3_3,
+                CASE WHEN h3_get_resolution(h3_index) > 8
+                    THEN h3_cell_to_parent(h3_index, 8)
+                    ELSE h3_cell_to_center_child(h3_index, 8)
+                END AS h3_group,
+                h3_index
+            FROM {settings.USER_DATA_SCHEMA}."{table_name}";
+            """
+            await async_session.execute(text(sql_create_view))
+        finally:
+            await async_session.execute(text(f"SELECT pg_advisory_unlock({lock_key});"))
+            await async_session.commit()
+
     async def delete_user_data_tables(self, async_session: AsyncSession, user_id: UUID):
         """Delete the user data tables."""
 
+        # Drop the view reading the H3 table first
+        await async_session.execute(
+            text(
+                f"""DROP VIEW IF EXISTS {settings.USER_DATA_SCHEMA}."{UserDataTable.h3.value}_{UserDataTable.polygon.value}_{str(user_id).replace('-', '')}";"""
+            )
+        )
         for table_type in UserDataTable:
             table_name = f"{table_type.value}_{str(user_id).replace('-', '')}"
 
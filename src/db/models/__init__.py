@@ -20,4 +20,6 @@ from .user import User
 from .organization import Organization
 from .team import Team
 from .role import Role
-from .status import Status
\ No newline at end of file
+from .status import Status
+from .catchment_area_cache import CatchmentAreaCache
+from .heatmap_cache import HeatmapCache
\ No newline at end of file
@@ -0,0 +1,42 @@
+from datetime import datetime
+
+from geoalchemy2 import Geometry
+from sqlmodel import (
+    BigInteger,
+    Column,
+    DateTime,
+    Field,
+    Index,
+    Integer,
+    SQLModel,
+    Text,
+    text,
+)
+
+from src.core.config import settings
+
+
+class CatchmentAreaCache(SQLModel, table=True):
+    """Table class for catchment area shapes computed by the routing service, shared
+    across jobs with the same starting points and travel cost."""
+
+    __tablename__ = "catchment_area_cache"
+    __table_args__ = (
+        Index("idx_catchment_area_cache_cache_key", "cache_key"),
+        Index("idx_catchment_area_cache_created_at", "created_at"),
+        {"schema": settings.CUSTOMER_SCHEMA},
+    )
+
+    id: int | None = Field(
+        sa_column=Column(BigInteger, primary_key=True, autoincrement=True)
+    )
+    cache_key: str = Field(sa_column=Column(Text, nullable=False))
+    geom: str = Field(sa_column=Column(Geometry(srid="4326", spatial_index=False)))
+    integer_attr1: int | None = Field(sa_column=Column(Integer))
+    created_at: datetime | None = Field(
+        sa_column=Column(
+            DateTime(timezone=True),
+            nullable=False,
+            server_default=text("now()"),
+        )
+    )
@@ -0,0 +1,51 @@
+from datetime import datetime
+
+from sqlmodel import (
+    BigInteger,
+    Column,
+    DateTime,
+    Field,
+    Float,
+    Index,
+    Integer,
+    SQLModel,
+    Text,
+    UniqueConstraint,
+    text,
+)
+
+from src.core.config import settings
+
+
+class HeatmapCache(SQLModel, table=True):
+    """Table class for the H3 cells of computed heatmaps, shared across jobs with
+    the same parameters and input data."""
+
+    __tablename__ = "heatmap_cache"
+    __table_args__ = (
+        Index("idx_heatmap_cache_created_at", "created_at"),
+        {"schema": settings.CUSTOMER_SCHEMA},
+    )
+
+    id: int | None = Field(
+        sa_column=Column(BigInteger, primary_key=True, autoincrement=True)
+    )
+    cache_key: str = Field(sa_column=Column(Text, nullable=False))
+    h3_index: int = Field(sa_column=Column(BigInteger, nullable=False))
+    accessibility: float | None = Field(sa_column=Column(Float))
+    opportunity_count: int | None = Field(sa_column=Column(Integer))
+    created_at: datetime | None = Field(
+        sa_column=Column(
+            DateTime(timezone=True),
+            nullable=False,
+            server_default=text("now()"),
+        )
+    )
+
+
+# Constraints
+UniqueConstraint(
+    HeatmapCache.__table__.c.cache_key,
+    HeatmapCache.__table__.c.h3_index,
+    name="unique_heatmap_cache_cell",
+)
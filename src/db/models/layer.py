@@ -139,6 +139,8 @@ class FeatureDataType(str, Enum):
 
     mvt = "mvt"
     wfs = "wfs"
+    # H3 cells stored without geometry and read through a view adding the boundaries
+    h3 = "h3"
     # NULL / None is used for feature layers not fetched from an external service
 
 
@@ -346,6 +348,10 @@ def internal_layer_table_name(values: SQLModel | BaseModel):
     else:
         raise ValueError(f"The passed layer type {values.type} is not supported.")
 
+    # H3 layers are read through the view generating the cell boundaries
+    if getattr(values, "data_type", None) == FeatureDataType.h3:
+        feature_layer_geometry_type = f"h3_{feature_layer_geometry_type}"
+
     return f"{settings.USER_DATA_SCHEMA}.{feature_layer_geometry_type}_{str(values.user_id).replace('-', '')}"
 
 
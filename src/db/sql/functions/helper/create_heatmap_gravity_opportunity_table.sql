@@ -3,7 +3,8 @@ CREATE OR REPLACE FUNCTION basic.create_heatmap_gravity_opportunity_table(
     input_layer_project_id int, input_table text, customer_schema text, scenario_id text,
     geofence_table text, geofence_where_filter text, geofence_buffer_dist float,
     max_traveltime int, sensitivity float, potential_column text, where_filter text,
-    result_table_name text, grid_resolution int, is_area_based boolean, append_existing boolean
+    result_table_name text, grid_resolution int, is_area_based boolean, append_existing boolean,
+    scenario_version boolean DEFAULT NULL
 )
 RETURNS SETOF void
 LANGUAGE plpgsql
@@ -35,30 +36,66 @@ BEGIN
 		RAISE EXCEPTION 'Unsupported grid resolution specified';
 	END IF;
 
-    -- Create a temporary table containing opportunities after applying scenarios
+    -- Create a temporary table containing opportunities after applying scenarios. With
+    -- scenario_version, only the opportunities edited by the scenario are included,
+    -- as changed by the scenario if true or as in the layer if false
     SELECT 'temporal.opportunities_' || basic.uuid_generate_v7() INTO temp_opportunities_table;
-    EXECUTE format(
-        '
-            CREATE TABLE %I AS
-            WITH scenario_features AS (
-                SELECT sf.feature_id AS id, sf.geom, sf.edit_type, %s AS potential
+    IF scenario_version IS NULL THEN
+        EXECUTE format(
+            '
+                CREATE TABLE %I AS
+                WITH scenario_features AS (
+                    SELECT sf.feature_id AS id, sf.geom, sf.edit_type, %s AS potential
+                    FROM %s.scenario_scenario_feature ssf
+                    INNER JOIN %s.scenario_feature sf ON sf.id = ssf.scenario_feature_id
+                    WHERE ssf.scenario_id = %L
+                    AND sf.layer_project_id = %s
+                )
+                    SELECT of.id, geom, %s AS potential
+                    FROM (SELECT * FROM %s WHERE %s) of
+                    LEFT JOIN (SELECT id FROM scenario_features) sf ON of.id = sf.id
+                    WHERE sf.id IS NULL
+                UNION ALL
+                    SELECT id, geom, potential
+                    FROM scenario_features
+                    WHERE edit_type IN (''n'', ''m'');
+            ',
+            temp_opportunities_table, potential_column, customer_schema, customer_schema,
+            scenario_id, input_layer_project_id, potential_column, input_table, where_filter
+        );
+    ELSIF scenario_version THEN
+        EXECUTE format(
+            '
+                CREATE TABLE %I AS
+                SELECT sf.feature_id AS id, sf.geom, %s AS potential
                 FROM %s.scenario_scenario_feature ssf
                 INNER JOIN %s.scenario_feature sf ON sf.id = ssf.scenario_feature_id
                 WHERE ssf.scenario_id = %L
                 AND sf.layer_project_id = %s
-            )
+                AND sf.edit_type IN (''n'', ''m'');
+            ',
+            temp_opportunities_table, potential_column, customer_schema, customer_schema,
+            scenario_id, input_layer_project_id
+        );
+    ELSE
+        EXECUTE format(
+            '
+                CREATE TABLE %I AS
+                WITH scenario_features AS (
+                    SELECT sf.feature_id AS id
+                    FROM %s.scenario_scenario_feature ssf
+                    INNER JOIN %s.scenario_feature sf ON sf.id = ssf.scenario_feature_id
+                    WHERE ssf.scenario_id = %L
+                    AND sf.layer_project_id = %s
+                )
                 SELECT of.id, geom, %s AS potential
                 FROM (SELECT * FROM %s WHERE %s) of
-                LEFT JOIN (SELECT id FROM scenario_features) sf ON of.id = sf.id
-                WHERE sf.id IS NULL
-            UNION ALL
-                SELECT id, geom, potential
-                FROM scenario_features
-                WHERE edit_type IN (''n'', ''m'');
-        ',
-        temp_opportunities_table, potential_column, customer_schema, customer_schema,
-        scenario_id, input_layer_project_id, potential_column, input_table, where_filter
-    );
+                WHERE of.id IN (SELECT id FROM scenario_features);
+            ',
+            temp_opportunities_table, customer_schema, customer_schema, scenario_id,
+            input_layer_project_id, potential_column, input_table, where_filter
+        );
+    END IF;
 
     -- Produce h3 grid at specified resolution
     IF NOT is_area_based THEN
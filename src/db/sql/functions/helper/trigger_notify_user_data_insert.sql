@@ -0,0 +1,11 @@
+CREATE OR REPLACE FUNCTION basic.trigger_notify_user_data_insert()
+RETURNS TRIGGER AS $$
+BEGIN
+  -- Notify listeners waiting for results of a layer, e.g. catchment areas written
+  -- by the routing service. Runs once per statement, and PostgreSQL sends each
+  -- layer once on commit of the transaction.
+  PERFORM pg_notify('user_data_insert', layer_id::text)
+  FROM (SELECT DISTINCT layer_id FROM new_rows) layers;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
\ No newline at end of file
@@ -2,6 +2,7 @@ from fastapi import APIRouter, Body, Depends
 
 from src.core.tool import start_calculation
 from src.crud.crud_catchment_area import CRUDCatchmentAreaActiveMobility
+from src.crud.crud_heatmap_batch import CRUDHeatmapBatch
 from src.crud.crud_heatmap_closest_average import CRUDHeatmapClosestAverage
 from src.crud.crud_heatmap_connectivity import CRUDHeatmapConnectivity
 from src.crud.crud_heatmap_gravity import CRUDHeatmapGravity
@@ -14,6 +15,7 @@ from src.schemas.catchment_area import (
     request_examples_catchment_area_active_mobility as active_mobility_request_examples,
 )
 from src.schemas.heatmap import (
+    IHeatmapBatchActive,
     IHeatmapClosestAverageActive,
     IHeatmapConnectivityActive,
     IHeatmapGravityActive,
@@ -143,3 +145,33 @@ async def compute_active_mobility_heatmap_connectivity(
         project_id=common.project_id,
         params=params,
     )
+
+
+@router.post(
+    "/heatmap-batch",
+    summary="Compute several heatmaps for active mobility in one pass",
+    response_model=IToolResponse,
+    status_code=201,
+    dependencies=[Depends(auth_z)],
+)
+async def compute_active_mobility_heatmap_batch(
+    *,
+    common: CommonToolParams = Depends(),
+    params: IHeatmapBatchActive = Body(
+        ...,
+        examples={},
+        description="The heatmap batch parameters.",
+    ),
+):
+    """Compute several heatmaps for active mobility in one pass."""
+
+    return await start_calculation(
+        job_type=JobType.heatmap_batch_active_mobility,
+        tool_class=CRUDHeatmapBatch,
+        crud_method="run_heatmap",
+        async_session=common.async_session,
+        user_id=common.user_id,
+        background_tasks=common.background_tasks,
+        project_id=common.project_id,
+        params=params,
+    )
@@ -5,6 +5,7 @@ from src.crud.crud_catchment_area import (
     CRUDCatchmentAreaCar,
     CRUDCatchmentAreaPT,
 )
+from src.crud.crud_heatmap_batch import CRUDHeatmapBatch
 from src.crud.crud_heatmap_closest_average import CRUDHeatmapClosestAverage
 from src.crud.crud_heatmap_connectivity import CRUDHeatmapConnectivity
 from src.crud.crud_heatmap_gravity import CRUDHeatmapGravity
@@ -20,6 +21,7 @@ from src.schemas.catchment_area import (
     request_examples_catchment_area_pt,
 )
 from src.schemas.heatmap import (
+    IHeatmapBatchMotorized,
     IHeatmapClosestAverageMotorized,
     IHeatmapConnectivityMotorized,
     IHeatmapGravityMotorized,
@@ -272,3 +274,33 @@ async def compute_motorized_mobility_heatmap_connectivity(
         project_id=common.project_id,
         params=params,
     )
+
+
+@router.post(
+    "/heatmap-batch",
+    summary="Compute several heatmaps for motorized mobility in one pass",
+    response_model=IToolResponse,
+    status_code=201,
+    dependencies=[Depends(auth_z)],
+)
+async def compute_motorized_mobility_heatmap_batch(
+    *,
+    common: CommonToolParams = Depends(),
+    params: IHeatmapBatchMotorized = Body(
+        ...,
+        examples={},
+        description="The heatmap batch parameters.",
+    ),
+):
+    """Compute several heatmaps for motorized mobility in one pass."""
+
+    return await start_calculation(
+        job_type=JobType.heatmap_batch_motorized_mobility,
+        tool_class=CRUDHeatmapBatch,
+        crud_method="run_heatmap",
+        async_session=common.async_session,
+        user_id=common.user_id,
+        background_tasks=common.background_tasks,
+        project_id=common.project_id,
+        params=params,
+    )
@@ -0,0 +1,397 @@
+"""
+Compute heatmaps in memory from the rows of a travel time matrix.
+
+Each matrix row holds the destination cells reached from an origin cell at one
+travel time. The rows are converted to compressed sparse rows (CSR): the
+destinations of origin i are dest_index[offsets[i]:offsets[i + 1]], with their
+travel times at the same positions in traveltime.
+"""
+
+from itertools import chain
+
+import numpy as np
+from numba import njit
+
+
+def build_traveltime_matrix_csr(orig_id: list, traveltime: list, dest_id: list) -> dict:
+    """
+    Convert travel time matrix rows to compressed sparse rows.
+
+    :param orig_id: The origin cell of each row as integer H3 index.
+    :param traveltime: The travel time of each row.
+    :param dest_id: The destination cells of each row as integer H3 indexes.
+    :return: The sorted origin cells, the offsets of their destinations, the
+        destinations as index into the sorted destination cells, the travel times
+        and the destination cells.
+    """
+    orig_id = np.asarray(orig_id, dtype=np.int64)
+    order = np.argsort(orig_id, kind="stable")
+    n_dest = np.fromiter(
+        (len(dest_id[i]) for i in order), dtype=np.int64, count=len(order)
+    )
+    entry_dest_id = np.fromiter(
+        chain.from_iterable(dest_id[i] for i in order),
+        dtype=np.int64,
+        count=int(n_dest.sum()),
+    )
+    entry_traveltime = np.repeat(np.asarray(traveltime, dtype=np.int16)[order], n_dest)
+
+    # Rows of the same origin are adjacent after sorting
+    unique_orig_id, first_row = np.unique(orig_id[order], return_index=True)
+    row_offsets = np.zeros(len(order) + 1, dtype=np.int64)
+    np.cumsum(n_dest, out=row_offsets[1:])
+    offsets = np.append(row_offsets[first_row], row_offsets[-1])
+
+    unique_dest_id, dest_index = np.unique(entry_dest_id, return_inverse=True)
+    return {
+        "orig_id": unique_orig_id,
+        "offsets": offsets,
+        "dest_index": dest_index.astype(np.int64),
+        "traveltime": entry_traveltime,
+        "dest_id": unique_dest_id,
+    }
+
+
+def build_opportunity_csr(
+    opportunity_id: list,
+    h3_index: list,
+    max_traveltime: list,
+    matrix_orig_id: np.ndarray,
+    **attributes: list,
+) -> dict:
+    """
+    Group the cells of the opportunities, so the travel time to a destination is
+    counted once per opportunity, even if several of its cells reach it.
+
+    Opportunities are grouped by id and their attributes (e.g. sensitivity and
+    potential), like in the SQL engine.
+
+    :return: The offsets of the cells of each opportunity, the origin of each cell
+        in the matrix (-1 if the matrix has no rows for it), the max travel time of
+        each cell, and the attributes of each opportunity.
+    """
+    keys = np.rec.fromarrays(
+        [np.asarray([str(id) for id in opportunity_id], dtype=str)]
+        + [np.asarray(values, dtype=np.float64) for values in attributes.values()]
+    )
+    unique_keys, group = np.unique(keys, return_inverse=True)
+    order = np.argsort(group, kind="stable")
+
+    h3_index = np.asarray(h3_index, dtype=np.int64)[order]
+    orig = np.searchsorted(matrix_orig_id, h3_index)
+    orig[orig == len(matrix_orig_id)] = 0
+    if len(matrix_orig_id):
+        orig[matrix_orig_id[orig] != h3_index] = -1
+    else:
+        orig[:] = -1
+
+    offsets = np.zeros(len(unique_keys) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(group, minlength=len(unique_keys)), out=offsets[1:])
+    return {
+        "offsets": offsets,
+        "orig": orig.astype(np.int64),
+        "max_traveltime": np.asarray(max_traveltime, dtype=np.int16)[order],
+        **{
+            name: unique_keys[f"f{i + 1}"].astype(np.float64)
+            for i, name in enumerate(attributes)
+        },
+    }
+
+
+def build_impedance_table(
+    impedance_function: str,
+    sensitivities: np.ndarray,
+    max_traveltime: int,
+    max_sensitivity: float,
+) -> np.ndarray:
+    """
+    Weight of an opportunity for each sensitivity and travel time from 0 to
+    max_traveltime minutes. With t = traveltime / max_traveltime and
+    s = sensitivity / max_sensitivity, the weights are exp(-t^2 / s) (gaussian),
+    1 - t (linear), exp(-s * t) (exponential) and t^-s (power).
+
+    :return: The weights with one row per sensitivity and one column per minute.
+    """
+    t = np.arange(max_traveltime + 1, dtype=np.float64) / float(max_traveltime)
+    s = np.asarray(sensitivities, dtype=np.float64)[:, None] / float(max_sensitivity)
+    with np.errstate(divide="ignore"):
+        if impedance_function == "gaussian":
+            weights = np.exp(-(t**2) / s)
+        elif impedance_function == "linear":
+            weights = np.broadcast_to(1.0 - t, (len(s), len(t)))
+        elif impedance_function == "exponential":
+            weights = np.exp(-s * t)
+        elif impedance_function == "power":
+            weights = t ** (-s)
+        else:
+            raise ValueError(f"Unknown impedance function type: {impedance_function}")
+    return np.ascontiguousarray(weights)
+
+
+@njit(cache=True, nogil=True)
+def gravity_accessibility(
+    offsets,
+    dest_index,
+    traveltime,
+    n_dest,
+    opportunity_offsets,
+    opportunity_orig,
+    opportunity_max_traveltime,
+    opportunity_weights,
+    opportunity_potential,
+    weights,
+):
+    """
+    Sum the weighted potential of the opportunities reachable from each
+    destination. The weight of an opportunity reached after t minutes is
+    weights[opportunity_weights[i], t].
+
+    :return: The accessibility of each destination and the number of
+        opportunities which reached it.
+    """
+    accessibility = np.zeros(n_dest, dtype=np.float64)
+    opportunity_count = np.zeros(n_dest, dtype=np.int64)
+    min_traveltime = np.full(n_dest, -1, dtype=np.int32)
+    touched = np.empty(n_dest, dtype=np.int64)
+
+    for i in range(len(opportunity_offsets) - 1):
+        # Shortest travel time to each destination from any cell of the opportunity
+        n_touched = 0
+        for j in range(opportunity_offsets[i], opportunity_offsets[i + 1]):
+            orig = opportunity_orig[j]
+            if orig < 0:
+                continue
+            for k in range(offsets[orig], offsets[orig + 1]):
+                if traveltime[k] > opportunity_max_traveltime[j]:
+                    continue
+                d = dest_index[k]
+                if min_traveltime[d] < 0:
+                    touched[n_touched] = d
+                    n_touched += 1
+                    min_traveltime[d] = traveltime[k]
+                elif traveltime[k] < min_traveltime[d]:
+                    min_traveltime[d] = traveltime[k]
+
+        weights_row = weights[opportunity_weights[i]]
+        for m in range(n_touched):
+            d = touched[m]
+            accessibility[d] += (
+                weights_row[min_traveltime[d]] * opportunity_potential[i]
+            )
+            opportunity_count[d] += 1
+            min_traveltime[d] = -1
+
+    return accessibility, opportunity_count
+
+
+def compute_gravity_heatmap(
+    matrix: dict,
+    opportunities: dict,
+    impedance_function: str,
+    max_traveltime: int,
+    max_sensitivity: float,
+) -> dict:
+    """
+    Compute a gravity heatmap from the CSR arrays of the matrix and opportunities.
+
+    :return: The integer H3 index, accessibility and number of reaching
+        opportunities of each reached cell.
+    """
+    sensitivities, opportunity_weights = np.unique(
+        opportunities["sensitivity"], return_inverse=True
+    )
+    weights = build_impedance_table(
+        impedance_function, sensitivities, max_traveltime, max_sensitivity
+    )
+    accessibility, opportunity_count = gravity_accessibility(
+        matrix["offsets"],
+        matrix["dest_index"],
+        matrix["traveltime"],
+        len(matrix["dest_id"]),
+        opportunities["offsets"],
+        opportunities["orig"],
+        opportunities["max_traveltime"],
+        opportunity_weights.astype(np.int64),
+        opportunities["potential"],
+        weights,
+    )
+    reached = opportunity_count > 0
+    return {
+        "h3_index": matrix["dest_id"][reached],
+        "accessibility": accessibility[reached],
+        "opportunity_count": opportunity_count[reached],
+    }
+
+
+@njit(cache=True, nogil=True)
+def closest_average_traveltime(
+    offsets,
+    dest_index,
+    traveltime,
+    n_dest,
+    opportunity_offsets,
+    opportunity_orig,
+    opportunity_max_traveltime,
+    opportunity_group,
+    group_size,
+):
+    """
+    Average the travel times to the closest opportunities of each destination.
+    For every group g of opportunities, a bounded max-heap per destination keeps
+    the group_size[g] shortest travel times seen so far, so selecting them costs
+    O(log k) per reached destination instead of sorting all of them.
+
+    :return: The average travel time of each destination over the kept travel
+        times of all groups, and whether any opportunity reached it.
+    """
+    n_groups = len(group_size)
+    heap_offsets = np.zeros(n_groups + 1, dtype=np.int64)
+    for g in range(n_groups):
+        heap_offsets[g + 1] = heap_offsets[g] + group_size[g] * n_dest
+    heaps = np.empty(heap_offsets[n_groups], dtype=np.int16)
+    heap_length = np.zeros(n_groups * n_dest, dtype=np.int64)
+    min_traveltime = np.full(n_dest, -1, dtype=np.int32)
+    touched = np.empty(n_dest, dtype=np.int64)
+
+    for i in range(len(opportunity_offsets) - 1):
+        # Shortest travel time to each destination from any cell of the opportunity
+        n_touched = 0
+        for j in range(opportunity_offsets[i], opportunity_offsets[i + 1]):
+            orig = opportunity_orig[j]
+            if orig < 0:
+                continue
+            for k in range(offsets[orig], offsets[orig + 1]):
+                if traveltime[k] > opportunity_max_traveltime[j]:
+                    continue
+                d = dest_index[k]
+                if min_traveltime[d] < 0:
+                    touched[n_touched] = d
+                    n_touched += 1
+                    min_traveltime[d] = traveltime[k]
+                elif traveltime[k] < min_traveltime[d]:
+                    min_traveltime[d] = traveltime[k]
+
+        g = opportunity_group[i]
+        size = group_size[g]
+        for m in range(n_touched):
+            d = touched[m]
+            t = min_traveltime[d]
+            min_traveltime[d] = -1
+            if size == 0:
+                continue
+
+            start = heap_offsets[g] + d * size
+            length = heap_length[g * n_dest + d]
+            if length < size:
+                # Sift the new travel time up from the end of the heap
+                pos = length
+                while pos > 0:
+                    parent = (pos - 1) // 2
+                    if heaps[start + parent] >= t:
+                        break
+                    heaps[start + pos] = heaps[start + parent]
+                    pos = parent
+                heaps[start + pos] = t
+                heap_length[g * n_dest + d] = length + 1
+            elif t < heaps[start]:
+                # Replace the longest kept travel time and sift it down
+                pos = 0
+                while True:
+                    child = 2 * pos + 1
+                    if child >= size:
+                        break
+                    if (
+                        child + 1 < size
+                        and heaps[start + child + 1] > heaps[start + child]
+                    ):
+                        child += 1
+                    if heaps[start + child] <= t:
+                        break
+                    heaps[start + pos] = heaps[start + child]
+                    pos = child
+                heaps[start + pos] = t
+
+    total = np.zeros(n_dest, dtype=np.float64)
+    count = np.zeros(n_dest, dtype=np.int64)
+    for g in range(n_groups):
+        size = group_size[g]
+        for d in range(n_dest):
+            start = heap_offsets[g] + d * size
+            length = heap_length[g * n_dest + d]
+            for m in range(length):
+                total[d] += heaps[start + m]
+            count[d] += length
+
+    reached = count > 0
+    average = np.zeros(n_dest, dtype=np.float64)
+    for d in range(n_dest):
+        if reached[d]:
+            average[d] = total[d] / count[d]
+    return average, reached
+
+
+def compute_closest_average_heatmap(matrix: dict, opportunities: dict) -> dict:
+    """
+    Compute a closest-average heatmap from the CSR arrays of the matrix and
+    opportunities, the latter grouped with a num_destinations attribute.
+
+    :return: The integer H3 index and accessibility of each reached cell.
+    """
+    num_destinations, opportunity_group = np.unique(
+        opportunities["num_destinations"].astype(np.int64), return_inverse=True
+    )
+    # No more travel times can be kept than opportunities of the group exist
+    group_size = np.minimum(
+        np.maximum(num_destinations, 0),
+        np.bincount(opportunity_group, minlength=len(num_destinations)),
+    )
+    accessibility, reached = closest_average_traveltime(
+        matrix["offsets"],
+        matrix["dest_index"],
+        matrix["traveltime"],
+        len(matrix["dest_id"]),
+        opportunities["offsets"],
+        opportunities["orig"],
+        opportunities["max_traveltime"],
+        opportunity_group.astype(np.int64),
+        group_size.astype(np.int64),
+    )
+    return {
+        "h3_index": matrix["dest_id"][reached],
+        "accessibility": accessibility[reached],
+    }
+
+
+def compute_connectivity_heatmap(
+    matrix: dict, h3_index: np.ndarray, max_traveltime: int, cell_area: float
+) -> dict:
+    """
+    Compute a connectivity heatmap, the area of the cells reachable from each
+    reference area cell within max_traveltime. Like in the SQL engine, a cell
+    listed several times in the reference area is counted once per listing.
+
+    :return: The integer H3 index and accessibility of each connected cell.
+    """
+    entry_origin = np.repeat(
+        np.arange(len(matrix["orig_id"])), np.diff(matrix["offsets"])
+    )
+    reachable_cells = np.bincount(
+        entry_origin[matrix["traveltime"] <= max_traveltime],
+        minlength=len(matrix["orig_id"]),
+    )
+
+    cells, n_listed = np.unique(
+        np.asarray(h3_index, dtype=np.int64), return_counts=True
+    )
+    orig = np.searchsorted(matrix["orig_id"], cells)
+    orig[orig == len(matrix["orig_id"])] = 0
+    found = np.zeros(len(cells), dtype=np.bool_)
+    if len(matrix["orig_id"]):
+        found = matrix["orig_id"][orig] == cells
+        found[found] = reachable_cells[orig[found]] > 0
+    return {
+        "h3_index": cells[found],
+        "accessibility": n_listed[found]
+        * reachable_cells[orig[found]]
+        * float(cell_area),
+    }
@@ -3,15 +3,32 @@ Translated from https://github.com/goat-community/goat/blob/0089611acacbebf4e297
 """
 
 import math
+import time
 
 import numpy as np
+import shapely
 from geopandas import GeoDataFrame
-from numba import njit
-from shapely.geometry import shape
+from numba import njit, prange
+
+from src.core.config import settings
+from src.utils import (
+    compute_r5_surface,
+    decode_r5_grid,
+    pixel_to_latitude,
+    pixel_to_longitude,
+    pixel_x_to_web_mercator_x,
+    pixel_y_to_web_mercator_y,
+)
+
+# Maximum number of vertices of a ring after simplification
+MAX_COORDS = 20000
 
-from src.utils import compute_r5_surface, coordinate_from_pixel, decode_r5_grid
+# Shells with at least this many vertices get their edges indexed for hole lookups
+EDGE_INDEX_MIN_VERTICES = 64
+EDGE_INDEX_EDGES_PER_BIN = 8
 
-MAX_COORDS = 20000
+# Smallest fraction of a pixel between an interpolated vertex and the pixels
+MIN_FRACTION = 1e-6
 
 
 @njit
@@ -60,71 +77,99 @@ def get_contour(surface, width, height, cutoff):
     return contour
 
 
-@njit
-def followLoop(idx, xy, prev_xy):
+@njit(cache=True)
+def get_band_index(surface, sorted_cutoffs):
+    """
+    Classify every pixel against all cutoffs in one pass. A pixel is in band k if
+    sorted_cutoffs[k - 1] <= value < sorted_cutoffs[k], so it lies within cutoff k
+    and all larger cutoffs.
+    """
+    band = np.empty(surface.shape[0], dtype=np.uint8)
+    for i in range(surface.shape[0]):
+        band[i] = np.searchsorted(sorted_cutoffs, surface[i], side="right")
+    return band
+
+
+@njit(cache=True)
+def get_cell_index(band, width, height, x, y, rank):
+    """
+    Get the marching squares index of a cell for the cutoff with the given rank.
+    Equivalent to a single cell of get_contour.
+    """
+    index = y * width + x
+    topLeft = band[index] <= rank and x != 0 and y != 0
+    topRight = band[index + 1] <= rank and x != width - 2 and y != 0
+    botLeft = band[index + width] <= rank and x != 0 and y != height - 2
+    botRight = band[index + width + 1] <= rank and x != width - 2 and y != height - 2
+
+    idx = 0
+    if topLeft:
+        idx |= 1 << 3
+    if topRight:
+        idx |= 1 << 2
+    if botRight:
+        idx |= 1 << 1
+    if botLeft:
+        idx |= 1
+    return idx
+
+
+@njit(cache=True)
+def followLoop(idx, x, y, prevx, prevy):
     """
     Follow the loop
     We keep track of which contour cell we're in, and we always keep the filled
     area to our left. Thus we always indicate only which direction we exit the
     cell.
     """
-    x = xy[0]
-    y = xy[1]
-    prevx = prev_xy[0]
-    prevy = prev_xy[1]
-
-    if idx in (1, 3, 7):
-        return [x - 1, y]
-    elif idx in (2, 6, 14):
-        return [x, y + 1]
-    elif idx in (4, 12, 13):
-        return [x + 1, y]
+    if idx == 1 or idx == 3 or idx == 7:
+        return x - 1, y
+    elif idx == 2 or idx == 6 or idx == 14:
+        return x, y + 1
+    elif idx == 4 or idx == 12 or idx == 13:
+        return x + 1, y
     elif idx == 5:
         # Assume that saddle has // orientation (as opposed to \\). It doesn't
         # really matter if we're wrong, we'll just have two disjoint pieces
         # where we should have one, or vice versa.
         # From Bottom:
         if prevy > y:
-            return [x + 1, y]
+            return x + 1, y
 
         # From Top:
         if prevy < y:
-            return [x - 1, y]
+            return x - 1, y
 
-        return [x, y]
-    elif idx in (8, 9, 11):
-        return [x, y - 1]
+        return x, y
+    elif idx == 8 or idx == 9 or idx == 11:
+        return x, y - 1
     elif idx == 10:
         # From left
         if prevx < x:
-            return [x, y + 1]
+            return x, y + 1
 
         # From right
         if prevx > x:
-            return [x, y - 1]
+            return x, y - 1
 
-        return [x, y]
+        return x, y
 
     else:
-        return [x, y]
+        return x, y
 
 
-@njit
-def interpolate(pos, cutoff, start, surface, width, height):
+@njit(cache=True, error_model="numpy")
+def interpolate(x, y, startx, starty, cutoff, surface, width, height):
     """
     Do linear interpolation
     """
     #   The edges are always considered unreachable to avoid edge effects so set
     #   them to the cutoff.
-    x = pos[0]
-    y = pos[1]
-    startx = start[0]
-    starty = start[1]
     index = y * width + x
-    topLeft = surface[index]
-    topRight = surface[index + 1]
-    botLeft = surface[index + width]
-    botRight = surface[index + width + 1]
+    topLeft = float(surface[index])
+    topRight = float(surface[index + 1])
+    botLeft = float(surface[index + width])
+    botRight = float(surface[index + width + 1])
     if x == 0:
         topLeft = botLeft = cutoff
     if y == 0:
@@ -136,210 +181,855 @@ def interpolate(pos, cutoff, start, surface, width, height):
     # From left
     if startx < x:
         frac = (cutoff - topLeft) / (botLeft - topLeft)
-        return [x, y + ensureFractionIsNumber(frac, "left")]
+        return x, y + ensureFractionIsNumber(frac)
     # From right
     if startx > x:
         frac = (cutoff - topRight) / (botRight - topRight)
-        return [x + 1, y + ensureFractionIsNumber(frac, "right")]
+        return x + 1, y + ensureFractionIsNumber(frac)
     # From bottom
     if starty > y:
         frac = (cutoff - botLeft) / (botRight - botLeft)
-        return [x + ensureFractionIsNumber(frac, "bottom"), y + 1]
+        return x + ensureFractionIsNumber(frac), y + 1
     # From top
-    if starty < y:
-        frac = (cutoff - topLeft) / (topRight - topLeft)
-        return [x + ensureFractionIsNumber(frac, "top"), y]
-    pass
+    frac = (cutoff - topLeft) / (topRight - topLeft)
+    return x + ensureFractionIsNumber(frac), y
 
 
-@njit
-def noInterpolate(pos, start):
-    x = pos[0]
-    y = pos[1]
-    startx = start[0]
-    starty = start[1]
+@njit(cache=True)
+def noInterpolate(x, y, startx, starty):
     # From left
     if startx < x:
-        return [x, y + 0.5]
+        return x, y + 0.5
     # From right
     if startx > x:
-        return [x + 1, y + 0.5]
+        return x + 1, y + 0.5
     # From bottom
     if starty > y:
-        return [x + 0.5, y + 1]
+        return x + 0.5, y + 1
     # From top
-    if starty < y:
-        return [x + 0.5, y]
-    pass
+    return x + 0.5, y
 
 
 # Calculated fractions may not be numbers causing interpolation to fail.
-@njit
-def ensureFractionIsNumber(frac, direction):
+@njit(cache=True)
+def ensureFractionIsNumber(frac):
     if math.isnan(frac) or math.isinf(frac):
         return 0.5
-    return frac
+    # A pixel equal to the cutoff would put the vertex onto the pixel, where rings
+    # passing the pixel on different sides touch, so keep it just off the pixel.
+    return min(max(frac, MIN_FRACTION), 1 - MIN_FRACTION)
 
 
-@njit
-def calculate_jsolines(
+@njit(cache=True)
+def trace_rings(
+    band,
     surface,
     width,
     height,
     west,
     north,
     zoom,
-    cutoffs,
-    interpolation=True,
-    web_mercator=True,
+    cutoff,
+    rank,
+    interpolation,
+    web_mercator,
+    write,
+    coords,
+    vertex_start,
+    ring_offsets,
+    ring_is_shell,
+    ring_start,
 ):
-    geometries = []
-    for _, cutoff in np.ndenumerate(cutoffs):
-        contour = get_contour(surface, width, height, cutoff)
-        cWidth = width - 1
-        # Store warnings
-        warnings = []
-
-        # JavaScript does not have boolean arrays.
-        found = np.zeros((width - 1) * (height - 1), dtype=np.int8)
-
-        # DEBUG, comment out to save memory
-        indices = []
-
-        # We'll sort out what shell goes with what hole in a bit.
-        shells = []
-        holes = []
-
-        # Find a cell that has a line in it, then follow that line, keeping filled
-        # area to your left. This lets us use winding direction to determine holes.
-
-        for origy in range(height - 1):
-            for origx in range(width - 1):
-                index = origy * cWidth + origx
-                if found[index] == 1:
-                    continue
-                idx = contour[index]
+    """
+    Trace all rings of a single cutoff. If write is False, only the number of rings
+    and vertices are counted, otherwise the rings are written into the coordinate
+    buffer starting at vertex_start and ring_start.
 
-                # Continue if there is no line here or if it's a saddle, as we don't know which way the saddle goes.
-                if idx == 0 or idx == 5 or idx == 10 or idx == 15:
-                    continue
+    :return: Number of rings, number of vertices and length of the longest
+    discarded ring, which is the scratch space needed in addition to the vertices.
+    """
+    cWidth = width - 1
+    found = np.zeros((width - 1) * (height - 1), dtype=np.bool_)
+    n_rings = 0
+    n_vertices = 0
+    max_discarded = 0
+
+    # Find a cell that has a line in it, then follow that line, keeping filled
+    # area to your left. This lets us use winding direction to determine holes.
+    for origy in range(height - 1):
+        for origx in range(width - 1):
+            index = origy * cWidth + origx
+            if found[index]:
+                continue
+            idx = get_cell_index(band, width, height, origx, origy, rank)
+
+            # Continue if there is no line here or if it's a saddle, as we don't know which way the saddle goes.
+            if idx == 0 or idx == 5 or idx == 10 or idx == 15:
+                continue
+
+            # Huzzah! We have found a line, now follow it, keeping the filled area to our left,
+            # which allows us to use the winding direction to determine what should be a shell and
+            # what should be a hole
+            x = origx
+            y = origy
+            startx = starty = -1
+            cursor = vertex_start + n_vertices
+            length = 0
+            closed = False
+
+            # Track winding direction
+            direction = 0
+
+            # Make sure we're not traveling in circles.
+            # NB using index from _previous_ cell, we have not yet set an index for this cell
+            while not found[index]:
+                prevx = startx
+                prevy = starty
+                startx = x
+                starty = y
+                idx = get_cell_index(band, width, height, x, y, rank)
+
+                # Mark as found if it's not a saddle because we expect to reach saddles twice.
+                if idx != 5 and idx != 10:
+                    found[index] = True
+
+                # Ran off outside of ring
+                if idx == 0 or idx >= 15:
+                    break
+
+                # Follow the loop
+                x, y = followLoop(idx, x, y, prevx, prevy)
+                index = y * cWidth + x
+
+                # Keep track of winding direction
+                direction += (x - startx) * (y + starty)
+
+                # Unexpected coordinate shift, discarding ring
+                if x == startx and y == starty:
+                    break
+
+                if write:
+                    # Shift exact coordinates
+                    if interpolation:
+                        px, py = interpolate(
+                            x, y, startx, starty, cutoff, surface, width, height
+                        )
+                    else:
+                        px, py = noInterpolate(x, y, startx, starty)
+                    if web_mercator:
+                        coords[cursor + length, 0] = pixel_x_to_web_mercator_x(
+                            px + west, zoom
+                        )
+                        coords[cursor + length, 1] = pixel_y_to_web_mercator_y(
+                            py + north, zoom
+                        )
+                    else:
+                        coords[cursor + length, 0] = pixel_to_longitude(px + west, zoom)
+                        coords[cursor + length, 1] = pixel_to_latitude(py + north, zoom)
+                length += 1
+
+                # We're back at the start of the ring
+                if x == origx and y == origy:
+                    # close the ring
+                    if write:
+                        coords[cursor + length, 0] = coords[cursor, 0]
+                        coords[cursor + length, 1] = coords[cursor, 1]
+                    length += 1
+                    closed = True
+                    break
+
+            if closed:
+                if write:
+                    ring_offsets[ring_start + n_rings] = cursor
+                    # Check winding direction. Positive here means counter clockwise,
+                    # see http:#stackoverflow.com/questions/1165647
+                    # +y is down so the signs are reversed from what would be expected
+                    ring_is_shell[ring_start + n_rings] = direction > 0
+                n_rings += 1
+                n_vertices += length
+            else:
+                max_discarded = max(max_discarded, length)
 
-                # Huzzah! We have found a line, now follow it, keeping the filled area to our left,
-                # which allows us to use the winding direction to determine what should be a shell and
-                # what should be a hole
-                pos = [origx, origy]
-                prev = [-1, -1]
-                start = [-1, -1]
+    return n_rings, n_vertices, max_discarded
 
-                # Track winding direction
-                direction = 0
-                coords = []
 
-                # Make sure we're not traveling in circles.
-                # NB using index from _previous_ cell, we have not yet set an index for this cell
+@njit(parallel=True, cache=True)
+def trace_isoline_rings(
+    band,
+    surface,
+    width,
+    height,
+    west,
+    north,
+    zoom,
+    cutoffs,
+    ranks,
+    interpolation,
+    web_mercator,
+):
+    """
+    Trace the rings of all cutoffs in parallel into ragged coordinate buffers.
 
-                while found[index] != 1:
-                    prev = start
-                    start = pos
-                    idx = contour[index]
+    :return: Coordinates of all rings, offsets of each ring into the coordinates
+    (n_rings + 1), winding direction flag of each ring and offsets of each cutoff
+    into the rings (n_cutoffs + 1).
+    """
+    n_cutoffs = cutoffs.shape[0]
+    n_rings = np.zeros(n_cutoffs, dtype=np.int64)
+    n_vertices = np.zeros(n_cutoffs, dtype=np.int64)
+    max_discarded = np.zeros(n_cutoffs, dtype=np.int64)
+    empty_coords = np.empty((0, 2), dtype=np.float64)
+    empty_offsets = np.empty(0, dtype=np.int64)
+    empty_is_shell = np.empty(0, dtype=np.bool_)
+
+    # Count rings & vertices to preallocate the buffers
+    for k in prange(n_cutoffs):
+        n_rings[k], n_vertices[k], max_discarded[k] = trace_rings(
+            band,
+            surface,
+            width,
+            height,
+            west,
+            north,
+            zoom,
+            cutoffs[k],
+            ranks[k],
+            interpolation,
+            web_mercator,
+            False,
+            empty_coords,
+            0,
+            empty_offsets,
+            empty_is_shell,
+            0,
+        )
 
-                    indices.append(idx)
+    # Every cutoff gets its own region of the buffers, including scratch space for
+    # rings which are discarded while tracing
+    vertex_start = np.zeros(n_cutoffs + 1, dtype=np.int64)
+    ring_start = np.zeros(n_cutoffs + 1, dtype=np.int64)
+    for k in range(n_cutoffs):
+        vertex_start[k + 1] = vertex_start[k] + n_vertices[k] + max_discarded[k]
+        ring_start[k + 1] = ring_start[k] + n_rings[k]
+    buffer = np.empty((vertex_start[n_cutoffs], 2), dtype=np.float64)
+    buffer_offsets = np.empty(ring_start[n_cutoffs], dtype=np.int64)
+    ring_is_shell = np.empty(ring_start[n_cutoffs], dtype=np.bool_)
+
+    # Trace rings into the buffers
+    for k in prange(n_cutoffs):
+        trace_rings(
+            band,
+            surface,
+            width,
+            height,
+            west,
+            north,
+            zoom,
+            cutoffs[k],
+            ranks[k],
+            interpolation,
+            web_mercator,
+            True,
+            buffer,
+            vertex_start[k],
+            buffer_offsets,
+            ring_is_shell,
+            ring_start[k],
+        )
 
-                    # Mark as found if it's not a saddle because we expect to reach saddles twice.
-                    if idx != 5 and idx != 10:
-                        found[index] = 1
+    # Drop the scratch space, the rings of each cutoff are contiguous
+    coords = np.empty((n_vertices.sum(), 2), dtype=np.float64)
+    ring_offsets = np.empty(ring_start[n_cutoffs] + 1, dtype=np.int64)
+    shift = 0
+    for k in range(n_cutoffs):
+        start = vertex_start[k]
+        coords[start - shift : start - shift + n_vertices[k]] = buffer[
+            start : start + n_vertices[k]
+        ]
+        for r in range(ring_start[k], ring_start[k + 1]):
+            ring_offsets[r] = buffer_offsets[r] - shift
+        shift += max_discarded[k]
+    ring_offsets[ring_start[n_cutoffs]] = coords.shape[0]
+
+    return coords, ring_offsets, ring_is_shell, ring_start
+
+
+@njit(cache=True)
+def get_ring_bounds(coords, ring_offsets):
+    """
+    Get the bounding box (xmin, ymin, xmax, ymax) of every ring.
+    """
+    n_rings = ring_offsets.shape[0] - 1
+    bounds = np.empty((n_rings, 4), dtype=np.float64)
+    for ring in range(n_rings):
+        start = ring_offsets[ring]
+        bounds[ring, 0] = bounds[ring, 2] = coords[start, 0]
+        bounds[ring, 1] = bounds[ring, 3] = coords[start, 1]
+        for i in range(start + 1, ring_offsets[ring + 1]):
+            bounds[ring, 0] = min(bounds[ring, 0], coords[i, 0])
+            bounds[ring, 1] = min(bounds[ring, 1], coords[i, 1])
+            bounds[ring, 2] = max(bounds[ring, 2], coords[i, 0])
+            bounds[ring, 3] = max(bounds[ring, 3], coords[i, 1])
+    return bounds
+
+
+@njit(cache=True)
+def get_ring_areas(coords, ring_offsets):
+    """
+    Get the unsigned area of every ring.
+    """
+    n_rings = ring_offsets.shape[0] - 1
+    areas = np.empty(n_rings, dtype=np.float64)
+    for ring in range(n_rings):
+        area = 0.0
+        for i in range(ring_offsets[ring], ring_offsets[ring + 1] - 1):
+            area += coords[i, 0] * coords[i + 1, 1] - coords[i + 1, 0] * coords[i, 1]
+        areas[ring] = abs(area) / 2
+    return areas
+
+
+@njit(cache=True)
+def build_shell_index(bounds, ring_is_shell, first, last):
+    """
+    Build a packed grid index of the shell bounding boxes of a single cutoff.
+    Every shell is registered in each grid cell its bounding box overlaps.
 
-                    if idx == 0 or idx >= 15:
-                        warnings.append("Ran off outside of ring")
-                        break
+    :return: Extent and size of the grid and the shells of each grid cell as
+    offsets and values.
+    """
+    # Grid extent
+    xmin = ymin = np.inf
+    xmax = ymax = -np.inf
+    n_shells = 0
+    for ring in range(first, last):
+        if ring_is_shell[ring]:
+            xmin = min(xmin, bounds[ring, 0])
+            ymin = min(ymin, bounds[ring, 1])
+            xmax = max(xmax, bounds[ring, 2])
+            ymax = max(ymax, bounds[ring, 3])
+            n_shells += 1
+
+    # Roughly one shell per grid cell
+    grid_size = max(1, int(math.sqrt(n_shells)))
+    cell_width = max((xmax - xmin) / grid_size, 1e-12)
+    cell_height = max((ymax - ymin) / grid_size, 1e-12)
+
+    # Count, then fill the shells of each grid cell
+    cell_offsets = np.zeros(grid_size * grid_size + 1, dtype=np.int64)
+    for fill in range(2):
+        if fill:
+            for cell in range(grid_size * grid_size):
+                cell_offsets[cell + 1] += cell_offsets[cell]
+            cell_shells = np.empty(cell_offsets[-1], dtype=np.int64)
+            cursor = cell_offsets[:-1].copy()
+        for ring in range(first, last):
+            if not ring_is_shell[ring]:
+                continue
+            col_min = min(int((bounds[ring, 0] - xmin) / cell_width), grid_size - 1)
+            col_max = min(int((bounds[ring, 2] - xmin) / cell_width), grid_size - 1)
+            row_min = min(int((bounds[ring, 1] - ymin) / cell_height), grid_size - 1)
+            row_max = min(int((bounds[ring, 3] - ymin) / cell_height), grid_size - 1)
+            for row in range(row_min, row_max + 1):
+                for col in range(col_min, col_max + 1):
+                    cell = row * grid_size + col
+                    if fill:
+                        cell_shells[cursor[cell]] = ring
+                        cursor[cell] += 1
+                    else:
+                        cell_offsets[cell + 1] += 1
+
+    return (
+        xmin,
+        ymin,
+        xmax,
+        ymax,
+        cell_width,
+        cell_height,
+        grid_size,
+        cell_offsets,
+        cell_shells,
+    )
 
-                    # Follow the loop
-                    pos = followLoop(idx, pos, prev)
-                    index = pos[1] * cWidth + pos[0]
 
-                    # Keep track of winding direction
-                    direction += (pos[0] - start[0]) * (pos[1] + start[1])
+@njit(cache=True)
+def build_edge_index(coords, ring_offsets, bounds, ring_is_shell, first, last):
+    """
+    Bin the edges of large shells of a single cutoff by y. A point can only be
+    inside a ring if one of the edges in its y-bin crosses the ray from the point.
 
-                    # Shift exact coordinates
-                    if interpolation:
-                        coord = interpolate(pos, cutoff, start, surface, width, height)
+    :return: Offsets of each ring into the bins (no bins for small rings) and the
+    edges of each bin as offsets and values. Edges are stored by their first vertex.
+    """
+    ring_bins = np.zeros(last - first + 1, dtype=np.int64)
+    for ring in range(first, last):
+        n_vertices = ring_offsets[ring + 1] - ring_offsets[ring]
+        n_bins = 0
+        if ring_is_shell[ring] and n_vertices >= EDGE_INDEX_MIN_VERTICES:
+            n_bins = n_vertices // EDGE_INDEX_EDGES_PER_BIN
+        ring_bins[ring - first + 1] = ring_bins[ring - first] + n_bins
+
+    # Count, then fill the edges of each bin
+    bin_offsets = np.zeros(ring_bins[-1] + 1, dtype=np.int64)
+    for fill in range(2):
+        if fill:
+            for i in range(ring_bins[-1]):
+                bin_offsets[i + 1] += bin_offsets[i]
+            bin_edges = np.empty(bin_offsets[-1], dtype=np.int64)
+            cursor = bin_offsets[:-1].copy()
+        for ring in range(first, last):
+            first_bin = ring_bins[ring - first]
+            n_bins = ring_bins[ring - first + 1] - first_bin
+            if n_bins == 0:
+                continue
+            bin_height = max((bounds[ring, 3] - bounds[ring, 1]) / n_bins, 1e-12)
+            # The ring is closed, so the edge from the last to the first vertex
+            # is degenerate and skipped
+            for edge in range(ring_offsets[ring], ring_offsets[ring + 1] - 1):
+                y1 = coords[edge, 1]
+                y2 = coords[edge + 1, 1]
+                bin_min = int((min(y1, y2) - bounds[ring, 1]) / bin_height)
+                bin_max = int((max(y1, y2) - bounds[ring, 1]) / bin_height)
+                for bin in range(
+                    min(bin_min, n_bins - 1), min(bin_max, n_bins - 1) + 1
+                ):
+                    if fill:
+                        bin_edges[cursor[first_bin + bin]] = edge
+                        cursor[first_bin + bin] += 1
                     else:
-                        coord = noInterpolate(pos, start)
+                        bin_offsets[first_bin + bin + 1] += 1
 
-                    if not coord:
-                        warnings.append(
-                            f"Unexpected coo rdinate shift from ${start[0]}, ${start[1]} to ${pos[0]}, ${pos[1]}, discarding ring"
-                        )
+    return ring_bins, bin_offsets, bin_edges
+
+
+@njit(parallel=True, cache=True)
+def assign_holes(coords, ring_offsets, ring_is_shell, cutoff_offsets, nested=False):
+    """
+    Sort out shells and holes.
+
+    The shells of each cutoff are indexed by their bounding boxes, so the exact point
+    in polygon test only runs against shells whose bounding box contains the hole.
+
+    :param nested: Whether shells can lie inside each other (isobands). A hole is then
+    assigned to the smallest shell containing it instead of requiring a single one.
+
+    :return: Index of the shell containing each hole, -1 for shells and for holes
+    which can't be assigned.
+    """
+    bounds = get_ring_bounds(coords, ring_offsets)
+    if nested:
+        areas = get_ring_areas(coords, ring_offsets)
+        extent = np.empty(4, dtype=np.float64)
+        if bounds.shape[0] > 0:
+            extent[0] = bounds[:, 0].min()
+            extent[1] = bounds[:, 1].min()
+            extent[2] = bounds[:, 2].max()
+            extent[3] = bounds[:, 3].max()
+    shell_index = np.full(ring_is_shell.shape[0], -1, dtype=np.int64)
+    for k in prange(cutoff_offsets.shape[0] - 1):
+        (
+            xmin,
+            ymin,
+            xmax,
+            ymax,
+            cell_width,
+            cell_height,
+            grid_size,
+            cell_offsets,
+            cell_shells,
+        ) = build_shell_index(
+            bounds, ring_is_shell, cutoff_offsets[k], cutoff_offsets[k + 1]
+        )
+        ring_bins, bin_offsets, bin_edges = build_edge_index(
+            coords,
+            ring_offsets,
+            bounds,
+            ring_is_shell,
+            cutoff_offsets[k],
+            cutoff_offsets[k + 1],
+        )
+
+        for hole in range(cutoff_offsets[k], cutoff_offsets[k + 1]):
+            # Only accept holes that are at least 2-dimensional.
+            if ring_is_shell[hole] or ring_offsets[hole + 1] - ring_offsets[hole] < 3:
+                continue
+
+            # NB this is checking whether the first coordinate of the hole is inside
+            # the shell. This is sufficient as shells don't overlap (or are nested),
+            # and holes are guaranteed to be completely contained by a shell.
+            vertex = ring_offsets[hole]
+            if nested:
+                # The rings of all cutoffs meet at the edge of the grid, where the
+                # surface is set to the cutoff, so take a vertex off the edge.
+                for i in range(ring_offsets[hole], ring_offsets[hole + 1]):
+                    if (
+                        extent[0] < coords[i, 0] < extent[2]
+                        and extent[1] < coords[i, 1] < extent[3]
+                    ):
+                        vertex = i
                         break
-                    xy = coordinate_from_pixel(
-                        [coord[0] + west, coord[1] + north],
-                        zoom=zoom,
-                        web_mercator=web_mercator,
+            x = coords[vertex, 0]
+            y = coords[vertex, 1]
+            if not (xmin <= x <= xmax and ymin <= y <= ymax):
+                continue
+            col = min(int((x - xmin) / cell_width), grid_size - 1)
+            row = min(int((y - ymin) / cell_height), grid_size - 1)
+            cell = row * grid_size + col
+
+            containing_shell = -1
+            n_containing_shells = 0
+            for i in range(cell_offsets[cell], cell_offsets[cell + 1]):
+                shell = cell_shells[i]
+                if not (
+                    bounds[shell, 0] <= x <= bounds[shell, 2]
+                    and bounds[shell, 1] <= y <= bounds[shell, 3]
+                ):
+                    continue
+                first_bin = ring_bins[shell - cutoff_offsets[k]]
+                last_bin = ring_bins[shell - cutoff_offsets[k] + 1]
+                if first_bin == last_bin:
+                    inside = pointinpolygon(
+                        x, y, coords, ring_offsets[shell], ring_offsets[shell + 1]
                     )
-                    coords.append(xy)
-
-                    # We're back at the start of the ring
-                    if pos[0] == origx and pos[1] == origy:
-                        coords.append(coords[0])  # close the ring
-
-                        # make it a fully-fledged GeoJSON object
-                        geom = [coords]
-
-                        # Check winding direction. Positive here means counter clockwise,
-                        # see http:#stackoverflow.com/questions/1165647
-                        # +y is down so the signs are reversed from what would be expected
-                        if direction > 0:
-                            shells.append(geom)
-                        else:
-                            holes.append(geom)
-                        break
+                else:
+                    inside = pointinpolygon_indexed(
+                        x,
+                        y,
+                        coords,
+                        bounds[shell, 1],
+                        max(
+                            (bounds[shell, 3] - bounds[shell, 1])
+                            / (last_bin - first_bin),
+                            1e-12,
+                        ),
+                        bin_offsets[first_bin : last_bin + 1],
+                        bin_edges,
+                    )
+                if inside:
+                    if (
+                        not nested
+                        or containing_shell == -1
+                        or areas[shell] < areas[containing_shell]
+                    ):
+                        containing_shell = shell
+                    n_containing_shells += 1
+            if n_containing_shells == 1 or (nested and containing_shell != -1):
+                shell_index[hole] = containing_shell
+    return shell_index
+
+
+def trace_jsolines(
+    surface,
+    width,
+    height,
+    west,
+    north,
+    zoom,
+    sorted_cutoffs,
+    interpolation=True,
+    web_mercator=True,
+):
+    """
+    Trace the rings of all cutoffs and assign the holes to their shells.
 
-        # Shell game time. Sort out shells and holes.
-        for hole in holes:
-            # Only accept holes that are at least 2-dimensional.
-            # Workaroudn (x+y) to avoid float to str type conversion in numba
-            vertices = []
-            for x, y in hole[0]:
-                vertices.append((x + y))
-
-            if len(vertices) >= 3:
-                # NB this is checking whether the first coordinate of the hole is inside
-                # the shell. This is sufficient as shells don't overlap, and holes are
-                # guaranteed to be completely contained by a single shell.
-                holePoint = hole[0][0]
-                containingShell = []
-                for shell in shells:
-                    if pointinpolygon(holePoint[0], holePoint[1], shell[0]):
-                        containingShell.append(shell)
-                if len(containingShell) == 1:
-                    containingShell[0].append(hole[0])
-
-        geometries.append(list(shells))
+    The surface is classified against all cutoffs at once, then the rings of each
+    cutoff are traced in parallel.
+
+    :return: The coordinates, ring offsets, ring types, cutoff offsets (rings of each
+    cutoff in sorted order) and the shell index of every hole.
+    """
+    if sorted_cutoffs.shape[0] > np.iinfo(np.uint8).max:
+        raise ValueError("Too many cutoffs to compute jsolines.")
+    band = get_band_index(surface, sorted_cutoffs)
+    coords, ring_offsets, ring_is_shell, cutoff_offsets = trace_isoline_rings(
+        band,
+        surface,
+        int(width),
+        int(height),
+        int(west),
+        int(north),
+        int(zoom),
+        sorted_cutoffs,
+        np.arange(sorted_cutoffs.shape[0]),
+        interpolation,
+        web_mercator,
+    )
+    shell_index = assign_holes(coords, ring_offsets, ring_is_shell, cutoff_offsets)
+    return coords, ring_offsets, ring_is_shell, cutoff_offsets, shell_index
+
+
+def get_ring_vertices(ring_offsets, rings):
+    """
+    Get the vertex indices of the given rings, concatenated in the given order.
+
+    :return: The vertex indices and the new ring offsets.
+    """
+    lengths = ring_offsets[rings + 1] - ring_offsets[rings]
+    offsets = np.zeros(rings.shape[0] + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    vertices = np.arange(offsets[-1], dtype=np.int64) + np.repeat(
+        ring_offsets[rings] - offsets[:-1], lengths
+    )
+    return vertices, offsets
+
+
+def get_isoband_rings(coords, ring_offsets, ring_is_shell, cutoff_offsets):
+    """
+    Collect the rings bounding each band between two consecutive sorted cutoffs.
+
+    A ring belongs to band k when it lies between cutoff k - 1 and cutoff k: the band
+    is bounded by the rings of cutoff k and by the rings of cutoff k - 1, whose shells
+    become holes of the band and whose holes become shells.
+
+    :return: The coordinates, ring offsets, ring types and band offsets of the bands.
+    """
+    n_cutoffs = cutoff_offsets.shape[0] - 1
+    first = cutoff_offsets[np.maximum(np.arange(n_cutoffs) - 1, 0)]
+    last = cutoff_offsets[1:]
+    band_offsets = np.zeros(n_cutoffs + 1, dtype=np.int64)
+    np.cumsum(last - first, out=band_offsets[1:])
+
+    rings = np.concatenate([np.arange(first[k], last[k]) for k in range(n_cutoffs)])
+    band_is_shell = ring_is_shell[rings].copy()
+    for k in range(1, n_cutoffs):
+        lower = band_offsets[k] + np.arange(cutoff_offsets[k] - cutoff_offsets[k - 1])
+        band_is_shell[lower] = ~band_is_shell[lower]
+
+    vertices, band_ring_offsets = get_ring_vertices(ring_offsets, rings)
+    return coords[vertices], band_ring_offsets, band_is_shell, band_offsets
+
+
+def get_invalid_isobands(bands, isolines, coords, ring_offsets, cutoff_offsets):
+    """
+    Check the bands built from the rings against the isolines they lie between.
+
+    Each cutoff resolves the saddles of the grid on its own, so the isolines of
+    consecutive cutoffs are not always nested. Where the rings of the lower cutoff
+    run along the edge of the grid, they share vertices with the rings of the
+    cutoff. In both cases the rings don't bound a valid band. If the lower isoline
+    covers the whole grid, its shell can't be assigned as a hole, so the band
+    doesn't cover the difference of the isolines either.
+
+    :param bands: The bands of the sorted cutoffs.
+    :param isolines: The isolines of the sorted cutoffs.
+    :param coords: The coordinates of the rings of the isolines.
+    :param ring_offsets: The offsets of the rings in coords.
+    :param cutoff_offsets: The offsets of the rings of each sorted cutoff.
+    :return: Whether each band must be cut out of the isolines instead.
+    """
+    areas = shapely.area(isolines)
+    expected_areas = areas - np.append(0.0, areas[:-1])
+    invalid = np.abs(shapely.area(bands) - expected_areas) > 1e-9 * areas
+    # The isolines are nested if their rings don't touch, the rings of the lower
+    # cutoff lie within the isoline of the cutoff and the rings of the cutoff lie
+    # outside of the lower isoline
+    boundaries = shapely.boundary(isolines)
+    first_coords = coords[ring_offsets[:-1]]
+    for k in np.flatnonzero(~invalid[1:]) + 1:
+        lower = first_coords[cutoff_offsets[k - 1] : cutoff_offsets[k]]
+        upper = first_coords[cutoff_offsets[k] : cutoff_offsets[k + 1]]
+        invalid[k] = (
+            shapely.intersects(boundaries[k], boundaries[k - 1])
+            or not shapely.contains_xy(isolines[k], lower[:, 0], lower[:, 1]).all()
+            or shapely.contains_xy(isolines[k - 1], upper[:, 0], upper[:, 1]).any()
+        )
+    return invalid
+
+
+def build_multipolygons(coords, ring_offsets, ring_is_shell, shell_index, offsets):
+    """
+    Create the MultiPolygon of each group of rings in bulk from the offset arrays.
+    Holes which couldn't be assigned to a shell are dropped.
+    """
+    n_groups = offsets.shape[0] - 1
+    multipolygons = shapely.empty(n_groups, geom_type=shapely.GeometryType.MULTIPOLYGON)
+    shells = np.flatnonzero(ring_is_shell)
+    if shells.shape[0] == 0:
+        return multipolygons
+
+    # Every shell followed by its holes, both in the order they were traced
+    polygon_rings = np.where(ring_is_shell, np.arange(ring_is_shell.shape[0]), -1)
+    polygon_rings[shell_index != -1] = shell_index[shell_index != -1]
+    rings = np.flatnonzero(polygon_rings != -1)
+    rings = rings[np.lexsort((~ring_is_shell[rings], polygon_rings[rings]))]
+
+    vertices, kept_ring_offsets = get_ring_vertices(ring_offsets, rings)
+    linearrings = shapely.linearrings(
+        coords[vertices],
+        indices=np.repeat(np.arange(rings.shape[0]), np.diff(kept_ring_offsets)),
+    )
+    polygons = shapely.polygons(
+        linearrings, indices=np.searchsorted(shells, polygon_rings[rings])
+    )
+    shapely.multipolygons(
+        polygons,
+        indices=np.searchsorted(offsets, shells, side="right") - 1,
+        out=multipolygons,
+    )
+    return multipolygons
+
+
+def calculate_jsolines(
+    surface,
+    width,
+    height,
+    west,
+    north,
+    zoom,
+    cutoffs,
+    interpolation=True,
+    web_mercator=True,
+):
+    """
+    Calculate the polygon coordinates of all cutoffs.
+
+    :return: A list with the polygons of each cutoff. Every polygon is a list of
+    rings (shell first), every ring an array of coordinates.
+    """
+    cutoffs = np.asarray(cutoffs, dtype=np.float64)
+    order = np.argsort(cutoffs, kind="stable")
+    coords, ring_offsets, ring_is_shell, cutoff_offsets, shell_index = trace_jsolines(
+        surface,
+        width,
+        height,
+        west,
+        north,
+        zoom,
+        cutoffs[order],
+        interpolation,
+        web_mercator,
+    )
+
+    geometries = [None] * cutoffs.shape[0]
+    for k in range(cutoffs.shape[0]):
+        rings = range(cutoff_offsets[k], cutoff_offsets[k + 1])
+        polygons = {
+            ring: [coords[ring_offsets[ring] : ring_offsets[ring + 1]]]
+            for ring in rings
+            if ring_is_shell[ring]
+        }
+        for ring in rings:
+            if shell_index[ring] != -1:
+                polygons[shell_index[ring]].append(
+                    coords[ring_offsets[ring] : ring_offsets[ring + 1]]
+                )
+        geometries[order[k]] = list(polygons.values())
     return geometries
 
 
-@njit
-def pointinpolygon(x, y, poly):
-    n = len(poly)
+@njit(cache=True)
+def crosses_ray(x, y, p1x, p1y, p2x, p2y):
+    """
+    Check if the edge from p1 to p2 crosses the ray cast from x, y to the right.
+    """
+    if y > min(p1y, p2y):
+        if y <= max(p1y, p2y):
+            if x <= max(p1x, p2x):
+                if p1x == p2x:
+                    return True
+                # y can't be within the range of a horizontal edge
+                xints = (y - p1y) * (p2x - p1x) / (p2y - p1y) + p1x
+                return x <= xints
+    return False
+
+
+@njit(cache=True)
+def pointinpolygon(x, y, coords, start, end):
+    n = end - start
     inside = False
-    p2x = 0.0
-    p2y = 0.0
-    xints = 0.0
-    p1x, p1y = poly[0]
+    p1x = coords[start, 0]
+    p1y = coords[start, 1]
     for i in range(n + 1):
-        p2x, p2y = poly[i % n]
-        if y > min(p1y, p2y):
-            if y <= max(p1y, p2y):
-                if x <= max(p1x, p2x):
-                    if p1y != p2y:
-                        xints = (y - p1y) * (p2x - p1x) / (p2y - p1y) + p1x
-                    if p1x == p2x or x <= xints:
-                        inside = not inside
+        p2x = coords[start + i % n, 0]
+        p2y = coords[start + i % n, 1]
+        if crosses_ray(x, y, p1x, p1y, p2x, p2y):
+            inside = not inside
         p1x, p1y = p2x, p2y
 
     return inside
 
 
+@njit(cache=True)
+def pointinpolygon_indexed(x, y, coords, ymin, bin_height, bin_offsets, bin_edges):
+    """
+    Same as pointinpolygon, but only tests the edges of the ring in the y-bin of
+    the point. See build_edge_index.
+    """
+    n_bins = bin_offsets.shape[0] - 1
+    bin = min(max(int((y - ymin) / bin_height), 0), n_bins - 1)
+    inside = False
+    for i in range(bin_offsets[bin], bin_offsets[bin + 1]):
+        edge = bin_edges[i]
+        if crosses_ray(
+            x,
+            y,
+            coords[edge, 0],
+            coords[edge, 1],
+            coords[edge + 1, 0],
+            coords[edge + 1, 1],
+        ):
+            inside = not inside
+    return inside
+
+
+def get_pixel_size(north, height, zoom, web_mercator=False):
+    """Get the size of a pixel in the coordinates of the isolines.
+
+    In degrees this is the height of the pixel in the middle of the surface, which
+    is smaller than its width, so that tolerances never exceed a pixel.
+    """
+
+    if web_mercator:
+        return pixel_x_to_web_mercator_x(1, zoom) - pixel_x_to_web_mercator_x(0, zoom)
+    y = north + height // 2
+    return pixel_to_latitude(y, zoom) - pixel_to_latitude(y + 1, zoom)
+
+
+def get_max_ring_coords(geometries):
+    """Get the number of vertices of the largest ring of each geometry."""
+
+    polygons, polygon_index = shapely.get_parts(geometries, return_index=True)
+    rings, ring_index = shapely.get_rings(polygons, return_index=True)
+    max_ring_coords = np.zeros(len(geometries), dtype=np.int64)
+    np.maximum.at(
+        max_ring_coords,
+        polygon_index[ring_index],
+        shapely.get_num_coordinates(rings),
+    )
+    return max_ring_coords
+
+
+def simplify_jsolines(geometries, tolerance, grid_size, max_coords=MAX_COORDS):
+    """
+    Reduce the vertices of isolines.
+
+    Isolines are simplified preserving their topology, then snapped to a grid.
+    Geometries with rings of more than max_coords vertices are simplified again
+    with twice the tolerance until they fit.
+
+    :param geometries: An array of (multi)polygons.
+    :param tolerance: The simplification tolerance.
+    :param grid_size: The size of the precision grid, 0 to keep full precision.
+    :param max_coords: The maximum number of vertices of a ring.
+
+    :return: An array of the simplified (multi)polygons.
+    """
+
+    geometries = np.asarray(geometries, dtype=object)
+    simplified = shapely.simplify(geometries, tolerance, preserve_topology=True)
+    too_large = get_max_ring_coords(simplified) > max_coords
+    # Start from a fraction of the grid size if simplification is disabled
+    capped_tolerance = tolerance or grid_size / 4
+    while too_large.any() and capped_tolerance > 0:
+        capped_tolerance *= 2
+        simplified[too_large] = shapely.simplify(
+            geometries[too_large], capped_tolerance, preserve_topology=True
+        )
+        too_large[too_large] = get_max_ring_coords(simplified[too_large]) > max_coords
+    if grid_size > 0:
+        simplified = shapely.set_precision(simplified, grid_size)
+    return simplified
+
+
 def jsolines(
     surface,
     width,
@@ -351,6 +1041,8 @@ def jsolines(
     interpolation=True,
     return_incremental=False,
     web_mercator=False,
+    simplify_tolerance=0.0,
+    precision=0.0,
 ):
     """
     Calculate isolines from a surface.
@@ -363,26 +1055,41 @@ def jsolines(
     :param zoom: The zoom level of the surface.
     :param cutoffs: A list of cutoff values.
     :param interpolation: Whether to interpolate between pixels.
-    :param return_incremental: Whether to also return incremental isolines. Takes
+    :param return_incremental: Whether to also return incremental isolines, i.e. the
+    bands between each cutoff and the next lower one.
     :param web_mercator: Whether to use web mercator coordinates.
+    :param simplify_tolerance: The simplification tolerance in pixels, 0 to disable.
+    :param precision: The size of the precision grid in pixels, 0 to disable.
 
     :return: A dictionary with full and/or incremental isolines as a geodataframe object.
     """
 
-    isochrone_multipolygon_coordinates = calculate_jsolines(
-        surface, width, height, west, north, zoom, cutoffs, interpolation, web_mercator
+    cutoffs = np.asarray(cutoffs, dtype=np.float64)
+    order = np.argsort(cutoffs, kind="stable")
+    coords, ring_offsets, ring_is_shell, cutoff_offsets, shell_index = trace_jsolines(
+        surface,
+        width,
+        height,
+        west,
+        north,
+        zoom,
+        cutoffs[order],
+        interpolation,
+        web_mercator,
     )
 
-    result = {}
-    isochrone_shapes = []
-    for isochrone in isochrone_multipolygon_coordinates:
-        isochrone_shapes.append(
-            shape({"type": "MultiPolygon", "coordinates": isochrone})
-        )
+    # Geometries are built in sorted order, put them back in the order of the cutoffs
+    isochrone_shapes = np.empty(cutoffs.shape[0], dtype=object)
+    isochrone_shapes[order] = build_multipolygons(
+        coords, ring_offsets, ring_is_shell, shell_index, cutoff_offsets
+    )
 
+    result = {}
     result["full"] = GeoDataFrame({"geometry": isochrone_shapes, "minute": cutoffs})
 
-    if return_incremental:
+    if return_incremental and not interpolation:
+        # Without interpolation the rings of all cutoffs run through the same cell
+        # midpoints, so the bands are cut out of the isolines instead.
         isochrone_diff = []
         for i in range(len(isochrone_shapes)):
             if i == 0:
@@ -395,6 +1102,45 @@ def jsolines(
         result["incremental"] = GeoDataFrame(
             {"geometry": isochrone_diff, "minute": cutoffs}
         )
+    elif return_incremental:
+        band_coords, band_ring_offsets, band_is_shell, band_offsets = get_isoband_rings(
+            coords, ring_offsets, ring_is_shell, cutoff_offsets
+        )
+        band_shell_index = assign_holes(
+            band_coords, band_ring_offsets, band_is_shell, band_offsets, nested=True
+        )
+        sorted_bands = build_multipolygons(
+            band_coords,
+            band_ring_offsets,
+            band_is_shell,
+            band_shell_index,
+            band_offsets,
+        )
+        sorted_shapes = isochrone_shapes[order]
+        invalid = get_invalid_isobands(
+            sorted_bands, sorted_shapes, coords, ring_offsets, cutoff_offsets
+        )
+        for k in np.flatnonzero(invalid):
+            sorted_bands[k] = (
+                sorted_shapes[k]
+                if k == 0
+                else sorted_shapes[k].difference(sorted_shapes[k - 1])
+            )
+        isochrone_bands = np.empty(cutoffs.shape[0], dtype=object)
+        isochrone_bands[order] = sorted_bands
+
+        result["incremental"] = GeoDataFrame(
+            {"geometry": isochrone_bands, "minute": cutoffs}
+        )
+
+    if simplify_tolerance > 0 or precision > 0:
+        pixel_size = get_pixel_size(north, height, zoom, web_mercator)
+        for key in result:
+            result[key]["geometry"] = simplify_jsolines(
+                result[key]["geometry"].values,
+                simplify_tolerance * pixel_size,
+                precision * pixel_size,
+            )
 
     crs = "EPSG:4326"
     if web_mercator:
@@ -405,7 +1151,9 @@ def jsolines(
     return result
 
 
-def generate_jsolines(grid, travel_time, percentile, steps):
+def generate_jsolines(
+    grid, travel_time, percentile, steps, simplify_tolerance=0.0, precision=0.0
+):
     """
     Generate the jsolines from the isochrones.
 
@@ -430,6 +1178,8 @@ def generate_jsolines(grid, travel_time, percentile, steps):
             step=(travel_time / steps),
         ),
         return_incremental=True,
+        simplify_tolerance=simplify_tolerance,
+        precision=precision,
     )
     return isochrones
 
@@ -457,3 +1207,22 @@ if __name__ == "__main__":
             return_incremental=True,
             web_mercator=False,
         )
+
+        # Report the vertex reduction of the configured simplification
+        pixel_size = get_pixel_size(
+            grid_decoded["north"], grid_decoded["height"], grid_decoded["zoom"]
+        )
+        geometries = isochrones["full"].geometry.values
+        start = time.perf_counter()
+        simplified = simplify_jsolines(
+            geometries,
+            settings.JSOLINE_SIMPLIFY_TOLERANCE * pixel_size,
+            settings.JSOLINE_PRECISION * pixel_size,
+        )
+        duration = time.perf_counter() - start
+        vertices = shapely.get_num_coordinates(geometries).sum()
+        simplified_vertices = shapely.get_num_coordinates(simplified).sum()
+        print(
+            f"Vertices: {vertices} -> {simplified_vertices} "
+            f"({vertices / max(simplified_vertices, 1):.1f}x) in {duration:.3f}s"
+        )
@@ -10,7 +10,9 @@ from fastapi.staticfiles import StaticFiles
 from sqlalchemy.exc import IntegrityError
 from starlette.middleware.cors import CORSMiddleware
 
+from src.core.completion import user_data_insert_listener
 from src.core.config import settings
+from src.core.r5_cache import r5_region_cache
 from src.db.session import session_manager
 from src.endpoints.deps import close_http_client, initialize_qgis_application, close_qgis_application
 from src.endpoints.v2.api import router as api_router_v2
@@ -27,6 +29,12 @@ if settings.SENTRY_DSN and settings.ENVIRONMENT:
 async def lifespan(app: FastAPI):
     print("Starting up...")
     session_manager.init(settings.ASYNC_SQLALCHEMY_DATABASE_URI)
+    try:
+        async with session_manager.session() as session:
+            await r5_region_cache.refresh(session)
+    except Exception as e:
+        # Regions are looked up in the database instead
+        print(f"Could not load R5 regions: {e}")
     logger = logging.getLogger("uvicorn.access")
     handler = logging.StreamHandler()
     handler.setFormatter(logging.Formatter("%(asctime)s - %(levelname)s - %(message)s"))
@@ -35,6 +43,7 @@ async def lifespan(app: FastAPI):
     yield
     print("Shutting down...")
     await session_manager.close()
+    await user_data_insert_listener.close()
     await close_http_client()
     close_qgis_application(qgis_application)
 
@@ -63,6 +63,22 @@ class ImpedanceFunctionType(str, Enum):
     power = "power"
 
 
+class HeatmapEngineType(str, Enum):
+    """Heatmap engine type schema."""
+
+    sql = "sql"
+    sql_partitioned = "sql_partitioned"
+    numba = "numba"
+
+
+class HeatmapIndicatorType(str, Enum):
+    """Heatmap indicator type schema."""
+
+    gravity = "gravity"
+    closest_average = "closest_average"
+    connectivity = "connectivity"
+
+
 class MaxTravelTimeTransportMode(int, Enum):
     """Max travel time transport mode schema."""
 
@@ -130,6 +146,11 @@ class HeatmapGravityBase(BaseModel):
         title="Impedance Function",
         description="The impedance function of the heatmap.",
     )
+    engine: HeatmapEngineType = Field(
+        HeatmapEngineType.sql,
+        title="Engine",
+        description="Compute the heatmap in the database or in memory with compiled kernels.",
+    )
     # TODO: Limit 10 opportunities layers
     opportunities: List[OpportunityGravityBased] = Field(
         ...,
@@ -167,6 +188,11 @@ class HeatmapGravityBase(BaseModel):
 class HeatmapClosestAverageBase(BaseModel):
     """Closest average based heatmap schema."""
 
+    engine: HeatmapEngineType = Field(
+        HeatmapEngineType.sql,
+        title="Engine",
+        description="Compute the heatmap in the database or in memory with compiled kernels.",
+    )
     opportunities: List[OpportunityClosestAverage] = Field(
         ...,
         title="Opportunities",
@@ -215,6 +241,11 @@ class HeatmapConnectivityBase(BaseModel):
         ge=1,
         le=60,
     )
+    engine: HeatmapEngineType = Field(
+        HeatmapEngineType.sql,
+        title="Engine",
+        description="Compute the heatmap in the database or in memory with compiled kernels.",
+    )
     scenario_id: UUID | None = Field(
         None,
         title="Scenario ID",
@@ -419,3 +450,97 @@ class IHeatmapConnectivityMotorized(HeatmapConnectivityBase):
             }
         }
 
+
+HEATMAP_INDICATOR_SCHEMAS = {
+    ActiveRoutingHeatmapType: {
+        HeatmapIndicatorType.gravity: IHeatmapGravityActive,
+        HeatmapIndicatorType.closest_average: IHeatmapClosestAverageActive,
+        HeatmapIndicatorType.connectivity: IHeatmapConnectivityActive,
+    },
+    MotorizedRoutingHeatmapType: {
+        HeatmapIndicatorType.gravity: IHeatmapGravityMotorized,
+        HeatmapIndicatorType.closest_average: IHeatmapClosestAverageMotorized,
+        HeatmapIndicatorType.connectivity: IHeatmapConnectivityMotorized,
+    },
+}
+
+
+class HeatmapIndicator(BaseModel):
+    """Indicator of a batch heatmap."""
+
+    type: HeatmapIndicatorType = Field(
+        ...,
+        title="Indicator Type",
+        description="The type of the heatmap of the indicator.",
+    )
+    params: dict = Field(
+        ...,
+        title="Parameters",
+        description="The parameters of the heatmap of the indicator, the routing type is shared by the batch.",
+    )
+
+
+class HeatmapBatchBase(BaseModel):
+    """Batch heatmap schema, computing several indicators in one pass over the travel time matrix."""
+
+    indicators: List[HeatmapIndicator] = Field(
+        ...,
+        title="Indicators",
+        description="The indicators to compute, each producing its own result layer.",
+        min_items=1,
+        max_items=10,
+    )
+
+    def validate_indicators(routing_type, values):
+        indicator_schemas = HEATMAP_INDICATOR_SCHEMAS[type(routing_type)]
+        for indicator in values.get("indicators") or []:
+            indicator_schemas[indicator.type](
+                **{**indicator.params, "routing_type": routing_type}
+            )
+        return routing_type
+
+    def get_indicator_params(self):
+        """Get the parameters of each indicator, always computed in memory."""
+
+        return [
+            (
+                indicator.type,
+                HEATMAP_INDICATOR_SCHEMAS[type(self.routing_type)][indicator.type](
+                    **{
+                        **indicator.params,
+                        "routing_type": self.routing_type,
+                        "engine": HeatmapEngineType.numba,
+                    }
+                ),
+            )
+            for indicator in self.indicators
+        ]
+
+
+class IHeatmapBatchActive(HeatmapBatchBase):
+    """Batch heatmap for active mobility schema."""
+
+    routing_type: ActiveRoutingHeatmapType = Field(
+        ...,
+        title="Routing Type",
+        description="The routing type of the heatmaps.",
+    )
+
+    @validator("routing_type")
+    def validate_routing_type(cls, routing_type, values):
+        return super().validate_indicators(routing_type, values)
+
+
+class IHeatmapBatchMotorized(HeatmapBatchBase):
+    """Batch heatmap for motorized mobility schema."""
+
+    routing_type: MotorizedRoutingHeatmapType = Field(
+        ...,
+        title="Routing Type",
+        description="The routing type of the heatmaps.",
+    )
+
+    @validator("routing_type")
+    def validate_routing_type(cls, routing_type, values):
+        return super().validate_indicators(routing_type, values)
+
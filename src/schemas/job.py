@@ -27,6 +27,8 @@ class JobType(str, Enum):
     )
     heatmap_connectivity_active_mobility = "heatmap_connectivity_active_mobility"
     heatmap_connectivity_motorized_mobility = "heatmap_connectivity_motorized_mobility"
+    heatmap_batch_active_mobility = "heatmap_batch_active_mobility"
+    heatmap_batch_motorized_mobility = "heatmap_batch_motorized_mobility"
     data_delete_multi = "data_delete_multi"
     update_layer_dataset = "update_layer_dataset"
 
@@ -158,6 +160,18 @@ class JobStatusHeatmapConnectivityMotorizedMobility(JobStatusHeatmapConnectivity
     pass
 
 
+class JobStatusHeatmapBatchBase(BaseModel):
+    heatmap_batch: JobStep = {}
+
+
+class JobStatusHeatmapBatchActiveMobility(JobStatusHeatmapBatchBase):
+    pass
+
+
+class JobStatusHeatmapBatchMotorizedMobility(JobStatusHeatmapBatchBase):
+    pass
+
+
 class JobStatusLayerDeleteMulti(BaseModel):
     data_delete_multi: JobStep = {}
 
@@ -182,6 +196,8 @@ job_mapping = {
     JobType.heatmap_closest_average_motorized_mobility: JobStatusHeatmapClosestAverageMotorizedMobility,
     JobType.heatmap_connectivity_active_mobility: JobStatusHeatmapConnectivityActiveMobility,
     JobType.heatmap_connectivity_motorized_mobility: JobStatusHeatmapConnectivityMotorizedMobility,
+    JobType.heatmap_batch_active_mobility: JobStatusHeatmapBatchActiveMobility,
+    JobType.heatmap_batch_motorized_mobility: JobStatusHeatmapBatchMotorizedMobility,
     JobType.data_delete_multi: JobStatusLayerDeleteMulti,
     JobType.update_layer_dataset: JobStatusFileImport,
 }
@@ -123,6 +123,7 @@ class UserDataTable(str, Enum):
     no_geometry = "no_geometry"
     street_network_line = "street_network_line"
     street_network_point = "street_network_point"
+    h3 = "h3"
 
 
 class LayerReadBaseAttributes(BaseModel):
@@ -254,6 +255,9 @@ class IFeatureLayerToolCreate(BaseModel):
     attribute_mapping: dict = Field(..., description="Attribute mapping of the layer")
     tool_type: ToolType = Field(..., description="Tool type")
     job_id: UUID = Field(..., description="Job ID")
+    data_type: FeatureDataType | None = Field(
+        None, description="Data type to store the source of the layer"
+    )
 
 
 class IFeatureStandardCreateAdditionalAttributes(BaseModel):
@@ -304,6 +308,9 @@ class IFeatureToolRead(
     """Model to read a feature layer tool."""
 
     charts: dict | None = Field(None, description="Chart configuration")
+    data_type: FeatureDataType | None = Field(
+        None, description="Data type to store the source of the layer"
+    )
 
 
 @optional
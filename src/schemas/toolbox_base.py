@@ -63,7 +63,7 @@ class MaxFeatureCnt(int, Enum):
     area_statistics = 100000
     join = 100000
     catchment_area_active_mobility = 1000
-    catchment_area_pt = 5
+    catchment_area_pt = 20
     catchment_area_car = 50
     catchment_area_nearby_station_access = 1000
     oev_gueteklasse = 10000
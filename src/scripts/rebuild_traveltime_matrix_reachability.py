@@ -0,0 +1,38 @@
+import argparse
+import asyncio
+
+from src.core.config import settings
+from src.core.traveltime_matrix import get_reachability_table, rebuild_reachability
+from src.db.session import session_manager
+from src.schemas.heatmap import TRAVELTIME_MATRIX_TABLE, MaxTravelTimeTransportMode
+from src.utils import print_info
+
+ROUTING_TYPES = [getattr(key, "value", key) for key in TRAVELTIME_MATRIX_TABLE]
+
+
+async def main(routing_types: list):
+    session_manager.init(settings.ASYNC_SQLALCHEMY_DATABASE_URI)
+    async with session_manager.session() as async_session:
+        for routing_type in routing_types:
+            matrix_table = TRAVELTIME_MATRIX_TABLE[routing_type]
+            print_info(f"Rebuilding {get_reachability_table(matrix_table)}")
+            await rebuild_reachability(
+                async_session,
+                matrix_table,
+                MaxTravelTimeTransportMode[routing_type].value,
+            )
+    await session_manager.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Precompute the cumulative number of reachable cells per origin and minute of the travel time matrices."
+    )
+    parser.add_argument(
+        "--routing-type",
+        choices=ROUTING_TYPES,
+        action="append",
+        help="Routing type of the matrix, all matrices by default.",
+    )
+    args = parser.parse_args()
+    asyncio.run(main(args.routing_type or ROUTING_TYPES))
@@ -0,0 +1,37 @@
+import argparse
+import asyncio
+
+from src.core.config import settings
+from src.core.traveltime_matrix import traveltime_matrix_shards
+from src.db.session import session_manager
+from src.schemas.heatmap import TRAVELTIME_MATRIX_TABLE
+from src.utils import print_info
+
+ROUTING_TYPES = [getattr(key, "value", key) for key in TRAVELTIME_MATRIX_TABLE]
+
+
+async def main(matrix_tables: list):
+    session_manager.init(settings.ASYNC_SQLALCHEMY_DATABASE_URI)
+    async with session_manager.session() as async_session:
+        for matrix_table in matrix_tables:
+            print_info(f"Rebuilding shards of {matrix_table}")
+            stats = await traveltime_matrix_shards.rebuild(async_session, matrix_table)
+            print_info(
+                f"Built {stats['built']}, unchanged {stats['unchanged']}, removed {stats['removed']} shards."
+            )
+    await session_manager.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Export the travel time matrices to local shards, rebuilding the shards whose source rows or files changed."
+    )
+    parser.add_argument(
+        "--routing-type",
+        choices=ROUTING_TYPES,
+        action="append",
+        help="Routing type of the matrix, all matrices by default.",
+    )
+    args = parser.parse_args()
+    routing_types = args.routing_type or ROUTING_TYPES
+    asyncio.run(main([TRAVELTIME_MATRIX_TABLE[type] for type in routing_types]))
@@ -12,12 +12,13 @@ import subprocess
 import time
 import zipfile
 from functools import wraps
-from typing import Any, List, Type
+from typing import Any, Callable, List, Type
 from uuid import UUID
 
 import aiohttp
 
 # Third party imports
+import h3
 import numpy as np
 from fastapi import UploadFile
 from geoalchemy2.shape import to_shape
@@ -63,13 +64,128 @@ async def table_exists(db: AsyncSession, schema_name: str, table_name: str) -> b
     return table_exists.scalar() > 0
 
 
+async def is_distributed_table(async_session: AsyncSession, table_name: str) -> bool:
+    """Check if a table is distributed by Citus."""
+
+    sql_check_citus = "SELECT to_regclass('pg_catalog.pg_dist_partition') IS NOT NULL"
+    if not (await async_session.execute(sql_check_citus)).scalar():
+        return False
+    sql_check_table = f"""
+        SELECT EXISTS (
+            SELECT 1 FROM pg_dist_partition
+            WHERE logicalrelid = '{table_name}'::regclass
+        )
+    """
+    return (await async_session.execute(sql_check_table)).scalar()
+
+
+async def copy_records_to_table(
+    async_session: AsyncSession, table_name: str, columns: List[str], records: list
+):
+    """Bulk load records into a table with a binary COPY.
+
+    Geometries have to be passed as EWKB.
+    """
+
+    schema_name, table_name = table_name.split(".")
+    connection = await async_session.connection()
+    asyncpg_connection = (await connection.get_raw_connection()).driver_connection
+
+    # Geometries are registered with a text codec, which binary COPY can't use
+    await asyncpg_connection.set_type_codec(
+        "geometry", encoder=bytes, decoder=bytes, schema="public", format="binary"
+    )
+    try:
+        await asyncpg_connection.copy_records_to_table(
+            table_name, schema_name=schema_name, columns=columns, records=records
+        )
+    finally:
+        await asyncpg_connection.set_type_codec(
+            "geometry", encoder=str, decoder=str, schema="public", format="text"
+        )
+
+
+PG_COPY_SIGNATURE = b"PGCOPY\n\xff\r\n\x00"
+PG_COPY_HEADER_LENGTH = 19  # signature + flags + header extension length
+PG_COPY_TRAILER = b"\xff\xff"
+
+
+async def copy_query_to_arrays(
+    async_session: AsyncSession,
+    query: str,
+    columns: dict,
+    process_batch: Callable[[dict], Any],
+    batch_size: int,
+):
+    """Stream the rows of a query with a binary COPY in batches of NumPy arrays.
+
+    The columns must be NOT NULL and of a fixed size, e.g. float8, int8, int4 or
+    boolean, and are passed with their NumPy dtype in the order of the query.
+    process_batch is run in a thread with the arrays of about batch_size rows.
+    """
+
+    # Each row holds the number of fields and the length and value of each field
+    row_dtype = np.dtype(
+        [("n_fields", ">i2")]
+        + [
+            field
+            for name, dtype in columns.items()
+            for field in (
+                (f"{name}_length", ">i4"),
+                (name, np.dtype(dtype).newbyteorder(">")),
+            )
+        ]
+    )
+    buffer = bytearray()
+    header_length = None
+
+    async def write_batch():
+        n_rows = len(buffer) // row_dtype.itemsize
+        rows = np.frombuffer(
+            bytes(buffer[: n_rows * row_dtype.itemsize]), dtype=row_dtype
+        )
+        del buffer[: n_rows * row_dtype.itemsize]
+        await asyncio.to_thread(
+            process_batch,
+            {name: rows[name].astype(dtype) for name, dtype in columns.items()},
+        )
+
+    async def write(data: bytes):
+        nonlocal header_length
+        buffer.extend(data)
+        if header_length is None and len(buffer) >= PG_COPY_HEADER_LENGTH:
+            if bytes(buffer[: len(PG_COPY_SIGNATURE)]) != PG_COPY_SIGNATURE:
+                raise ValueError("Invalid binary COPY signature")
+            header_length = PG_COPY_HEADER_LENGTH + int.from_bytes(
+                buffer[15:PG_COPY_HEADER_LENGTH], "big"
+            )
+        if header_length is not None and len(buffer) >= header_length:
+            del buffer[:header_length]
+            header_length = 0
+            if len(buffer) >= batch_size * row_dtype.itemsize:
+                await write_batch()
+
+    connection = await async_session.connection()
+    asyncpg_connection = (await connection.get_raw_connection()).driver_connection
+    await asyncpg_connection.copy_from_query(query, output=write, format="binary")
+
+    if bytes(buffer[-len(PG_COPY_TRAILER) :]) != PG_COPY_TRAILER:
+        raise ValueError("Invalid binary COPY trailer")
+    del buffer[-len(PG_COPY_TRAILER) :]
+    await write_batch()
+
+
+R5_GRID_TYPE = b"ACCESSGR"
+R5_GRID_VERSION = 0
+R5_GRID_HEADER_ENTRIES = 7
+R5_GRID_HEADER_LENGTH = 9  # type + entries
+
+
 def encode_r5_grid(grid_data: Any) -> bytes:
     """
     Encode raster grid data
     """
-    grid_type = "ACCESSGR"
-    grid_type_binary = str.encode(grid_type)
-    array = np.array(
+    header_bin = np.array(
         [
             grid_data["version"],
             grid_data["zoom"],
@@ -80,18 +196,15 @@ def encode_r5_grid(grid_data: Any) -> bytes:
             grid_data["depth"],
         ],
         dtype=np.int32,
-    )
-    header_bin = array.tobytes()
-    # - reshape the data
+    ).tobytes()
+
+    # - delta-code each percentile of the grid
     grid_size = grid_data["width"] * grid_data["height"]
     if len(grid_data["data"]) == 0:
         data = np.array([], dtype=np.int32)
     else:
-        data = grid_data["data"].reshape(grid_data["depth"], grid_size)
-        reshaped_data = np.array([])
-        for i in range(grid_data["depth"]):
-            reshaped_data = np.append(reshaped_data, np.diff(data[i], prepend=0))
-        data = reshaped_data.astype(np.int32)
+        data = np.reshape(grid_data["data"], (grid_data["depth"], grid_size))
+        data = np.diff(data, axis=1, prepend=0).astype(np.int32)
     z_diff_bin = data.tobytes()
 
     # - encode metadata
@@ -105,64 +218,48 @@ def encode_r5_grid(grid_data: Any) -> bytes:
     }
     metadata_bin = json.dumps(metadata).encode("utf-8")
 
-    binary_output = b"".join([grid_type_binary, header_bin, z_diff_bin, metadata_bin])
-    return binary_output
+    return b"".join([R5_GRID_TYPE, header_bin, z_diff_bin, metadata_bin])
 
 
 def decode_r5_grid(grid_data_buffer: bytes) -> dict:
     """
     Decode R5 grid data
     """
-    CURRENT_VERSION = 0
-    HEADER_ENTRIES = 7
-    HEADER_LENGTH = 9  # type + entries
-    TIMES_GRID_TYPE = "ACCESSGR"
-
     # -- PARSE HEADER
-    ## - get header type
-    header = {}
-    header_data = np.frombuffer(grid_data_buffer, count=8, dtype=np.byte)
-    header_type = "".join(map(chr, header_data))
-    if header_type != TIMES_GRID_TYPE:
+    if grid_data_buffer[: len(R5_GRID_TYPE)] != R5_GRID_TYPE:
         raise ValueError("Invalid grid type")
-    ## - get header data
-    header_raw = np.frombuffer(
-        grid_data_buffer, count=HEADER_ENTRIES, offset=8, dtype=np.int32
+    version, zoom, west, north, width, height, depth = np.frombuffer(
+        grid_data_buffer,
+        count=R5_GRID_HEADER_ENTRIES,
+        offset=len(R5_GRID_TYPE),
+        dtype=np.int32,
     )
-    version = header_raw[0]
-    if version != CURRENT_VERSION:
+    if version != R5_GRID_VERSION:
         raise ValueError("Invalid grid version")
-    header["zoom"] = header_raw[1]
-    header["west"] = header_raw[2]
-    header["north"] = header_raw[3]
-    header["width"] = header_raw[4]
-    header["height"] = header_raw[5]
-    header["depth"] = header_raw[6]
-    header["version"] = version
+    header = {
+        "zoom": zoom,
+        "west": west,
+        "north": north,
+        "width": width,
+        "height": height,
+        "depth": depth,
+        "version": version,
+    }
 
     # -- PARSE DATA --
-    gridSize = header["width"] * header["height"]
-    # - skip the header
+    # - view the delta-coded values of each percentile as one row and restore them
+    grid_size = int(width) * int(height)
+    data_offset = R5_GRID_HEADER_LENGTH * 4
     data = np.frombuffer(
         grid_data_buffer,
-        offset=HEADER_LENGTH * 4,
-        count=gridSize * header["depth"],
+        offset=data_offset,
+        count=grid_size * int(depth),
         dtype=np.int32,
-    )
-    # - reshape the data
-    data = data.reshape(header["depth"], gridSize)
-    reshaped_data = np.array([], dtype=np.int32)
-    for i in range(header["depth"]):
-        reshaped_data = np.append(reshaped_data, data[i].cumsum())
-    data = reshaped_data
+    ).reshape(int(depth), grid_size)
+    data = np.cumsum(data, axis=1).ravel()
+
     # - decode metadata
-    raw_metadata = np.frombuffer(
-        grid_data_buffer,
-        offset=(HEADER_LENGTH + header["width"] * header["height"] * header["depth"])
-        * 4,
-        dtype=np.int8,
-    )
-    metadata = json.loads(raw_metadata.tostring())
+    metadata = json.loads(grid_data_buffer[data_offset + grid_size * int(depth) * 4 :])
 
     return header | metadata | {"data": data, "errors": [], "warnings": []}
 
@@ -217,6 +314,27 @@ def pixel_to_latitude(pixel_y, zoom):
     return lat_rad * 180 / math.pi
 
 
+@njit(cache=True)
+def longitude_to_pixel(longitude, zoom):
+    """
+    Convert longitude to pixel x coordinate
+    """
+    return (longitude + 180) / 360 * z_scale(zoom)
+
+
+@njit(cache=True)
+def latitude_to_pixel(latitude, zoom):
+    """
+    Convert latitude to pixel y coordinate
+    """
+    lat_rad = latitude * math.pi / 180
+    return (
+        (1 - math.log(math.tan(lat_rad) + 1 / math.cos(lat_rad)) / math.pi)
+        / 2
+        * z_scale(zoom)
+    )
+
+
 @njit(cache=True)
 def pixel_x_to_web_mercator_x(x, zoom):
     return x * (40075016.68557849 / (z_scale(zoom))) - (40075016.68557849 / 2.0)
@@ -245,6 +363,110 @@ def coordinate_from_pixel(input, zoom, round_int=False, web_mercator=False):
     return [x, y]
 
 
+@njit(cache=True)
+def get_pixel_centers(surface, width, west, north, zoom, max_value):
+    """
+    Get the longitude, latitude and value of the center of all pixels of a surface
+    with a value up to max_value.
+    """
+    n_pixels = 0
+    for i in range(surface.shape[0]):
+        if surface[i] <= max_value:
+            n_pixels += 1
+
+    lons = np.empty(n_pixels, dtype=np.float64)
+    lats = np.empty(n_pixels, dtype=np.float64)
+    values = np.empty(n_pixels, dtype=surface.dtype)
+    j = 0
+    for i in range(surface.shape[0]):
+        if surface[i] <= max_value:
+            lons[j] = pixel_to_longitude(west + i % width + 0.5, zoom)
+            lats[j] = pixel_to_latitude(north + i // width + 0.5, zoom)
+            values[j] = surface[i]
+            j += 1
+    return lons, lats, values
+
+
+def surface_to_h3_cells(
+    surface: np.ndarray,
+    width: int,
+    west: int,
+    north: int,
+    zoom: int,
+    max_value: int,
+    h3_resolution: int,
+) -> dict:
+    """
+    Aggregate a surface to the H3 cells containing the pixel centers, keeping the
+    minimum value of each cell. Pixels with a value above max_value are skipped.
+    """
+    lons, lats, values = get_pixel_centers(
+        surface, int(width), int(west), int(north), int(zoom), max_value
+    )
+    h3_index = [
+        h3.geo_to_h3(lat, lon, h3_resolution)
+        for lat, lon in zip(lats, lons, strict=True)
+    ]
+    return min_value_per_h3_cell(h3_index, values)
+
+
+def min_value_per_h3_cell(h3_index: List[str], values: List[int]) -> dict:
+    """
+    Keep the minimum value of every H3 cell.
+    """
+    values = np.asarray(values)
+    # Sort by value, so the first occurrence of each cell holds the minimum
+    order = np.argsort(values, kind="stable")
+    unique_h3_index, first = np.unique(
+        np.asarray(h3_index, dtype=str)[order], return_index=True
+    )
+    return {
+        "h3_index": unique_h3_index.tolist(),
+        "value": values[order][first].tolist(),
+    }
+
+
+def split_points_by_h3_cell(
+    lats: List[float], lons: List[float], max_chunk_size: int, h3_resolution: int
+) -> List[np.ndarray]:
+    """
+    Split points into chunks of at most max_chunk_size points. Points in the same H3
+    cell are kept together and cells are ordered by their index, which keeps cells
+    of the same parent next to each other, so chunks are spatially coherent.
+
+    :return: The indices of the points of each chunk.
+    """
+    h3_index = np.array(
+        [
+            h3.geo_to_h3(lat, lon, h3_resolution)
+            for lat, lon in zip(lats, lons, strict=True)
+        ],
+        dtype=str,
+    )
+    order = np.argsort(h3_index, kind="stable")
+    sorted_h3_index = h3_index[order]
+    cells = np.split(
+        order, np.flatnonzero(sorted_h3_index[1:] != sorted_h3_index[:-1]) + 1
+    )
+
+    chunks = []
+    chunk = []
+    chunk_size = 0
+    for cell in cells:
+        # Cells with more points than fit into a chunk are split
+        for i in range(0, len(cell), max_chunk_size):
+            points = cell[i : i + max_chunk_size]
+            if chunk_size + len(points) > max_chunk_size:
+                chunks.append(np.concatenate(chunk))
+                chunk = []
+                chunk_size = 0
+            chunk.append(points)
+            chunk_size += len(points)
+    if chunk:
+        chunks.append(np.concatenate(chunk))
+    return chunks
+
+
 def delete_file(file_path: str) -> None:
     """Delete file from disk."""
 
@@ -605,3 +827,19 @@ def format_value_null_sql(value) -> str:
         return "NULL"
     else:
         return f"'{value}'"
+
+
+def get_h3_result_column() -> str:
+    """Get the column storing the cells of results on a H3 grid, the H3 index in the
+    H3 user table or the cell boundary in the polygon user table."""
+
+    return "h3_index" if settings.H3_RESULT_TABLE else "geom"
+
+
+def get_h3_result_value(h3_index: str) -> str:
+    """Get the SQL value of the column returned by get_h3_result_column for a H3
+    index expression."""
+
+    if settings.H3_RESULT_TABLE:
+        return h3_index
+    return f"ST_SetSRID(h3_cell_to_boundary({h3_index})::geometry, 4326)"
@@ -1,7 +1,12 @@
+from uuid import uuid4
+
+import numpy as np
 import pytest
 from httpx import AsyncClient
 
 from src.core.config import settings
+from src.crud.crud_catchment_area import CRUDCatchmentAreaPT
+from src.jsoline import jsolines
 from src.schemas.catchment_area import (
     CatchmentAreaRoutingAccessModePT,
     CatchmentAreaRoutingEgressModePT,
@@ -444,3 +449,66 @@ async def test_catchment_area_car(
     # Check if job is finished
     job = await check_job_status(client, response.json()["job_id"])
     assert job["status_simple"] == "finished"
+
+
+@pytest.mark.parametrize("polygon_difference", [False, True])
+async def test_catchment_area_pt_copy_matches_insert(
+    db_session, fixture_create_user, polygon_difference
+):
+    # Synthetic radial travel time surface around Munich
+    width, height = 80, 60
+    yy, xx = np.mgrid[0:height, 0:width]
+    surface = np.hypot(xx - width / 2, yy - height / 2).astype(np.uint16).ravel()
+    shapes = jsolines(
+        surface,
+        width,
+        height,
+        69700,
+        45300,
+        9,
+        np.arange(5.0, 31, 5.0),
+        return_incremental=True,
+    )
+
+    crud_catchment_area = CRUDCatchmentAreaPT(
+        job_id=uuid4(),
+        background_tasks=None,
+        async_session=db_session,
+        user_id=fixture_create_user,
+        project_id=None,
+        http_client=None,
+    )
+    result_table = f"{settings.USER_DATA_SCHEMA}.polygon_{str(fixture_create_user).replace('-', '')}"
+    layer_id_insert, layer_id_copy = str(uuid4()), str(uuid4())
+    for layer_id, is_distributed in [(layer_id_insert, True), (layer_id_copy, False)]:
+        await crud_catchment_area.write_catchment_area_result(
+            catchment_area_type="polygon",
+            layer_id=layer_id,
+            result_table=result_table,
+            shapes=shapes,
+            grid=None,
+            polygon_difference=polygon_difference,
+            is_distributed=is_distributed,
+        )
+
+    # Both writers produce the same rows in the same order
+    sql = f"""
+        SELECT a.integer_attr1, b.integer_attr1, ST_Equals(a.geom, b.geom),
+            ST_SRID(b.geom), b.h3_3 IS NOT NULL
+        FROM (
+            SELECT *, ROW_NUMBER() OVER (ORDER BY id) AS row_number
+            FROM {result_table} WHERE layer_id = '{layer_id_insert}'
+        ) a
+        FULL JOIN (
+            SELECT *, ROW_NUMBER() OVER (ORDER BY id) AS row_number
+            FROM {result_table} WHERE layer_id = '{layer_id_copy}'
+        ) b ON a.row_number = b.row_number;
+    """
+    rows = (await db_session.execute(sql)).fetchall()
+    assert len(rows) == len(shapes["full"])
+    for insert_minute, copy_minute, equals, srid, has_h3 in rows:
+        assert insert_minute == copy_minute
+        assert equals
+        assert srid == 4326
+        assert has_h3
+    await db_session.rollback()
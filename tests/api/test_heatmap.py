@@ -1,15 +1,31 @@
 from typing import List
+from uuid import UUID, uuid4
 
 import pytest
 from httpx import AsyncClient
 
 from src.core.config import settings
+from src.core.heatmap_cache import heatmap_result_cache
+from src.core.traveltime_matrix import get_reachability_table, rebuild_reachability
+from src.crud.crud_heatmap_closest_average import CRUDHeatmapClosestAverage
+from src.crud.crud_heatmap_connectivity import CRUDHeatmapConnectivity
+from src.crud.crud_heatmap_gravity import CRUDHeatmapGravity
+from src.crud.crud_job import job as crud_job
 from src.schemas.heatmap import (
+    TRAVELTIME_MATRIX_TABLE,
     ActiveRoutingHeatmapType,
+    HeatmapEngineType,
+    IHeatmapClosestAverageActive,
+    IHeatmapConnectivityActive,
+    IHeatmapGravityActive,
     ImpedanceFunctionType,
     MotorizedRoutingHeatmapType,
 )
-from tests.utils import check_job_status
+from tests.utils import check_job_status, create_synthetic_traveltime_matrix
+
+
+async def skip_update_status(*args, **kwargs):
+    """The heatmaps computed without a job have no status to update."""
 
 
 # TODO: Upload larger heatmap-specific input/opportunity layers to test functionality in a more robust way
@@ -151,6 +167,346 @@ async def test_heatmap_gravity(
     assert job["status_simple"] == "finished"
 
 
+@pytest.mark.asyncio
+async def test_heatmap_gravity_cache(
+    client: AsyncClient,
+    fixture_add_aggregate_point_layer_to_project,
+):
+    project_id = fixture_add_aggregate_point_layer_to_project["project_id"]
+    params = {
+        "routing_type": ActiveRoutingHeatmapType.walking.value,
+        "impedance_function": ImpedanceFunctionType.gaussian.value,
+        "opportunities": [
+            {
+                "opportunity_layer_project_id": fixture_add_aggregate_point_layer_to_project[
+                    "source_layer_project_id"
+                ],
+                "max_traveltime": 15,
+                "sensitivity": 150000,
+            }
+        ],
+    }
+
+    # The second run with the same params and input data is copied from the cache
+    hits = heatmap_result_cache.hits
+    for engine in ("sql", "numba"):
+        response = await client.post(
+            f"{settings.API_V2_STR}/active-mobility/heatmap-gravity?project_id={project_id}",
+            json=params | {"engine": engine},
+        )
+        assert response.status_code == 201
+        job = await check_job_status(client, response.json()["job_id"])
+        assert job["status_simple"] == "finished"
+    assert heatmap_result_cache.hits == hits + 1
+
+
+async def compute_heatmap_gravity_delta_and_full(
+    db_session, user_id, project_id, layer_project_id, scenario_id
+):
+    """Compute the scenario heatmap corrected from the cached heatmap without
+    scenario and recomputed in full, and join their cells."""
+
+    crud_heatmap = CRUDHeatmapGravity(
+        job_id=uuid4(),
+        background_tasks=None,
+        async_session=db_session,
+        user_id=user_id,
+        project_id=UUID(project_id),
+    )
+    params = IHeatmapGravityActive(
+        routing_type=ActiveRoutingHeatmapType.walking,
+        impedance_function=ImpedanceFunctionType.gaussian,
+        opportunities=[
+            {
+                "opportunity_layer_project_id": layer_project_id,
+                "max_traveltime": 15,
+                "sensitivity": 150000,
+            }
+        ],
+        scenario_id=scenario_id,
+    )
+    result_table = await crud_heatmap.get_h3_result_table()
+
+    # Cache the heatmap without scenario, the scenario heatmap corrects it
+    layer_ids = {"baseline": str(uuid4()), "delta": str(uuid4()), "full": str(uuid4())}
+    await crud_heatmap.compute_heatmap_cached(
+        params=params.copy(update={"scenario_id": None}),
+        result_table=result_table,
+        result_layer_id=layer_ids["baseline"],
+    )
+    assert await crud_heatmap.compute_heatmap_delta(
+        params=params,
+        result_table=result_table,
+        result_layer_id=layer_ids["delta"],
+    )
+    await crud_heatmap.compute_heatmap(
+        params=params,
+        opportunity_table=await crud_heatmap.create_opportunity_table(params),
+        result_table=result_table,
+        result_layer_id=layer_ids["full"],
+    )
+
+    sql_cnt_baseline = f"""
+        SELECT COUNT(*) FROM {result_table} WHERE layer_id = '{layer_ids["baseline"]}';
+    """
+    cnt_baseline = (await db_session.execute(sql_cnt_baseline)).scalar()
+    sql = f"""
+        SELECT a.text_attr1, b.text_attr1, a.float_attr1, b.float_attr1,
+            a.integer_attr1, b.integer_attr1
+        FROM (
+            SELECT * FROM {result_table} WHERE layer_id = '{layer_ids["full"]}'
+        ) a
+        FULL JOIN (
+            SELECT * FROM {result_table} WHERE layer_id = '{layer_ids["delta"]}'
+        ) b ON a.text_attr1 = b.text_attr1;
+    """
+    return cnt_baseline, (await db_session.execute(sql)).fetchall()
+
+
+@pytest.mark.asyncio
+async def test_heatmap_gravity_delta_matches_full(
+    db_session,
+    fixture_create_user,
+    fixture_create_project_scenario_features,
+):
+    _cnt_baseline, rows = await compute_heatmap_gravity_delta_and_full(
+        db_session,
+        user_id=fixture_create_user,
+        project_id=fixture_create_project_scenario_features["project_id"],
+        layer_project_id=fixture_create_project_scenario_features["layer_project_id"],
+        scenario_id=fixture_create_project_scenario_features["scenario_id"],
+    )
+
+    # Both produce the same cells, accessibility and opportunity count
+    assert rows
+    for full_h3_index, delta_h3_index, full_value, delta_value, *counts in rows:
+        assert full_h3_index == delta_h3_index
+        assert delta_value == pytest.approx(full_value, rel=1e-9, abs=1e-12)
+        assert counts[0] == counts[1]
+
+
+@pytest.mark.asyncio
+async def test_heatmap_gravity_delta_drops_unreached_cells(
+    client: AsyncClient,
+    db_session,
+    fixture_create_user,
+    fixture_create_project_scenario,
+    fixture_add_aggregate_point_layer_to_project,
+):
+    project_id = fixture_create_project_scenario["project_id"]
+    scenario_id = fixture_create_project_scenario["scenario_id"]
+    layer_project_id = fixture_add_aggregate_point_layer_to_project[
+        "source_layer_project_id"
+    ]
+
+    # Delete all opportunities but one, so that no opportunity reaches most cells
+    sql_features = f"""
+        SELECT feature.id, ST_AsText(feature.geom)
+        FROM {settings.USER_DATA_SCHEMA}.point_{str(fixture_create_user).replace('-', '')} feature
+        JOIN {settings.CUSTOMER_SCHEMA}.layer_project layer_project
+            ON layer_project.layer_id = feature.layer_id
+        WHERE layer_project.id = {layer_project_id}
+        ORDER BY feature.id
+        OFFSET 1;
+    """
+    features = (await db_session.execute(sql_features)).fetchall()
+    response = await client.post(
+        f"{settings.API_V2_STR}/project/{project_id}/layer/{layer_project_id}/scenario/{scenario_id}/features",
+        json=[
+            {
+                "layer_project_id": layer_project_id,
+                "feature_id": str(feature_id),
+                "edit_type": "d",
+                "geom": geom,
+            }
+            for feature_id, geom in features
+        ],
+    )
+    assert response.status_code == 201
+
+    cnt_baseline, rows = await compute_heatmap_gravity_delta_and_full(
+        db_session,
+        user_id=fixture_create_user,
+        project_id=project_id,
+        layer_project_id=layer_project_id,
+        scenario_id=scenario_id,
+    )
+
+    # Cells reached by the deleted opportunities only are dropped, not kept at zero
+    assert len(rows) < cnt_baseline
+    for full_h3_index, delta_h3_index, full_value, delta_value, *counts in rows:
+        assert full_h3_index == delta_h3_index
+        assert delta_value == pytest.approx(full_value, rel=1e-9, abs=1e-12)
+        assert counts[0] == counts[1] == 1
+
+
+@pytest.mark.asyncio
+async def test_heatmap_gravity_h3_view(
+    db_session,
+    fixture_create_user,
+    fixture_add_aggregate_point_layer_to_project,
+    monkeypatch,
+):
+    monkeypatch.setattr(settings, "H3_RESULT_TABLE", True)
+    crud_heatmap = CRUDHeatmapGravity(
+        job_id=uuid4(),
+        background_tasks=None,
+        async_session=db_session,
+        user_id=fixture_create_user,
+        project_id=UUID(fixture_add_aggregate_point_layer_to_project["project_id"]),
+    )
+    params = IHeatmapGravityActive(
+        routing_type=ActiveRoutingHeatmapType.walking,
+        impedance_function=ImpedanceFunctionType.gaussian,
+        opportunities=[
+            {
+                "opportunity_layer_project_id": fixture_add_aggregate_point_layer_to_project[
+                    "source_layer_project_id"
+                ],
+                "max_traveltime": 15,
+                "sensitivity": 150000,
+            }
+        ],
+    )
+    result_table = await crud_heatmap.get_h3_result_table()
+    result_layer_id = str(uuid4())
+    await crud_heatmap.compute_heatmap(
+        params=params,
+        opportunity_table=await crud_heatmap.create_opportunity_table(params),
+        result_table=result_table,
+        result_layer_id=result_layer_id,
+    )
+
+    # The view generates the boundaries of the stored cells
+    view = f"{settings.USER_DATA_SCHEMA}.h3_polygon_{str(fixture_create_user).replace('-', '')}"
+    sql = f"""
+        SELECT COUNT(*),
+            COUNT(*) FILTER (
+                WHERE ST_Equals(geom, ST_SetSRID(h3_cell_to_boundary(text_attr1::h3index)::geometry, 4326))
+            ),
+            COUNT(*) FILTER (WHERE cluster_keep)
+        FROM {view}
+        WHERE layer_id = '{result_layer_id}';
+    """
+    cnt, cnt_boundaries, cnt_cluster_keep = (await db_session.execute(sql)).fetchone()
+    assert cnt > 0
+    assert cnt_boundaries == cnt
+    assert 0 < cnt_cluster_keep <= cnt
+
+    # Data of the layer is deleted through the view
+    await db_session.execute(
+        f"DELETE FROM {view} WHERE layer_id = '{result_layer_id}';"
+    )
+    sql_cnt = (
+        f"SELECT COUNT(*) FROM {result_table} WHERE layer_id = '{result_layer_id}';"
+    )
+    assert (await db_session.execute(sql_cnt)).scalar() == 0
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("impedance_function", list(ImpedanceFunctionType))
+async def test_heatmap_gravity_numba_matches_sql(
+    db_session,
+    fixture_create_user,
+    monkeypatch,
+    impedance_function: ImpedanceFunctionType,
+):
+    job_id = uuid4()
+    table_suffix = job_id.hex
+    matrix_table = f"temporal.traveltime_matrix_{table_suffix}"
+    opportunity_table = f"temporal.points_{table_suffix}"
+    monkeypatch.setitem(
+        TRAVELTIME_MATRIX_TABLE, ActiveRoutingHeatmapType.walking, matrix_table
+    )
+    monkeypatch.setattr(crud_job, "update_status", skip_update_status)
+
+    # Opportunities on every third cell, some with two cells, from two layers
+    cells = await create_synthetic_traveltime_matrix(db_session, matrix_table)
+    opportunities = [
+        (str(uuid4()), cells[i : i + 1 + i % 2], 5 + i % 4, 100000 * (1 + i % 3))
+        for i in range(0, len(cells), 3)
+    ]
+    values = [
+        f"('{id}'::uuid, '{h3_index}'::h3index, {max_traveltime}, {sensitivity}, {1 + i % 5})"
+        for i, (id, h3_indexes, max_traveltime, sensitivity) in enumerate(opportunities)
+        for h3_index in h3_indexes
+    ]
+    await db_session.execute(
+        f"""
+        CREATE TABLE {opportunity_table} AS
+        SELECT id, h3_index, max_traveltime::smallint, sensitivity::float,
+            potential::float, basic.to_short_h3_3(h3_cell_to_parent(h3_index, 3)::bigint) AS h3_3
+        FROM (VALUES {", ".join(values)})
+            opportunity(id, h3_index, max_traveltime, sensitivity, potential);
+        """
+    )
+
+    crud_heatmap = CRUDHeatmapGravity(
+        job_id=job_id,
+        background_tasks=None,
+        async_session=db_session,
+        user_id=fixture_create_user,
+        project_id=None,
+    )
+    result_table = await crud_heatmap.get_h3_result_table()
+    layer_ids = {}
+    for engine in HeatmapEngineType:
+        params = IHeatmapGravityActive(
+            routing_type=ActiveRoutingHeatmapType.walking,
+            impedance_function=impedance_function,
+            opportunities=[
+                {
+                    "opportunity_layer_project_id": 1,
+                    "max_traveltime": 8,
+                    "sensitivity": 300000,
+                }
+            ],
+            engine=engine,
+        )
+        layer_ids[engine] = str(uuid4())
+        kwargs = {
+            "params": params,
+            "opportunity_table": opportunity_table,
+            "max_traveltime": 8,
+            "max_sensitivity": settings.HEATMAP_GRAVITY_MAX_SENSITIVITY,
+            "result_table": result_table,
+            "result_layer_id": layer_ids[engine],
+        }
+        if engine == HeatmapEngineType.numba:
+            await crud_heatmap.compute_heatmap_numba(**kwargs)
+        elif engine == HeatmapEngineType.sql_partitioned:
+            await crud_heatmap.compute_heatmap_partitioned(
+                **kwargs, sensitivities=[100000.0, 200000.0, 300000.0]
+            )
+        else:
+            await db_session.execute(
+                crud_heatmap.build_query(
+                    **kwargs, sensitivities=[100000.0, 200000.0, 300000.0]
+                )
+            )
+
+    # All engines produce the same cells and accessibility
+    for engine in (HeatmapEngineType.numba, HeatmapEngineType.sql_partitioned):
+        sql = f"""
+            SELECT a.text_attr1, b.text_attr1, a.float_attr1, b.float_attr1,
+                ST_Equals(a.geom, b.geom)
+            FROM (
+                SELECT * FROM {result_table} WHERE layer_id = '{layer_ids[HeatmapEngineType.sql]}'
+            ) a
+            FULL JOIN (
+                SELECT * FROM {result_table} WHERE layer_id = '{layer_ids[engine]}'
+            ) b ON a.text_attr1 = b.text_attr1;
+        """
+        rows = (await db_session.execute(sql)).fetchall()
+        assert rows
+        for sql_h3_index, engine_h3_index, sql_value, engine_value, equals in rows:
+            assert sql_h3_index == engine_h3_index
+            assert engine_value == pytest.approx(sql_value, rel=1e-9)
+            assert equals
+    await db_session.execute(f"DROP TABLE {matrix_table}, {opportunity_table};")
+    await db_session.rollback()
+
+
 @pytest.mark.asyncio
 @pytest.mark.parametrize(
     "routing_type,use_scenario,opportunities,use_opportunity_geofence",
@@ -284,6 +640,104 @@ async def test_heatmap_closest_average(
     assert job["status_simple"] == "finished"
 
 
+@pytest.mark.asyncio
+@pytest.mark.parametrize("number_of_destinations", [1, 3, 10])
+async def test_heatmap_closest_average_numba_matches_sql(
+    db_session,
+    fixture_create_user,
+    monkeypatch,
+    number_of_destinations: int,
+):
+    job_id = uuid4()
+    table_suffix = job_id.hex
+    matrix_table = f"temporal.traveltime_matrix_{table_suffix}"
+    opportunity_table = f"temporal.points_{table_suffix}"
+    monkeypatch.setitem(
+        TRAVELTIME_MATRIX_TABLE, ActiveRoutingHeatmapType.walking, matrix_table
+    )
+    monkeypatch.setattr(crud_job, "update_status", skip_update_status)
+
+    # Opportunities on every third cell, some with two cells, from two layers
+    cells = await create_synthetic_traveltime_matrix(db_session, matrix_table)
+    opportunities = [
+        (
+            str(uuid4()),
+            cells[i : i + 1 + i % 2],
+            5 + i % 4,
+            number_of_destinations + i % 2,
+        )
+        for i in range(0, len(cells), 3)
+    ]
+    values = [
+        f"('{id}'::uuid, '{h3_index}'::h3index, {max_traveltime}, {num_destinations})"
+        for id, h3_indexes, max_traveltime, num_destinations in opportunities
+        for h3_index in h3_indexes
+    ]
+    await db_session.execute(
+        f"""
+        CREATE TABLE {opportunity_table} AS
+        SELECT id, h3_index, max_traveltime::smallint, num_destinations,
+            basic.to_short_h3_3(h3_cell_to_parent(h3_index, 3)::bigint) AS h3_3
+        FROM (VALUES {", ".join(values)})
+            opportunity(id, h3_index, max_traveltime, num_destinations);
+        """
+    )
+
+    crud_heatmap = CRUDHeatmapClosestAverage(
+        job_id=job_id,
+        background_tasks=None,
+        async_session=db_session,
+        user_id=fixture_create_user,
+        project_id=None,
+    )
+    result_table = await crud_heatmap.get_h3_result_table()
+    layer_ids = {}
+    for engine in HeatmapEngineType:
+        params = IHeatmapClosestAverageActive(
+            routing_type=ActiveRoutingHeatmapType.walking,
+            opportunities=[
+                {
+                    "opportunity_layer_project_id": 1,
+                    "max_traveltime": 8,
+                    "number_of_destinations": number_of_destinations,
+                }
+            ],
+            engine=engine,
+        )
+        layer_ids[engine] = str(uuid4())
+        kwargs = {
+            "params": params,
+            "opportunity_table": opportunity_table,
+            "result_table": result_table,
+            "result_layer_id": layer_ids[engine],
+        }
+        if engine == HeatmapEngineType.numba:
+            await crud_heatmap.compute_heatmap_numba(**kwargs)
+        elif engine == HeatmapEngineType.sql_partitioned:
+            await crud_heatmap.compute_heatmap_partitioned(**kwargs)
+        else:
+            await db_session.execute(crud_heatmap.build_query(**kwargs))
+
+    # All engines produce the same cells and accessibility
+    for engine in (HeatmapEngineType.numba, HeatmapEngineType.sql_partitioned):
+        sql = f"""
+            SELECT a.text_attr1, b.text_attr1, a.float_attr1, b.float_attr1
+            FROM (
+                SELECT * FROM {result_table} WHERE layer_id = '{layer_ids[HeatmapEngineType.sql]}'
+            ) a
+            FULL JOIN (
+                SELECT * FROM {result_table} WHERE layer_id = '{layer_ids[engine]}'
+            ) b ON a.text_attr1 = b.text_attr1;
+        """
+        rows = (await db_session.execute(sql)).fetchall()
+        assert rows
+        for sql_h3_index, engine_h3_index, sql_value, engine_value in rows:
+            assert sql_h3_index == engine_h3_index
+            assert engine_value == pytest.approx(sql_value, rel=1e-9)
+    await db_session.execute(f"DROP TABLE {matrix_table}, {opportunity_table};")
+    await db_session.rollback()
+
+
 @pytest.mark.asyncio
 @pytest.mark.parametrize(
     "routing_type,max_traveltime",
@@ -328,3 +782,172 @@ async def test_heatmap_connectivity(
     # Check if job is finished
     job = await check_job_status(client, response.json()["job_id"])
     assert job["status_simple"] == "finished"
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("max_traveltime", [1, 4, 9])
+async def test_heatmap_connectivity_reachability_matches_matrix(
+    db_session,
+    fixture_create_user,
+    monkeypatch,
+    max_traveltime: int,
+):
+    job_id = uuid4()
+    table_suffix = job_id.hex
+    matrix_table = f"temporal.traveltime_matrix_{table_suffix}"
+    reference_area_table = f"temporal.points_{table_suffix}"
+    monkeypatch.setitem(
+        TRAVELTIME_MATRIX_TABLE, ActiveRoutingHeatmapType.walking, matrix_table
+    )
+    monkeypatch.setattr(crud_job, "update_status", skip_update_status)
+
+    # Reference area of every second cell, some of them covered twice
+    cells = await create_synthetic_traveltime_matrix(db_session, matrix_table)
+    await rebuild_reachability(db_session, matrix_table, 30)
+    values = [
+        f"('{uuid4()}'::uuid, '{h3_index}'::h3index)"
+        for i, h3_index in enumerate(cells[::2])
+        for _ in range(1 + (i % 5 == 0))
+    ]
+    await db_session.execute(
+        f"""
+        CREATE TABLE {reference_area_table} AS
+        SELECT id, h3_index, basic.to_short_h3_3(h3_cell_to_parent(h3_index, 3)::bigint) AS h3_3
+        FROM (VALUES {", ".join(values)}) reference_area(id, h3_index);
+        """
+    )
+
+    crud_heatmap = CRUDHeatmapConnectivity(
+        job_id=job_id,
+        background_tasks=None,
+        async_session=db_session,
+        user_id=fixture_create_user,
+        project_id=None,
+    )
+    params = IHeatmapConnectivityActive(
+        routing_type=ActiveRoutingHeatmapType.walking,
+        reference_area_layer_project_id=1,
+        max_traveltime=max_traveltime,
+    )
+    result_table = await crud_heatmap.get_h3_result_table()
+    layer_ids = {}
+    for use_reachability in (False, True):
+        layer_ids[use_reachability] = str(uuid4())
+        await db_session.execute(
+            crud_heatmap.build_query(
+                params=params,
+                reference_area_table=reference_area_table,
+                result_table=result_table,
+                result_layer_id=layer_ids[use_reachability],
+                use_reachability=use_reachability,
+            )
+        )
+    layer_ids[HeatmapEngineType.sql_partitioned] = str(uuid4())
+    await crud_heatmap.compute_heatmap_partitioned(
+        params=params,
+        reference_area_table=reference_area_table,
+        result_table=result_table,
+        result_layer_id=layer_ids[HeatmapEngineType.sql_partitioned],
+        use_reachability=True,
+    )
+
+    # The cumulative counts and the partitions produce the same cells and accessibility
+    for key in (True, HeatmapEngineType.sql_partitioned):
+        sql = f"""
+            SELECT a.text_attr1, b.text_attr1, a.float_attr1, b.float_attr1
+            FROM (
+                SELECT * FROM {result_table} WHERE layer_id = '{layer_ids[False]}'
+            ) a
+            FULL JOIN (
+                SELECT * FROM {result_table} WHERE layer_id = '{layer_ids[key]}'
+            ) b ON a.text_attr1 = b.text_attr1;
+        """
+        rows = (await db_session.execute(sql)).fetchall()
+        assert rows
+        for matrix_h3_index, h3_index, matrix_value, value in rows:
+            assert matrix_h3_index == h3_index
+            assert value == pytest.approx(matrix_value, rel=1e-9)
+    await db_session.execute(
+        f"DROP TABLE {matrix_table}, {get_reachability_table(matrix_table)}, {reference_area_table};"
+    )
+    await db_session.rollback()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "routing_type,max_traveltime",
+    [
+        (ActiveRoutingHeatmapType.walking, 15),
+        (MotorizedRoutingHeatmapType.car, 30),
+    ],
+)
+async def test_heatmap_batch(
+    client: AsyncClient,
+    fixture_add_aggregate_point_layer_to_project,
+    fixture_add_aggregate_polygon_layer_to_project,
+    routing_type: ActiveRoutingHeatmapType | MotorizedRoutingHeatmapType,
+    max_traveltime: int,
+):
+    # Both layers are added to the same project
+    project_id = fixture_add_aggregate_point_layer_to_project["project_id"]
+    point_layer_project_id = fixture_add_aggregate_point_layer_to_project[
+        "source_layer_project_id"
+    ]
+    polygon_layer_project_id = fixture_add_aggregate_polygon_layer_to_project[
+        "source_layer_project_id"
+    ]
+
+    # Produce heatmap request payload with one indicator of each type
+    params = {
+        "routing_type": routing_type.value,
+        "indicators": [
+            {
+                "type": "gravity",
+                "params": {
+                    "impedance_function": ImpedanceFunctionType.gaussian.value,
+                    "opportunities": [
+                        {
+                            "opportunity_layer_project_id": point_layer_project_id,
+                            "max_traveltime": max_traveltime,
+                            "sensitivity": 300000,
+                        }
+                    ],
+                },
+            },
+            {
+                "type": "closest_average",
+                "params": {
+                    "opportunities": [
+                        {
+                            "opportunity_layer_project_id": point_layer_project_id,
+                            "max_traveltime": max_traveltime,
+                            "number_of_destinations": 3,
+                        }
+                    ],
+                },
+            },
+            {
+                "type": "connectivity",
+                "params": {
+                    "reference_area_layer_project_id": polygon_layer_project_id,
+                    "max_traveltime": max_traveltime,
+                },
+            },
+        ],
+    }
+
+    # Call endpoint
+    endpoint_type = (
+        "active-mobility"
+        if type(routing_type) == ActiveRoutingHeatmapType
+        else "motorized-mobility"
+    )
+    response = await client.post(
+        f"{settings.API_V2_STR}/{endpoint_type}/heatmap-batch?project_id={project_id}",
+        json=params,
+    )
+    assert response.status_code == 201
+
+    # Check if job is finished
+    job = await check_job_status(client, response.json()["job_id"])
+    assert job["status_simple"] == "finished"
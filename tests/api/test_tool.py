@@ -198,6 +198,22 @@ async def test_aggregate_points_h3_grid_group_by(
     )
 
 
+@pytest.mark.asyncio
+async def test_aggregate_points_h3_grid_group_by_vectorized(
+    client: AsyncClient, fixture_add_aggregate_point_layer_to_project, monkeypatch
+):
+    # Aggregate the points in memory regardless of their number
+    monkeypatch.setattr(settings, "AGGREGATE_POINT_VECTORIZED_MIN_POINTS", 0)
+    await test_aggregate(
+        client,
+        fixture_add_aggregate_point_layer_to_project,
+        "h3_grid",
+        "points",
+        "value",
+        ["category"],
+    )
+
+
 @pytest.mark.asyncio
 async def test_aggregate_polygons_polygon(
     client: AsyncClient, fixture_add_aggregate_polygon_layers_to_project
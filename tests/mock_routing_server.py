@@ -0,0 +1,65 @@
+"""Local mock of the GOAT routing and R5 endpoints.
+
+Like the real services, a request is answered with 202 while it is computed and
+with the result once it is done. Run standalone with:
+uvicorn tests.mock_routing_server:app --port 8100
+"""
+
+import asyncio
+import time
+from typing import Callable
+
+from fastapi import FastAPI, Request, Response
+
+
+class MockRoutingServer:
+    def __init__(
+        self,
+        compute_time: float = 0.2,
+        on_complete: Callable[[str], None] | None = None,
+    ):
+        """
+        :param compute_time: Seconds until a request is computed.
+        :param on_complete: Called with the layer_id of a catchment area once it is
+        computed, like the rows written into the result table.
+        """
+
+        self.compute_time = compute_time
+        self.on_complete = on_complete
+        self.completed = set()
+        self.started = {}
+        self.request_times = {}
+        self.app = FastAPI()
+        self.app.post("/active-mobility/catchment-area")(self.catchment_area)
+        self.app.post("/motorized-mobility/catchment-area")(self.catchment_area)
+        self.app.post("/api/analysis")(self.r5_analysis)
+
+    def process(self, key: str) -> bool:
+        """Start computing a request if it is new, return whether it is done."""
+
+        self.request_times.setdefault(key, []).append(time.perf_counter())
+        if key not in self.started:
+            self.started[key] = time.perf_counter()
+            asyncio.get_running_loop().call_later(self.compute_time, self.complete, key)
+        return key in self.completed
+
+    def complete(self, key: str):
+        self.completed.add(key)
+        if self.on_complete:
+            self.on_complete(key)
+
+    async def catchment_area(self, request: Request):
+        request_payload = await request.json()
+        if not self.process(request_payload["layer_id"]):
+            return Response(status_code=202)
+        return Response(status_code=201)
+
+    async def r5_analysis(self, request: Request):
+        request_payload = await request.json()
+        key = f'{request_payload["fromLat"]},{request_payload["fromLon"]}'
+        if not self.process(key):
+            return Response(status_code=202)
+        return Response(content=b"ACCESSGR", status_code=200)
+
+
+app = MockRoutingServer().app
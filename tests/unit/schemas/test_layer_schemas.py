@@ -3,7 +3,16 @@ from uuid import uuid4
 import pytest
 from pydantic import ValidationError
 
-from src.db.models.layer import DataCategory, DataLicense, Layer, LayerBase
+from src.core.config import settings
+from src.db.models.layer import (
+    DataCategory,
+    DataLicense,
+    FeatureDataType,
+    FeatureGeometryType,
+    Layer,
+    LayerBase,
+    LayerType,
+)
 from src.schemas.layer import FeatureLayerExportType, ILayerExport
 
 
@@ -150,3 +159,20 @@ def test_layer_export_invalid_crs_kml():
             file_name="test",
             crs=invalid_crs,
         )
+
+
+def test_layer_table_name_h3():
+    # Layers of H3 cells are read through the view of the user's H3 table
+    user_id = uuid4()
+    layer = Layer(
+        folder_id=uuid4(),
+        user_id=user_id,
+        name="Test Layer",
+        type=LayerType.feature,
+        feature_layer_geometry_type=FeatureGeometryType.polygon,
+    )
+    user_suffix = str(user_id).replace("-", "")
+    assert layer.table_name == f"{settings.USER_DATA_SCHEMA}.polygon_{user_suffix}"
+
+    layer.data_type = FeatureDataType.h3
+    assert layer.table_name == f"{settings.USER_DATA_SCHEMA}.h3_polygon_{user_suffix}"
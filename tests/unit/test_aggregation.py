@@ -0,0 +1,104 @@
+import h3
+import numpy as np
+import pytest
+
+from src.aggregation import H3PointAggregation
+
+RESOLUTION = 8
+
+
+def random_points(n: int, seed: int = 0) -> dict:
+    rng = np.random.default_rng(seed)
+    return {
+        "lat": rng.uniform(48.1, 48.2, n),
+        "lng": rng.uniform(11.5, 11.6, n),
+        "valid": rng.random(n) > 0.2,
+        "values": rng.integers(-100, 100, n),
+        "group_id": rng.integers(0, 3, n),
+    }
+
+
+def reference_aggregation(points: dict, operation: str, by_group: bool) -> dict:
+    """Statistics like the SQL of the point aggregation, NULL values are ignored."""
+
+    values_by_key = {}
+    for lat, lng, valid, value, group_id in zip(*points.values(), strict=True):
+        key = (h3.geo_to_h3(lat, lng, RESOLUTION), group_id if by_group else 0)
+        values_by_key.setdefault(key, [])
+        if valid:
+            values_by_key[key].append(int(value))
+
+    functions = {"count": len, "sum": sum, "min": min, "max": max}
+    return {
+        key: functions[operation](values) if values or operation == "count" else None
+        for key, values in values_by_key.items()
+    }
+
+
+def to_dict(h3_index, group_id, stats, count, operation) -> dict:
+    return {
+        (h3.h3_to_string(int(cell)), int(group)): (
+            int(value) if cnt > 0 or operation == "count" else None
+        )
+        for cell, group, value, cnt in zip(
+            h3_index, group_id, stats, count, strict=True
+        )
+    }
+
+
+@pytest.mark.parametrize("operation", ["count", "sum", "min", "max"])
+def test_h3_point_aggregation(operation):
+    points = random_points(2000)
+    aggregation = H3PointAggregation(RESOLUTION, operation, np.int64, n_groups=3)
+    # Points are added in batches
+    for batch in (slice(0, 700), slice(700, 1500), slice(1500, None)):
+        aggregation.add(
+            lat=points["lat"][batch],
+            lng=points["lng"][batch],
+            valid=points["valid"][batch],
+            values=None if operation == "count" else points["values"][batch],
+            group_id=points["group_id"][batch],
+        )
+    result = aggregation.result()
+
+    assert to_dict(
+        result["grouped_h3_index"],
+        result["group_id"],
+        result["grouped_stats"],
+        result["grouped_count"],
+        operation,
+    ) == reference_aggregation(points, operation, by_group=True)
+    assert to_dict(
+        result["h3_index"],
+        np.zeros(len(result["h3_index"])),
+        result["stats"],
+        result["count"],
+        operation,
+    ) == reference_aggregation(points, operation, by_group=False)
+
+
+def test_h3_point_aggregation_null_values():
+    # Cells without values are kept, without a statistic
+    aggregation = H3PointAggregation(RESOLUTION, "max", np.float64)
+    aggregation.add(
+        lat=np.array([48.1, 48.1]),
+        lng=np.array([11.5, 11.5]),
+        valid=np.array([False, False]),
+        values=np.array([0.0, 0.0]),
+    )
+    result = aggregation.result()
+    assert result["h3_index"].tolist() == [
+        int(h3.geo_to_h3(48.1, 11.5, RESOLUTION), 16)
+    ]
+    assert result["count"].tolist() == [0]
+
+
+def test_h3_point_aggregation_empty():
+    result = H3PointAggregation(RESOLUTION, "sum", np.float64).result()
+    assert len(result["h3_index"]) == 0
+    assert len(result["grouped_h3_index"]) == 0
+
+
+def test_h3_point_aggregation_unsupported_operation():
+    with pytest.raises(ValueError):
+        H3PointAggregation(RESOLUTION, "median", np.float64)
@@ -0,0 +1,64 @@
+from src.core.catchment_area_cache import CatchmentAreaResultCache
+
+
+def request_payload(
+    latitude: list = [48.13743, 48.15], longitude: list = [11.57549, 11.6], **kwargs
+) -> dict:
+    return {
+        "starting_points": {"latitude": latitude, "longitude": longitude},
+        "routing_type": "walking",
+        "travel_cost": {"max_traveltime": 15, "steps": 3, "speed": 5},
+        "catchment_area_type": "polygon",
+        "polygon_difference": True,
+        "result_table": "user_data.polygon_744e4fd1685c495c8b02efebce875359",
+        "layer_id": "a9ab8bdb-4a9c-4f0d-9b0e-4e8f1c0d1e2f",
+    } | kwargs
+
+
+def test_get_key():
+    cache = CatchmentAreaResultCache(ttl=60)
+    key = cache.get_key(request_payload())
+
+    # Starting points within the same H3 cell share a result, in any order
+    assert (
+        cache.get_key(
+            request_payload(latitude=[48.15, 48.13744], longitude=[11.6, 11.57548])
+        )
+        == key
+    )
+    assert cache.get_key(request_payload(latitude=[48.14, 48.15])) != key
+    assert cache.get_key(request_payload(routing_type="bicycle")) != key
+    assert (
+        cache.get_key(
+            request_payload(travel_cost={"max_traveltime": 20, "steps": 4, "speed": 5})
+        )
+        != key
+    )
+
+    # Key is independent of where the result is written to
+    assert (
+        cache.get_key(
+            request_payload(
+                result_table="temporal.temp_1",
+                layer_id="0c9d6a3e-5b8f-4e2a-9c1d-7f3b2a1e4d5c",
+            )
+        )
+        == key
+    )
+
+    # Scenarios and custom street networks are never cached
+    assert cache.get_key(request_payload(scenario_id="e7dcaae4")) is None
+    assert (
+        cache.get_key(
+            request_payload(
+                street_network={
+                    "edge_layer_project_id": 1,
+                    "node_layer_project_id": 2,
+                }
+            )
+        )
+        is None
+    )
+
+    # Disabled cache
+    assert CatchmentAreaResultCache(ttl=0).get_key(request_payload()) is None
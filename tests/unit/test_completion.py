@@ -0,0 +1,111 @@
+import asyncio
+import time
+
+import pytest
+from httpx import ASGITransport, AsyncClient
+
+from src.core.completion import (
+    CompletionListener,
+    get_backoff_delay,
+    request_until_complete,
+)
+from src.core.config import settings
+from tests.mock_routing_server import MockRoutingServer
+
+
+def mock_client(server: MockRoutingServer) -> AsyncClient:
+    return AsyncClient(
+        transport=ASGITransport(app=server.app), base_url="http://routing"
+    )
+
+
+def test_get_backoff_delay():
+    for attempt in range(10):
+        delay = get_backoff_delay(attempt)
+        assert settings.CRUD_RETRY_MIN_INTERVAL <= delay
+        assert delay <= min(
+            settings.CRUD_RETRY_INTERVAL, settings.CRUD_RETRY_MIN_INTERVAL * 2**attempt
+        )
+
+
+@pytest.mark.asyncio
+async def test_request_until_complete():
+    server = MockRoutingServer(compute_time=0.3)
+    async with mock_client(server) as client:
+        start = time.perf_counter()
+        response = await request_until_complete(
+            lambda: client.post(
+                "/api/analysis", json={"fromLat": 48.1, "fromLon": 11.5}
+            )
+        )
+        duration = time.perf_counter() - start
+
+    assert response.status_code == 200
+    assert response.content == b"ACCESSGR"
+    # Finished shortly after the computation instead of the max interval
+    assert duration < settings.CRUD_RETRY_INTERVAL / 2
+    assert len(server.request_times["48.1,11.5"]) < 10
+
+
+@pytest.mark.asyncio
+async def test_request_until_complete_notified(monkeypatch):
+    listener = CompletionListener("user_data_insert")
+
+    async def connect():
+        pass
+
+    monkeypatch.setattr(listener, "connect", connect)
+    # Backoff alone would wait the max interval after the computation
+    monkeypatch.setattr(settings, "CRUD_RETRY_MIN_INTERVAL", 2.0)
+    server = MockRoutingServer(
+        compute_time=0.3,
+        on_complete=lambda key: listener.notify(None, 0, "user_data_insert", key),
+    )
+    async with mock_client(server) as client:
+        start = time.perf_counter()
+        async with listener.listen("layer") as completed:
+            response = await request_until_complete(
+                lambda: client.post(
+                    "/active-mobility/catchment-area", json={"layer_id": "layer"}
+                ),
+                completed=completed,
+            )
+        duration = time.perf_counter() - start
+
+    assert response.status_code == 201
+    assert duration < 1
+    assert len(server.request_times["layer"]) == 2
+    assert listener.waiters == {}
+
+
+@pytest.mark.asyncio
+async def test_request_until_complete_timeout(monkeypatch):
+    monkeypatch.setattr(settings, "CRUD_RETRY_TIMEOUT", 0.3)
+    server = MockRoutingServer(compute_time=10)
+    async with mock_client(server) as client:
+        start = time.perf_counter()
+        response = await request_until_complete(
+            lambda: client.post(
+                "/motorized-mobility/catchment-area", json={"layer_id": "layer"}
+            )
+        )
+        duration = time.perf_counter() - start
+
+    assert response.status_code == 202
+    assert duration < 0.5
+
+
+@pytest.mark.asyncio
+async def test_listen_without_database(monkeypatch):
+    listener = CompletionListener("user_data_insert")
+
+    async def connect():
+        raise OSError("Connection refused")
+
+    monkeypatch.setattr(listener, "connect", connect)
+    async with listener.listen("layer") as completed:
+        listener.notify(None, 0, "user_data_insert", "layer")
+        await asyncio.sleep(0)
+        # Never done, so callers fall back to polling
+        assert not completed.done()
+    assert listener.waiters == {}
@@ -0,0 +1,22 @@
+import pytest
+import shapely
+
+from src.core.geofence import GeofenceCache
+
+
+@pytest.mark.asyncio
+async def test_count_outside():
+    cache = GeofenceCache()
+    # Loaded tables aren't queried again
+    cache.geofences["basic.geofence_active_mobility"] = shapely.union_all(
+        shapely.box([10, 12], [47, 47], [12, 14], [49, 49])
+    )
+
+    count = await cache.count_outside(
+        async_session=None,
+        geofence_table="basic.geofence_active_mobility",
+        lats=[48.1, 48.1, 48.1, 52.5, 47.0],
+        lons=[11.5, 12.0, 13.4, 13.4, 10.5],
+    )
+    # Points on the boundary are within the geofence, like with ST_Intersects
+    assert count == 1
@@ -0,0 +1,316 @@
+import math
+from uuid import uuid4
+
+import numpy as np
+import pytest
+
+from src.heatmap import (
+    build_impedance_table,
+    build_opportunity_csr,
+    build_traveltime_matrix_csr,
+    compute_closest_average_heatmap,
+    compute_connectivity_heatmap,
+    compute_gravity_heatmap,
+)
+
+MAX_SENSITIVITY = 1000000
+
+
+def synthetic_matrix(rng, n_cells=200, max_traveltime=30):
+    """Matrix rows of random origins, each reaching disjoint sets of destinations
+    at increasing travel times."""
+    rows = []
+    for orig_id in rng.choice(n_cells, size=n_cells // 2, replace=False):
+        dests = rng.permutation(n_cells)[: rng.integers(1, n_cells)]
+        traveltimes = rng.integers(1, max_traveltime + 1, size=len(dests))
+        for traveltime in np.unique(traveltimes):
+            rows.append(
+                (
+                    int(orig_id),
+                    int(traveltime),
+                    dests[traveltimes == traveltime].tolist(),
+                )
+            )
+    return rows
+
+
+def synthetic_opportunities(rng, n_cells=200, n_opportunities=80):
+    """Opportunities with one or more cells, from two layers with different max
+    travel times and sensitivities."""
+    opportunities = []
+    for i in range(n_opportunities):
+        max_traveltime, sensitivity = (15, 150000) if i % 2 else (30, 300000)
+        id, potential = uuid4(), float(rng.integers(1, 5))
+        for h3_index in rng.choice(n_cells, size=rng.integers(1, 4), replace=False):
+            opportunities.append(
+                (id, int(h3_index), max_traveltime, sensitivity, potential)
+            )
+    return opportunities
+
+
+def sql_impedance(impedance_function, traveltime, sensitivity, max_traveltime):
+    """Impedance formulas of the gravity heatmap, evaluated for a single row."""
+    if impedance_function == "gaussian":
+        return math.e ** (
+            (((traveltime / max_traveltime) ** 2) * -1)
+            / (sensitivity / MAX_SENSITIVITY)
+        )
+    elif impedance_function == "linear":
+        return 1 - (traveltime / max_traveltime)
+    elif impedance_function == "exponential":
+        return math.e ** (
+            ((sensitivity / MAX_SENSITIVITY) * -1) * (traveltime / max_traveltime)
+        )
+    elif impedance_function == "power":
+        return (traveltime / max_traveltime) ** ((sensitivity / MAX_SENSITIVITY) * -1)
+
+
+def sql_gravity(matrix_rows, opportunities, impedance_function, max_traveltime):
+    """Same steps as the query of CRUDHeatmapGravity.build_query."""
+    min_traveltime = {}
+    for id, h3_index, opp_max_traveltime, sensitivity, potential in opportunities:
+        for orig_id, traveltime, dest_ids in matrix_rows:
+            if orig_id != h3_index or traveltime > opp_max_traveltime:
+                continue
+            for dest_id in dest_ids:
+                key = (id, dest_id, sensitivity, potential)
+                min_traveltime[key] = min(
+                    min_traveltime.get(key, traveltime), traveltime
+                )
+
+    accessibility = {}
+    for (_id, dest_id, sensitivity, potential), traveltime in min_traveltime.items():
+        accessibility[dest_id] = (
+            accessibility.get(dest_id, 0.0)
+            + sql_impedance(
+                impedance_function, float(traveltime), sensitivity, max_traveltime
+            )
+            * potential
+        )
+    return accessibility
+
+
+def numba_gravity(matrix_rows, opportunities, impedance_function, max_traveltime):
+    matrix = build_traveltime_matrix_csr(*zip(*matrix_rows, strict=True))
+    id, h3_index, opportunity_max_traveltime, sensitivity, potential = zip(
+        *opportunities, strict=True
+    )
+    opportunity_csr = build_opportunity_csr(
+        id,
+        h3_index,
+        opportunity_max_traveltime,
+        matrix_orig_id=matrix["orig_id"],
+        sensitivity=sensitivity,
+        potential=potential,
+    )
+    heatmap = compute_gravity_heatmap(
+        matrix, opportunity_csr, impedance_function, max_traveltime, MAX_SENSITIVITY
+    )
+    return dict(
+        zip(
+            heatmap["h3_index"].tolist(),
+            heatmap["accessibility"].tolist(),
+            strict=True,
+        )
+    )
+
+
+def test_build_traveltime_matrix_csr():
+    rows = [(7, 3, [20, 10]), (5, 1, [10]), (7, 1, [30])]
+    matrix = build_traveltime_matrix_csr(*zip(*rows, strict=True))
+
+    np.testing.assert_array_equal(matrix["orig_id"], [5, 7])
+    np.testing.assert_array_equal(matrix["offsets"], [0, 1, 4])
+    np.testing.assert_array_equal(matrix["dest_id"], [10, 20, 30])
+    np.testing.assert_array_equal(
+        matrix["dest_id"][matrix["dest_index"]], [10, 20, 10, 30]
+    )
+    np.testing.assert_array_equal(matrix["traveltime"], [1, 3, 3, 1])
+
+
+@pytest.mark.parametrize(
+    "impedance_function", ["gaussian", "linear", "exponential", "power"]
+)
+def test_build_impedance_table(impedance_function):
+    sensitivities = np.array([50000.0, 150000.0, 300000.0])
+    weights = build_impedance_table(
+        impedance_function, sensitivities, 30, MAX_SENSITIVITY
+    )
+
+    assert weights.shape == (3, 31)
+    for i, sensitivity in enumerate(sensitivities):
+        for traveltime in range(1, 31):
+            assert weights[i, traveltime] == pytest.approx(
+                sql_impedance(impedance_function, float(traveltime), sensitivity, 30.0),
+                rel=1e-12,
+            )
+
+
+@pytest.mark.parametrize(
+    "impedance_function", ["gaussian", "linear", "exponential", "power"]
+)
+def test_gravity_matches_sql(impedance_function):
+    rng = np.random.default_rng(0)
+    matrix_rows = synthetic_matrix(rng)
+    opportunities = synthetic_opportunities(rng)
+
+    expected = sql_gravity(matrix_rows, opportunities, impedance_function, 30.0)
+    result = numba_gravity(matrix_rows, opportunities, impedance_function, 30)
+
+    assert result.keys() == expected.keys()
+    for dest_id, accessibility in expected.items():
+        assert result[dest_id] == pytest.approx(accessibility, rel=1e-9)
+
+
+def test_gravity_opportunity_outside_matrix():
+    matrix_rows = [(1, 5, [1, 2])]
+    opportunities = [(uuid4(), 3, 30, 100000, 1.0), (uuid4(), 1, 4, 100000, 1.0)]
+
+    # Neither the cell without matrix rows nor the one out of reach contribute
+    assert numba_gravity(matrix_rows, opportunities, "linear", 30) == {}
+
+
+def test_gravity_counts_reaching_opportunities():
+    matrix_rows = [(1, 2, [10, 20]), (2, 1, [10]), (3, 1, [10])]
+    # The first opportunity reaches destination 10 from both of its cells
+    opportunities = [(uuid4(), 1, 30, 100000, 1.0), (uuid4(), 3, 30, 100000, 1.0)]
+    opportunities.insert(1, (opportunities[0][0], 2, 30, 100000, 1.0))
+
+    matrix = build_traveltime_matrix_csr(*zip(*matrix_rows, strict=True))
+    id, h3_index, max_traveltime, sensitivity, potential = zip(
+        *opportunities, strict=True
+    )
+    opportunity_csr = build_opportunity_csr(
+        id,
+        h3_index,
+        max_traveltime,
+        matrix_orig_id=matrix["orig_id"],
+        sensitivity=sensitivity,
+        potential=potential,
+    )
+    heatmap = compute_gravity_heatmap(
+        matrix, opportunity_csr, "linear", 30, MAX_SENSITIVITY
+    )
+
+    np.testing.assert_array_equal(heatmap["h3_index"], [10, 20])
+    np.testing.assert_array_equal(heatmap["opportunity_count"], [2, 1])
+
+
+def sql_closest_average(matrix_rows, opportunities):
+    """Same steps as the query of CRUDHeatmapClosestAverage.build_query."""
+    min_traveltime = {}
+    for id, h3_index, max_traveltime, num_destinations in opportunities:
+        for orig_id, traveltime, dest_ids in matrix_rows:
+            if orig_id != h3_index or traveltime > max_traveltime:
+                continue
+            for dest_id in dest_ids:
+                key = (id, dest_id, num_destinations)
+                min_traveltime[key] = min(
+                    min_traveltime.get(key, traveltime), traveltime
+                )
+
+    grouped = {}
+    for (_id, dest_id, num_destinations), traveltime in min_traveltime.items():
+        grouped.setdefault((dest_id, num_destinations), []).append(traveltime)
+    closest = {}
+    for (dest_id, num_destinations), traveltimes in grouped.items():
+        closest.setdefault(dest_id, []).extend(
+            sorted(traveltimes)[: max(num_destinations, 0)]
+        )
+    return {
+        dest_id: sum(traveltimes) / len(traveltimes)
+        for dest_id, traveltimes in closest.items()
+        if traveltimes
+    }
+
+
+def numba_closest_average(matrix_rows, opportunities):
+    matrix = build_traveltime_matrix_csr(*zip(*matrix_rows, strict=True))
+    id, h3_index, max_traveltime, num_destinations = zip(*opportunities, strict=True)
+    opportunity_csr = build_opportunity_csr(
+        id,
+        h3_index,
+        max_traveltime,
+        matrix_orig_id=matrix["orig_id"],
+        num_destinations=num_destinations,
+    )
+    heatmap = compute_closest_average_heatmap(matrix, opportunity_csr)
+    return dict(
+        zip(
+            heatmap["h3_index"].tolist(),
+            heatmap["accessibility"].tolist(),
+            strict=True,
+        )
+    )
+
+
+@pytest.mark.parametrize("num_destinations", [1, 3, 10, 100])
+def test_closest_average_matches_sql(num_destinations):
+    rng = np.random.default_rng(0)
+    matrix_rows = synthetic_matrix(rng)
+    # Two layers, the second keeping one destination more
+    opportunities = [
+        (id, h3_index, max_traveltime, num_destinations + (sensitivity == 150000))
+        for id, h3_index, max_traveltime, sensitivity, _potential in (
+            synthetic_opportunities(rng)
+        )
+    ]
+
+    expected = sql_closest_average(matrix_rows, opportunities)
+    result = numba_closest_average(matrix_rows, opportunities)
+
+    assert result.keys() == expected.keys()
+    for dest_id, accessibility in expected.items():
+        assert result[dest_id] == pytest.approx(accessibility, rel=1e-12)
+
+
+def test_closest_average_keeps_closest():
+    matrix_rows = [(1, 5, [10]), (2, 3, [10]), (3, 1, [10, 20]), (4, 2, [10])]
+    opportunities = [
+        (uuid4(), 1, 30, 2),
+        (uuid4(), 2, 30, 2),
+        (uuid4(), 3, 30, 2),
+        # Reaches the destination within its max travel time from one cell only
+        (uuid4(), 4, 1, 2),
+    ]
+    opportunities.append((opportunities[-1][0], 1, 30, 2))
+
+    assert numba_closest_average(matrix_rows, opportunities) == {
+        10: (1 + 3) / 2,
+        20: 1.0,
+    }
+
+
+def sql_connectivity(matrix_rows, reference_area, max_traveltime, cell_area):
+    """Same steps as the query of CRUDHeatmapConnectivity.build_query."""
+    accessibility = {}
+    for h3_index in reference_area:
+        for orig_id, traveltime, dest_ids in matrix_rows:
+            if orig_id == h3_index and traveltime <= max_traveltime:
+                accessibility[orig_id] = (
+                    accessibility.get(orig_id, 0.0) + len(dest_ids) * cell_area
+                )
+    return accessibility
+
+
+@pytest.mark.parametrize("max_traveltime", [1, 10, 30])
+def test_connectivity_matches_sql(max_traveltime):
+    rng = np.random.default_rng(0)
+    matrix_rows = synthetic_matrix(rng)
+    # Cells with and without matrix rows, some listed twice
+    reference_area = rng.choice(200, size=120).tolist()
+
+    expected = sql_connectivity(matrix_rows, reference_area, max_traveltime, 2.5)
+    matrix = build_traveltime_matrix_csr(*zip(*matrix_rows, strict=True))
+    heatmap = compute_connectivity_heatmap(matrix, reference_area, max_traveltime, 2.5)
+    result = dict(
+        zip(
+            heatmap["h3_index"].tolist(),
+            heatmap["accessibility"].tolist(),
+            strict=True,
+        )
+    )
+
+    assert result.keys() == expected.keys()
+    for h3_index, accessibility in expected.items():
+        assert result[h3_index] == pytest.approx(accessibility, rel=1e-12)
@@ -0,0 +1,108 @@
+from datetime import datetime, timezone
+
+import pytest
+
+from src.core.heatmap_cache import HeatmapResultCache
+
+
+def heatmap_params(**kwargs) -> dict:
+    return {
+        "routing_type": "walking",
+        "impedance_function": "gaussian",
+        "engine": "sql",
+        "opportunities": [
+            {
+                "opportunity_layer_project_id": 1,
+                "max_traveltime": 15,
+                "sensitivity": 150000,
+                "destination_potential_column": None,
+            }
+        ],
+        "scenario_id": None,
+        "opportunity_geofence_layer_project_id": None,
+        "tool_type": "heatmap_gravity_active_mobility",
+    } | kwargs
+
+
+def heatmap_layers(
+    last_data_updated_at: datetime = datetime(2026, 10, 1, tzinfo=timezone.utc),
+    where_query: str = "layer_id = 'e7dcaae4-31a5-4b7c-a2a7-0b7a4b2d4b4e'",
+    filtered_count: int = 100,
+) -> list:
+    return [
+        {
+            "layer_id": "e7dcaae4-31a5-4b7c-a2a7-0b7a4b2d4b4e",
+            "where_query": where_query,
+            "last_data_updated_at": last_data_updated_at,
+            "feature_cnt": {"total_count": 120, "filtered_count": filtered_count},
+        }
+    ]
+
+
+def test_get_key():
+    cache = HeatmapResultCache(ttl=60)
+    key = cache.get_key(heatmap_params(), heatmap_layers())
+
+    # Key is independent of the key order and the engine
+    assert (
+        cache.get_key(dict(reversed(heatmap_params().items())), heatmap_layers()) == key
+    )
+    assert cache.get_key(heatmap_params(engine="numba"), heatmap_layers()) == key
+
+    assert (
+        cache.get_key(heatmap_params(routing_type="bicycle"), heatmap_layers()) != key
+    )
+    assert (
+        cache.get_key(heatmap_params(impedance_function="linear"), heatmap_layers())
+        != key
+    )
+    assert (
+        cache.get_key(
+            heatmap_params(tool_type="heatmap_closest_average_active_mobility"),
+            heatmap_layers(),
+        )
+        != key
+    )
+
+
+def test_get_key_input_data():
+    cache = HeatmapResultCache(ttl=60)
+    key = cache.get_key(heatmap_params(), heatmap_layers())
+
+    # Updated layer data and another layer filter invalidate the result
+    assert (
+        cache.get_key(
+            heatmap_params(),
+            heatmap_layers(datetime(2026, 10, 2, tzinfo=timezone.utc)),
+        )
+        != key
+    )
+    assert (
+        cache.get_key(
+            heatmap_params(), heatmap_layers(where_query="layer_id = 'other'")
+        )
+        != key
+    )
+
+    # So do deleted features, which don't change the last data update
+    assert cache.get_key(heatmap_params(), heatmap_layers(filtered_count=99)) != key
+
+    # So do edited features of the scenario
+    scenario_params = heatmap_params(scenario_id="e7dcaae4")
+    scenario_key = cache.get_key(scenario_params, heatmap_layers(), "3_2026-10-01")
+    assert scenario_key != key
+    assert (
+        cache.get_key(scenario_params, heatmap_layers(), "4_2026-10-02") != scenario_key
+    )
+
+
+def test_get_key_disabled():
+    assert HeatmapResultCache(ttl=0).get_key(heatmap_params(), heatmap_layers()) is None
+
+
+def test_stats():
+    cache = HeatmapResultCache(ttl=60)
+    assert cache.stats == {"hits": 0, "misses": 0, "hit_ratio": None}
+
+    cache.hits, cache.misses = 3, 1
+    assert cache.stats["hit_ratio"] == pytest.approx(0.75)
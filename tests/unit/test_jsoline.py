@@ -0,0 +1,284 @@
+import json
+
+import numpy as np
+import pytest
+import shapely
+from numba import njit, prange
+from shapely.geometry import shape
+
+from src.jsoline import (
+    MIN_FRACTION,
+    assign_holes,
+    calculate_jsolines,
+    get_band_index,
+    get_cell_index,
+    get_contour,
+    get_max_ring_coords,
+    get_pixel_size,
+    jsolines,
+    pointinpolygon,
+    simplify_jsolines,
+    trace_isoline_rings,
+)
+from src.utils import pixel_to_longitude, pixel_x_to_web_mercator_x
+
+
+def random_surface(width: int, height: int, seed: int) -> np.ndarray:
+    """Radial travel time surface with noise and unreachable patches."""
+    rng = np.random.default_rng(seed)
+    yy, xx = np.mgrid[0:height, 0:width]
+    surface = np.hypot(xx - width / 2, yy - height / 2) / max(width, height) * 120
+    surface += rng.normal(0, 3, size=surface.shape)
+    for _ in range(10):
+        x, y = rng.integers(0, width), rng.integers(0, height)
+        surface[np.hypot(xx - x, yy - y) < rng.integers(2, 6)] += 1000
+    return np.clip(surface, 0, 65535).astype(np.uint16).ravel()
+
+
+@njit(parallel=True)
+def assign_holes_brute_force(coords, ring_offsets, ring_is_shell, cutoff_offsets):
+    """Reference for assign_holes, testing every hole against every shell of its
+    cutoff."""
+    shell_index = np.full(ring_is_shell.shape[0], -1, dtype=np.int64)
+    for k in prange(cutoff_offsets.shape[0] - 1):
+        for hole in range(cutoff_offsets[k], cutoff_offsets[k + 1]):
+            if ring_is_shell[hole] or ring_offsets[hole + 1] - ring_offsets[hole] < 3:
+                continue
+            x = coords[ring_offsets[hole], 0]
+            y = coords[ring_offsets[hole], 1]
+            containing_shell = -1
+            n_containing_shells = 0
+            for shell in range(cutoff_offsets[k], cutoff_offsets[k + 1]):
+                if ring_is_shell[shell] and pointinpolygon(
+                    x, y, coords, ring_offsets[shell], ring_offsets[shell + 1]
+                ):
+                    containing_shell = shell
+                    n_containing_shells += 1
+            if n_containing_shells == 1:
+                shell_index[hole] = containing_shell
+    return shell_index
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_band_index_matches_contour(seed):
+    width, height = 40, 30
+    surface = random_surface(width, height, seed)
+    cutoffs = np.arange(10.0, 61, 10.0)
+    band = get_band_index(surface, cutoffs)
+
+    for rank, cutoff in enumerate(cutoffs):
+        contour = get_contour(surface, width, height, cutoff)
+        for y in range(height - 1):
+            for x in range(width - 1):
+                assert contour[y * (width - 1) + x] == get_cell_index(
+                    band, width, height, x, y, rank
+                )
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_calculate_jsolines(seed):
+    width, height = 80, 60
+    surface = random_surface(width, height, seed)
+    cutoffs = np.arange(10.0, 61, 10.0)
+    geometries = calculate_jsolines(
+        surface, width, height, 1000, 2000, 9, cutoffs, True, False
+    )
+
+    assert len(geometries) == len(cutoffs)
+    for polygons in geometries:
+        for polygon in polygons:
+            for ring in polygon:
+                assert len(ring) >= 3
+                np.testing.assert_array_equal(ring[0], ring[-1])
+
+    # Order of the result follows the order of the cutoffs
+    shuffled = calculate_jsolines(
+        surface, width, height, 1000, 2000, 9, cutoffs[::-1], True, False
+    )
+    for polygons, shuffled_polygons in zip(geometries, shuffled[::-1], strict=True):
+        assert len(polygons) == len(shuffled_polygons)
+        for polygon, shuffled_polygon in zip(polygons, shuffled_polygons, strict=True):
+            for ring, shuffled_ring in zip(polygon, shuffled_polygon, strict=True):
+                np.testing.assert_array_equal(ring, shuffled_ring)
+
+
+@pytest.mark.parametrize("web_mercator", [False, True])
+def test_calculate_jsolines_matches_previous_tracer(web_mercator):
+    # Rings traced cutoff by cutoff by the implementation translated from Jsolines.js
+    with open("tests/data/jsoline/calculate_jsolines.json") as file:
+        expected = json.load(file)
+    geometries = calculate_jsolines(
+        np.array(expected["surface"], dtype=np.uint16),
+        expected["width"],
+        expected["height"],
+        expected["west"],
+        expected["north"],
+        expected["zoom"],
+        np.array(expected["cutoffs"]),
+        True,
+        web_mercator,
+    )
+
+    expected_geometries = expected["geometries"][
+        "web_mercator" if web_mercator else "wgs84"
+    ]
+    # Vertices on pixels equal to a cutoff are moved just off the pixel
+    pixel_x = pixel_x_to_web_mercator_x if web_mercator else pixel_to_longitude
+    tolerance = (
+        2
+        * MIN_FRACTION
+        * (
+            pixel_x(expected["west"] + 1, expected["zoom"])
+            - pixel_x(expected["west"], expected["zoom"])
+        )
+    )
+    assert len(geometries) == len(expected_geometries)
+    for polygons, expected_polygons in zip(
+        geometries, expected_geometries, strict=True
+    ):
+        assert len(polygons) == len(expected_polygons)
+        for polygon, expected_polygon in zip(polygons, expected_polygons, strict=True):
+            assert len(polygon) == len(expected_polygon)
+            for ring, expected_ring in zip(polygon, expected_polygon, strict=True):
+                np.testing.assert_allclose(ring, expected_ring, rtol=0, atol=tolerance)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_assign_holes_matches_brute_force(seed):
+    # Noisy surface to get fragmented catchments with many shells and holes
+    rng = np.random.default_rng(seed)
+    width, height = 120, 100
+    yy, xx = np.mgrid[0:height, 0:width]
+    surface = np.hypot(xx - width / 2, yy - height / 2) / width * 60
+    surface = surface + rng.normal(0, 8, size=surface.shape)
+    surface = surface.clip(0).astype(np.uint16).ravel()
+    cutoffs = np.arange(10.0, 61, 10.0)
+    band = get_band_index(surface, cutoffs)
+    coords, ring_offsets, ring_is_shell, cutoff_offsets = trace_isoline_rings(
+        band,
+        surface,
+        width,
+        height,
+        1000,
+        2000,
+        9,
+        cutoffs,
+        np.arange(len(cutoffs)),
+        True,
+        False,
+    )
+    shell_index = assign_holes(coords, ring_offsets, ring_is_shell, cutoff_offsets)
+
+    np.testing.assert_array_equal(
+        shell_index,
+        assign_holes_brute_force(coords, ring_offsets, ring_is_shell, cutoff_offsets),
+    )
+
+
+# Isolines of seed 26 are not nested, a saddle is resolved differently per cutoff
+@pytest.mark.parametrize("seed", [*range(5), 26])
+def test_jsolines_isobands_match_difference(seed):
+    width, height = 80, 60
+    surface = random_surface(width, height, seed)
+    cutoffs = np.arange(10.0, 61, 10.0)
+    result = jsolines(
+        surface, width, height, 1000, 2000, 9, cutoffs, return_incremental=True
+    )
+
+    # Isolines are the same as when created one by one
+    coordinates = calculate_jsolines(
+        surface, width, height, 1000, 2000, 9, cutoffs, True, False
+    )
+    full = result["full"].geometry.values
+    for geometry, polygons in zip(full, coordinates, strict=True):
+        expected = shape({"type": "MultiPolygon", "coordinates": polygons})
+        assert shapely.equals_exact(geometry, expected, 0)
+
+    # Bands cover the same area as the difference of consecutive isolines
+    rng = np.random.default_rng(seed)
+    xmin, ymin, xmax, ymax = shapely.total_bounds(full)
+    x = rng.uniform(xmin, xmax, 10000)
+    y = rng.uniform(ymin, ymax, 10000)
+    bands = result["incremental"].geometry.values
+    assert shapely.is_valid(full).all()
+    assert shapely.is_valid(bands).all()
+    for i, band in enumerate(bands):
+        expected = full[i] if i == 0 else full[i].difference(full[i - 1])
+        assert band.area == pytest.approx(expected.area, rel=1e-9)
+        np.testing.assert_array_equal(
+            shapely.contains_xy(band, x, y), shapely.contains_xy(expected, x, y)
+        )
+
+
+def test_jsolines_isobands_empty():
+    # The lower isoline covers the whole grid, so nothing is left for the band
+    width, height = 80, 60
+    surface = np.full(width * height, 5, dtype=np.uint16)
+    result = jsolines(
+        surface, width, height, 1000, 2000, 9, [10.0, 20.0], return_incremental=True
+    )
+    full = result["full"].geometry.values
+    bands = result["incremental"].geometry.values
+    assert shapely.equals(bands[0], full[0])
+    assert shapely.is_valid(bands).all()
+    assert bands[1].is_empty
+
+
+@pytest.mark.parametrize("web_mercator", [False, True])
+def test_simplify_jsolines(web_mercator):
+    # Smooth surface, where most vertices are redundant
+    width, height = 200, 150
+    yy, xx = np.mgrid[0:height, 0:width]
+    surface = (np.hypot(xx - width / 2, yy - height / 2) / width * 120).astype(
+        np.uint16
+    )
+    cutoffs = np.arange(10.0, 61, 10.0)
+    result = jsolines(
+        surface.ravel(),
+        width,
+        height,
+        69700,
+        45300,
+        9,
+        cutoffs,
+        web_mercator=web_mercator,
+    )
+    simplified = jsolines(
+        surface.ravel(),
+        width,
+        height,
+        69700,
+        45300,
+        9,
+        cutoffs,
+        web_mercator=web_mercator,
+        simplify_tolerance=0.5,
+        precision=0.01,
+    )
+    geometries = result["full"].geometry.values
+    simplified_geometries = simplified["full"].geometry.values
+    assert (
+        shapely.get_num_coordinates(simplified_geometries).sum()
+        < shapely.get_num_coordinates(geometries).sum() / 3
+    )
+
+    # Isolines move by less than a pixel
+    pixel_size = get_pixel_size(45300, height, 9, web_mercator)
+    assert (
+        shapely.hausdorff_distance(geometries, simplified_geometries).max() < pixel_size
+    )
+    assert shapely.is_valid(simplified_geometries).all()
+
+    # Coordinates are snapped to the precision grid
+    coordinates = shapely.get_coordinates(simplified_geometries) / (0.01 * pixel_size)
+    np.testing.assert_allclose(coordinates, np.round(coordinates), atol=1e-6)
+
+
+def test_simplify_jsolines_max_coords():
+    geometries = jsolines(
+        random_surface(200, 150, 0), 200, 150, 69700, 45300, 9, [60.0]
+    )["full"].geometry.values
+    assert get_max_ring_coords(geometries)[0] > 100
+
+    simplified = simplify_jsolines(geometries, 0.0, 1e-6, max_coords=100)
+    assert get_max_ring_coords(simplified)[0] <= 100
@@ -0,0 +1,95 @@
+import os
+import time
+
+import pytest
+import shapely
+
+from src.core.r5_cache import R5RegionCache, R5ResultCache
+
+
+def request_payload(lat: float = 48.13743, lon: float = 11.57549, **kwargs) -> dict:
+    return {
+        "accessModes": "WALK",
+        "transitModes": "BUS,TRAM,SUBWAY",
+        "date": "2023-11-08",
+        "fromTime": 25200,
+        "toTime": 39600,
+        "bounds": {
+            "north": lat + 0.9,
+            "south": lat - 0.9,
+            "east": lon + 1.35,
+            "west": lon - 1.35,
+        },
+        "fromLat": lat,
+        "fromLon": lon,
+        "zoom": 9,
+        "bundleId": "650d3b5a3a8c5b1a5c1c8b5d",
+    } | kwargs
+
+
+def test_get_key(tmp_path):
+    cache = R5ResultCache(str(tmp_path), max_size=1024, ttl=60)
+    key = cache.get_key(request_payload())
+
+    # Origins within the same pixel share a result
+    assert cache.get_key(request_payload(lat=48.13744, lon=11.57548)) == key
+    assert cache.get_key(request_payload(lat=48.14, lon=11.58)) != key
+    assert cache.get_key(request_payload(fromTime=28800)) != key
+
+    # Key is independent of the order of the payload
+    assert cache.get_key(dict(reversed(request_payload().items()))) == key
+
+    # Scenarios are never cached
+    assert cache.get_key(request_payload(modifications=[{"type": "add-trip"}])) is None
+    assert cache.get_key(request_payload(modifications=[])) == key
+
+    # Disabled cache
+    assert (
+        R5ResultCache(str(tmp_path), max_size=0, ttl=60).get_key(request_payload())
+        is None
+    )
+
+
+@pytest.mark.asyncio
+async def test_get_put(tmp_path):
+    cache = R5ResultCache(str(tmp_path / "r5"), max_size=1024, ttl=60)
+    assert await cache.get("a") is None
+
+    await cache.put("a", b"ACCESSGR" + bytes(10))
+    assert await cache.get("a") == b"ACCESSGR" + bytes(10)
+
+    # Expired results are removed
+    created = time.time() - 120
+    os.utime(cache.get_path("a"), (created, created))
+    assert await cache.get("a") is None
+    assert not os.path.exists(cache.get_path("a"))
+
+
+@pytest.mark.asyncio
+async def test_evict_least_recently_used(tmp_path):
+    cache = R5ResultCache(str(tmp_path), max_size=350, ttl=60)
+    for i, key in enumerate(["a", "b", "c"]):
+        await cache.put(key, bytes(100))
+        # Results were created and used in order
+        os.utime(cache.get_path(key), (time.time() - 10 + i, time.time() - 10 + i))
+
+    # Use "a", so "b" is the least recently used result
+    assert await cache.get("a") is not None
+    await cache.put("d", bytes(100))
+
+    assert await cache.get("b") is None
+    for key in ["a", "c", "d"]:
+        assert await cache.get(key) is not None
+
+
+def test_get_regions():
+    cache = R5RegionCache()
+    assert cache.get_regions(lats=[48.1], lons=[11.5]) is None
+
+    cache.geometries = shapely.box([10, 12], [47, 47], [12, 14], [49, 49])
+    cache.regions = [
+        {"r5_region_id": "a", "r5_bundle_id": "1", "r5_host": "http://r5-a"},
+        {"r5_region_id": "b", "r5_bundle_id": "2", "r5_host": "http://r5-b"},
+    ]
+    regions = cache.get_regions(lats=[48.1, 48.1, 52.5], lons=[11.5, 13.4, 13.4])
+    assert regions == [cache.regions[0], cache.regions[1], None]
@@ -0,0 +1,137 @@
+import json
+
+import h3
+import numpy as np
+import pytest
+
+from src.utils import (
+    decode_r5_grid,
+    encode_r5_grid,
+    pixel_to_latitude,
+    pixel_to_longitude,
+    surface_to_h3_cells,
+)
+
+
+def encode_r5_grid_reference(grid_data):
+    """Loop based encoder which was used before the vectorized implementation."""
+    header_bin = np.array(
+        [
+            grid_data["version"],
+            grid_data["zoom"],
+            grid_data["west"],
+            grid_data["north"],
+            grid_data["width"],
+            grid_data["height"],
+            grid_data["depth"],
+        ],
+        dtype=np.int32,
+    ).tobytes()
+    grid_size = grid_data["width"] * grid_data["height"]
+    if len(grid_data["data"]) == 0:
+        data = np.array([], dtype=np.int32)
+    else:
+        data = grid_data["data"].reshape(grid_data["depth"], grid_size)
+        reshaped_data = np.array([])
+        for i in range(grid_data["depth"]):
+            reshaped_data = np.append(reshaped_data, np.diff(data[i], prepend=0))
+        data = reshaped_data.astype(np.int32)
+    metadata = {
+        "accessibility": grid_data.get("accessibility", {}),
+        "errors": grid_data.get("errors", []),
+        "warnings": grid_data.get("warnings", []),
+        "pathSummaries": grid_data.get("pathSummaries", []),
+        "scenarioApplicationWarnings": grid_data.get("scenarioApplicationWarnings", []),
+        "scenarioApplicationInfo": grid_data.get("scenarioApplicationInfo", []),
+    }
+    return b"".join(
+        [b"ACCESSGR", header_bin, data.tobytes(), json.dumps(metadata).encode("utf-8")]
+    )
+
+
+def decode_r5_grid_reference(grid_data_buffer):
+    """Loop based decoder which was used before the vectorized implementation."""
+    header_raw = np.frombuffer(grid_data_buffer, count=7, offset=8, dtype=np.int32)
+    width, height, depth = header_raw[4], header_raw[5], header_raw[6]
+    data = np.frombuffer(
+        grid_data_buffer, offset=36, count=width * height * depth, dtype=np.int32
+    ).reshape(depth, width * height)
+    reshaped_data = np.array([], dtype=np.int32)
+    for i in range(depth):
+        reshaped_data = np.append(reshaped_data, data[i].cumsum())
+    return reshaped_data
+
+
+def random_grid(seed: int) -> dict:
+    rng = np.random.default_rng(seed)
+    width = int(rng.integers(1, 120))
+    height = int(rng.integers(1, 120))
+    depth = int(rng.integers(1, 6))
+    data = rng.integers(0, 2**16, size=width * height * depth, dtype=np.int64)
+    # Mimic unreachable pixels returned by R5
+    data[rng.random(data.size) < 0.2] = 2147483647
+    return {
+        "version": 0,
+        "zoom": int(rng.integers(1, 15)),
+        "west": int(rng.integers(0, 2**20)),
+        "north": int(rng.integers(0, 2**20)),
+        "width": width,
+        "height": height,
+        "depth": depth,
+        "data": data,
+        "accessibility": {"seed": seed},
+    }
+
+
+@pytest.mark.parametrize("seed", range(50))
+def test_encode_r5_grid_matches_reference(seed):
+    grid = random_grid(seed)
+    assert encode_r5_grid(grid) == encode_r5_grid_reference(grid)
+
+
+@pytest.mark.parametrize("seed", range(50))
+def test_decode_r5_grid_matches_reference(seed):
+    buffer = encode_r5_grid_reference(random_grid(seed))
+    decoded = decode_r5_grid(buffer)
+    expected = decode_r5_grid_reference(buffer)
+    assert decoded["data"].dtype == expected.dtype
+    np.testing.assert_array_equal(decoded["data"], expected)
+
+
+@pytest.mark.parametrize("seed", range(50))
+def test_r5_grid_round_trip(seed):
+    grid = random_grid(seed)
+    buffer = encode_r5_grid(grid)
+    decoded = decode_r5_grid(buffer)
+    for key in ["zoom", "west", "north", "width", "height", "depth", "version"]:
+        assert decoded[key] == grid[key]
+    assert decoded["accessibility"] == grid["accessibility"]
+    np.testing.assert_array_equal(decoded["data"], grid["data"])
+    assert encode_r5_grid(decoded) == buffer
+
+
+def test_decode_r5_grid_invalid_type():
+    buffer = encode_r5_grid(random_grid(0))
+    with pytest.raises(ValueError):
+        decode_r5_grid(b"NOTAGRID" + buffer[8:])
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_surface_to_h3_cells(seed):
+    rng = np.random.default_rng(seed)
+    width, height, west, north, zoom = 60, 50, 68000, 44000, 9
+    surface = rng.integers(0, 120, size=width * height).astype(np.uint16)
+    surface[rng.random(surface.size) < 0.3] = 65535
+    cells = surface_to_h3_cells(surface, width, west, north, zoom, 60, 9)
+
+    expected = {}
+    for i, value in enumerate(surface):
+        if value > 60:
+            continue
+        cell = h3.geo_to_h3(
+            pixel_to_latitude(north + i // width + 0.5, zoom),
+            pixel_to_longitude(west + i % width + 0.5, zoom),
+            9,
+        )
+        expected[cell] = min(expected.get(cell, value), value)
+    assert dict(zip(cells["h3_index"], cells["value"], strict=True)) == expected
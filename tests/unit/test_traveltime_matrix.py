@@ -0,0 +1,181 @@
+import os
+
+import numpy as np
+import pytest
+
+from src.core.traveltime_matrix import TravelTimeMatrixShards, build_shard
+from src.heatmap import build_traveltime_matrix_csr
+
+MATRIX_TABLE = "basic.traveltime_matrix_walking"
+
+
+def synthetic_matrix_rows(rng, h3_3, n_origins=40, n_cells=500, max_traveltime=30):
+    """Matrix rows of one h3_3 cell, sorted by origin and travel time."""
+    rows = []
+    for orig_id in np.sort(rng.choice(n_cells, size=n_origins, replace=False)):
+        for traveltime in np.sort(rng.choice(max_traveltime, size=5, replace=False)):
+            dest_id = rng.choice(n_cells, size=rng.integers(1, 20), replace=False)
+            rows.append((h3_3 * n_cells + int(orig_id), int(traveltime), dest_id))
+    return rows
+
+
+@pytest.fixture
+def shards(tmp_path):
+    return TravelTimeMatrixShards(shard_dir=str(tmp_path), max_open_shards=2)
+
+
+def test_write_and_read_shard(shards):
+    rows = [(7, 1, [30]), (7, 3, [20, 10]), (9, 2, [10])]
+    shards.write_shard(MATRIX_TABLE, 5, build_shard(*zip(*rows, strict=True)))
+    shard = shards.get(MATRIX_TABLE, 5)
+
+    assert isinstance(shard["dest_id"], np.memmap)
+    np.testing.assert_array_equal(shard["orig_id"], [7, 9])
+    np.testing.assert_array_equal(shard["offsets"], [0, 3, 4])
+    np.testing.assert_array_equal(shard["dest_id"], [30, 20, 10, 10])
+    np.testing.assert_array_equal(shard["traveltime"], [1, 3, 3, 2])
+    assert shard["traveltime"].dtype == np.uint8
+    assert shards.get(MATRIX_TABLE, 6) is None
+
+
+def test_build_shard_traveltime_overflow():
+    with pytest.raises(ValueError):
+        build_shard([1], [300], [[2]])
+
+
+def test_open_shards_lru(shards):
+    for h3_3 in range(3):
+        shards.write_shard(MATRIX_TABLE, h3_3, build_shard([1], [1], [[h3_3]]))
+
+    shards.get(MATRIX_TABLE, 0)
+    shards.get(MATRIX_TABLE, 1)
+    shards.get(MATRIX_TABLE, 0)
+    shards.get(MATRIX_TABLE, 2)
+    # The least recently used shard was closed
+    assert list(shards.open_shards) == [(MATRIX_TABLE, 0), (MATRIX_TABLE, 2)]
+
+
+def test_reopen_replaced_shard(shards, tmp_path):
+    shards.write_shard(MATRIX_TABLE, 1, build_shard([1], [1], [[2]]))
+    np.testing.assert_array_equal(shards.get(MATRIX_TABLE, 1)["dest_id"], [2])
+
+    # Shards replaced or removed by a rebuild in another process are reopened
+    rebuild_shards = TravelTimeMatrixShards(shard_dir=str(tmp_path), max_open_shards=2)
+    rebuild_shards.write_shard(MATRIX_TABLE, 1, build_shard([1], [1], [[3, 4]]))
+    np.testing.assert_array_equal(shards.get(MATRIX_TABLE, 1)["dest_id"], [3, 4])
+    rebuild_shards.remove_shard(MATRIX_TABLE, 1)
+    assert shards.get(MATRIX_TABLE, 1) is None
+    assert (MATRIX_TABLE, 1) not in shards.open_shards
+
+
+def test_replace_shard_at_once(shards, tmp_path):
+    shards.write_shard(MATRIX_TABLE, 1, build_shard([1], [1], [[2]]))
+    shards.write_shard(MATRIX_TABLE, 1, build_shard([1], [1], [[3, 4]]))
+
+    # The shard is swapped by a symlink and the replaced files are removed
+    matrix_dir = shards.get_matrix_dir(MATRIX_TABLE)
+    assert os.path.islink(shards.get_shard_path(MATRIX_TABLE, 1))
+    assert len(os.listdir(matrix_dir)) == 2
+    shards.remove_shard(MATRIX_TABLE, 1)
+    assert os.listdir(matrix_dir) == []
+
+
+def test_reopen_shard_replaced_while_read(shards, tmp_path, monkeypatch):
+    shards.write_shard(MATRIX_TABLE, 1, build_shard([1], [1], [[2]]))
+    rebuild_shards = TravelTimeMatrixShards(shard_dir=str(tmp_path), max_open_shards=2)
+
+    # Replace the shard after its first array was opened
+    load = np.load
+
+    def load_and_replace(*args, **kwargs):
+        array = load(*args, **kwargs)
+        if load_and_replace.replace:
+            load_and_replace.replace = False
+            rebuild_shards.write_shard(MATRIX_TABLE, 1, build_shard([5], [1], [[3, 4]]))
+        return array
+
+    load_and_replace.replace = True
+    monkeypatch.setattr(np, "load", load_and_replace)
+    shard = shards.get(MATRIX_TABLE, 1)
+
+    # All arrays are of the new version
+    np.testing.assert_array_equal(shard["orig_id"], [5])
+    np.testing.assert_array_equal(shard["offsets"], [0, 2])
+    np.testing.assert_array_equal(shard["dest_id"], [3, 4])
+
+
+def test_load_csr_matches_rows(shards):
+    rng = np.random.default_rng(0)
+    rows = {h3_3: synthetic_matrix_rows(rng, h3_3) for h3_3 in range(3)}
+    for h3_3, shard_rows in rows.items():
+        shards.write_shard(
+            MATRIX_TABLE, h3_3, build_shard(*zip(*shard_rows, strict=True))
+        )
+
+    # Origins of two shards, some requested twice and some without rows
+    orig_id = np.array(
+        [row[0] for row in rows[0][::7]] + [row[0] for row in rows[2][::3]] + [499]
+    )
+    h3_3 = orig_id // 500
+    max_traveltime = rng.integers(1, 31, size=len(orig_id))
+    orig_id = np.append(orig_id, orig_id[0])
+    h3_3 = np.append(h3_3, h3_3[0])
+    max_traveltime = np.append(max_traveltime, 30)
+
+    matrix = shards.load_csr(MATRIX_TABLE, orig_id, h3_3, max_traveltime)
+
+    # Same as the matrix rows up to the largest max travel time of each origin
+    origin_max_traveltime = {}
+    for origin, traveltime in zip(orig_id, max_traveltime, strict=True):
+        origin_max_traveltime[origin] = max(
+            origin_max_traveltime.get(origin, 0), traveltime
+        )
+    expected_rows = [
+        row
+        for shard_rows in rows.values()
+        for row in shard_rows
+        if row[1] <= origin_max_traveltime.get(row[0], -1)
+    ]
+    expected = build_traveltime_matrix_csr(*zip(*expected_rows, strict=True))
+    np.testing.assert_array_equal(matrix["orig_id"], expected["orig_id"])
+    np.testing.assert_array_equal(matrix["offsets"], expected["offsets"])
+    np.testing.assert_array_equal(matrix["dest_id"], expected["dest_id"])
+    for i in range(len(matrix["orig_id"])):
+        entries = slice(matrix["offsets"][i], matrix["offsets"][i + 1])
+        assert sorted(
+            zip(
+                matrix["dest_id"][matrix["dest_index"][entries]],
+                matrix["traveltime"][entries],
+                strict=True,
+            )
+        ) == sorted(
+            zip(
+                expected["dest_id"][expected["dest_index"][entries]],
+                expected["traveltime"][entries],
+                strict=True,
+            )
+        )
+
+
+def test_file_checksum(shards):
+    checksum = shards.write_shard(MATRIX_TABLE, 1, build_shard([1], [1], [[2, 3]]))
+    assert shards.get_file_checksum(MATRIX_TABLE, 1) == checksum
+
+    # A corrupted file no longer matches the checksum of the manifest
+    path = f"{shards.get_shard_path(MATRIX_TABLE, 1)}/dest_id.npy"
+    with open(path, "r+b") as file:
+        file.seek(-1, 2)
+        file.write(b"\xff")
+    assert shards.get_file_checksum(MATRIX_TABLE, 1) != checksum
+
+    shards.remove_shard(MATRIX_TABLE, 1)
+    assert shards.get_file_checksum(MATRIX_TABLE, 1) is None
+
+
+def test_exists_after_complete_export(shards, tmp_path):
+    assert not shards.exists(MATRIX_TABLE)
+    shards.write_shard(MATRIX_TABLE, 1, build_shard([1], [1], [[2]]))
+    shards.write_manifest(MATRIX_TABLE, {"complete": False, "shards": {}})
+    assert not shards.exists(MATRIX_TABLE)
+    shards.write_manifest(MATRIX_TABLE, {"complete": True, "shards": {}})
+    assert shards.exists(MATRIX_TABLE)
@@ -0,0 +1,55 @@
+import h3
+import numpy as np
+import pytest
+
+from src.core.config import settings
+from src.utils import (
+    get_h3_result_column,
+    get_h3_result_value,
+    split_points_by_h3_cell,
+)
+
+
+@pytest.mark.parametrize("max_chunk_size", [1, 7, 50, 1000])
+def test_split_points_by_h3_cell(max_chunk_size):
+    rng = np.random.default_rng(0)
+    # Clusters of points around a few centers
+    centers = rng.uniform([47.5, 10.5], [48.5, 12.5], size=(5, 2))
+    points = np.concatenate(
+        [center + rng.normal(0, 0.05, size=(60, 2)) for center in centers]
+    )
+    lats, lons = points[:, 0].tolist(), points[:, 1].tolist()
+    chunks = split_points_by_h3_cell(lats, lons, max_chunk_size, 6)
+
+    # Every point is in exactly one chunk
+    np.testing.assert_array_equal(np.sort(np.concatenate(chunks)), np.arange(len(lats)))
+    assert all(0 < len(chunk) <= max_chunk_size for chunk in chunks)
+
+    # Cells are only split if they have more points than fit into a chunk
+    cells = [h3.geo_to_h3(lat, lon, 6) for lat, lon in zip(lats, lons, strict=True)]
+    chunks_per_cell = {}
+    for i, chunk in enumerate(chunks):
+        for point in chunk:
+            chunks_per_cell.setdefault(cells[point], set()).add(i)
+    for cell, cell_chunks in chunks_per_cell.items():
+        if cells.count(cell) <= max_chunk_size:
+            assert len(cell_chunks) == 1
+
+
+def test_split_points_by_h3_cell_empty():
+    assert split_points_by_h3_cell([], [], 10, 6) == []
+
+
+def test_h3_result_polygon_table(monkeypatch):
+    monkeypatch.setattr(settings, "H3_RESULT_TABLE", False)
+    assert get_h3_result_column() == "geom"
+    assert (
+        get_h3_result_value("dest_id")
+        == "ST_SetSRID(h3_cell_to_boundary(dest_id)::geometry, 4326)"
+    )
+
+
+def test_h3_result_h3_table(monkeypatch):
+    monkeypatch.setattr(settings, "H3_RESULT_TABLE", True)
+    assert get_h3_result_column() == "h3_index"
+    assert get_h3_result_value("dest_id") == "dest_id"
@@ -6,6 +6,7 @@ from typing import List
 from uuid import uuid4
 from uuid import UUID
 
+import h3
 from httpx import AsyncClient
 from sqlalchemy.sql import text
 from src.core.config import settings
@@ -254,3 +255,31 @@ async def check_user_data_deleted(
             {"layer_id": layer["id"]},
         )
         assert result.scalar() == 0
+
+
+async def create_synthetic_traveltime_matrix(
+    db_session, matrix_table: str, h3_resolution: int = 10, ring_size: int = 8
+):
+    """Create a travel time matrix around Munich in which the travel time between
+    two cells is their grid distance plus one, and return its cells."""
+
+    cells = sorted(h3.k_ring(h3.geo_to_h3(48.137, 11.575, h3_resolution), ring_size))
+    values = []
+    for orig_id in cells:
+        dest_ids = {}
+        for dest_id in h3.k_ring(orig_id, ring_size):
+            if dest_id in cells:
+                traveltime = h3.h3_distance(orig_id, dest_id) + 1
+                dest_ids.setdefault(traveltime, []).append(dest_id)
+        for traveltime, dest_id in dest_ids.items():
+            values.append(f"('{orig_id}', ARRAY{dest_id}::h3index[], {traveltime})")
+
+    await db_session.execute(
+        f"""
+        CREATE TABLE {matrix_table} AS
+        SELECT orig_id::h3index, dest_id, traveltime::smallint,
+            basic.to_short_h3_3(h3_cell_to_parent(orig_id::h3index, 3)::bigint) AS h3_3
+        FROM (VALUES {", ".join(values)}) matrix(orig_id, dest_id, traveltime);
+        """
+    )
+    return cells